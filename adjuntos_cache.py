@@ -0,0 +1,120 @@
+# adjuntos_cache.py
+# -- coding: utf-8 --
+# Caché en disco de adjuntos de correo, direccionada por contenido (SHA-256).
+# La clave lógica es (mail_id, att_id); varios adjuntos idénticos comparten un
+# mismo archivo. Los metadatos viven en db.attachment_cache/attachment_blobs y
+# el tamaño total se acota expulsando los blobs menos usados (LRU). Colocar un
+# blob y expulsar se hacen con el bloqueo de escritura de la base tomado
+# (db.adj_bajo_bloqueo), así varios workers no se pisan.
+
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import db
+
+DIR_ADJUNTOS = db.DBPATH.parent / "adjuntos"
+MAX_BYTES = int(os.getenv("ADJUNTOS_CACHE_MB", "1024")) * 1024 * 1024
+
+
+class CacheAdjuntos:
+    def __init__(self, directorio: Path = DIR_ADJUNTOS, max_bytes: int = MAX_BYTES):
+        self.directorio = Path(directorio)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        db.initdb()
+
+    def ruta(self, sha256: str) -> Path:
+        return self.directorio / sha256[:2] / sha256
+
+    def buscar(self, mail_id: str, att_id: str) -> Optional[Dict]:
+        """Metadatos + ruta del adjunto si está en disco; None si no."""
+        try:
+            info = db.adj_get(mail_id, att_id, time.time())
+        except Exception as e:
+            print("[ADJUNTOS] Error al leer la caché:", e)
+            info = None
+        if info is not None:
+            ruta = self.ruta(info["sha256"])
+            if ruta.exists():
+                self.hits += 1
+                info["ruta"] = ruta
+                return info
+            db.adj_delete_blob(info["sha256"])
+        self.misses += 1
+        return None
+
+    def escritor(self) -> "EscritorAdjunto":
+        return EscritorAdjunto(self)
+
+    def _guardar(self, mail_id: str, att_id: str, tmp: Path, sha256: str,
+                 size: int, name: str, content_type: str) -> None:
+        destino = self.ruta(sha256)
+        destino.parent.mkdir(parents=True, exist_ok=True)
+
+        def registrar(conn) -> None:
+            # otro worker no puede estar expulsando este mismo blob mientras tanto
+            if destino.exists():
+                tmp.unlink(missing_ok=True)
+            else:
+                os.replace(tmp, destino)
+            db.adj_put(mail_id, att_id, sha256, size, name, content_type, time.time(), conn=conn)
+            self._evictar(conn)
+
+        db.adj_bajo_bloqueo(registrar)
+
+    def _evictar(self, conn) -> None:
+        total = db.adj_total_size(conn)
+        while total > self.max_bytes:
+            candidatos = db.adj_lru(conn=conn)
+            if not candidatos:
+                break
+            for sha256, size in candidatos:
+                self.ruta(sha256).unlink(missing_ok=True)
+                db.adj_delete_blob(sha256, conn)
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self) -> Dict:
+        consultas = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / consultas, 3) if consultas else None,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class EscritorAdjunto:
+    """Va escribiendo un adjunto a un temporal mientras calcula su SHA-256."""
+
+    def __init__(self, cache: CacheAdjuntos):
+        self.cache = cache
+        fd, nombre = tempfile.mkstemp(dir=cache.directorio, suffix=".part")
+        self._f = os.fdopen(fd, "wb")
+        self._tmp = Path(nombre)
+        self._sha = hashlib.sha256()
+        self._size = 0
+
+    def escribir(self, chunk: bytes) -> None:
+        self._f.write(chunk)
+        self._sha.update(chunk)
+        self._size += len(chunk)
+
+    def terminar(self, mail_id: str, att_id: str, name: str, content_type: str) -> str:
+        """Cierra el temporal, lo mueve a su ruta definitiva y devuelve el SHA-256."""
+        self._f.close()
+        sha256 = self._sha.hexdigest()
+        self.cache._guardar(mail_id, att_id, self._tmp, sha256, self._size, name, content_type)
+        return sha256
+
+    def descartar(self) -> None:
+        if not self._f.closed:
+            self._f.close()
+        self._tmp.unlink(missing_ok=True)
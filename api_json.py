@@ -0,0 +1,135 @@
+# api_json.py
+# -- coding: utf-8 --
+# Utilidades de la API JSON (/api/v1/...): selección de campos, páginas por
+# clave sobre listas en memoria y la respuesta final, que lleva ETag (304 si
+# el cliente ya tiene esa versión) y va comprimida con brotli (si está
+# instalado 'brotli') o gzip según Accept-Encoding.
+
+import gzip
+import hashlib
+import importlib.util
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+import paginacion
+
+if importlib.util.find_spec("brotli") is not None:
+    import brotli
+else:
+    brotli = None
+
+VERSION = "v1"
+# Por debajo de este tamaño no vale la pena comprimir
+MIN_COMPRIMIR = 1024
+
+
+def campos_pedidos(request: Request) -> Optional[List[str]]:
+    """?campos=a,b,c -> ["a", "b", "c"] (None = todos)."""
+    valor = request.query_params.get("campos")
+    if not valor:
+        return None
+    return [c.strip() for c in valor.split(",") if c.strip()]
+
+
+def seleccionar(items: Iterable[Dict], campos: Optional[List[str]]) -> List[Dict]:
+    if not campos:
+        return list(items)
+    return [{c: it[c] for c in campos if c in it} for it in items]
+
+
+def pagina_en_memoria(
+    items: List[Dict],
+    clave: Callable[[Dict], Tuple],
+    cursor: Optional[str],
+    limite: int,
+    descendente: bool = False,
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Página por clave sobre una lista ya cargada: `cursor` guarda la clave de
+    la última fila entregada. Devuelve (filas, cursor siguiente o None).
+    """
+    try:
+        antes = paginacion.decodificar(cursor, len(clave(items[0]))) if items else None
+    except paginacion.CursorInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ordenados = sorted(items, key=clave, reverse=descendente)
+    if antes is not None:
+        if descendente:
+            ordenados = [it for it in ordenados if clave(it) < antes]
+        else:
+            ordenados = [it for it in ordenados if clave(it) > antes]
+    pagina = ordenados[:limite]
+    siguiente = paginacion.codificar(*clave(pagina[-1])) if len(ordenados) > limite else None
+    return pagina, siguiente
+
+
+def _calidades(accept_encoding: str) -> Dict[str, float]:
+    """'gzip;q=0.5, br' -> {"gzip": 0.5, "br": 1.0} (q inválido cuenta como 0)."""
+    calidades: Dict[str, float] = {}
+    for parte in accept_encoding.split(","):
+        nombre, *parametros = [p.strip() for p in parte.split(";")]
+        if not nombre:
+            continue
+        q = 1.0
+        for parametro in parametros:
+            clave, _, valor = parametro.partition("=")
+            if clave.strip().lower() == "q":
+                try:
+                    q = min(max(float(valor), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        calidades[nombre.lower()] = q
+    return calidades
+
+
+def _codificacion(accept_encoding: str) -> Optional[str]:
+    """La codificación disponible con mayor q (br antes que gzip si empatan)."""
+    calidades = _calidades(accept_encoding)
+    comodin = calidades.get("*", 0.0)
+    disponibles = (["br"] if brotli is not None else []) + ["gzip"]
+    elegida, mejor = None, 0.0
+    for nombre in disponibles:
+        q = calidades.get(nombre, comodin)
+        if q > mejor:
+            elegida, mejor = nombre, q
+    return elegida
+
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidatos = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+    return "*" in candidatos or etag in candidatos
+
+
+def respuesta(request: Request, datos: Any) -> Response:
+    """
+    JSON con ETag del contenido; 304 si coincide con If-None-Match. Cada
+    codificación lleva su propio ETag ("...-br", "...-gzip"): son
+    representaciones distintas del mismo recurso.
+    """
+    cuerpo = json.dumps(datos, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    codificacion = _codificacion(request.headers.get("accept-encoding", ""))
+    if len(cuerpo) < MIN_COMPRIMIR:
+        codificacion = None
+    sufijo = f"-{codificacion}" if codificacion else ""
+    etag = f'"{hashlib.sha256(cuerpo).hexdigest()[:32]}{sufijo}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        "X-API-Version": VERSION,
+    }
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if codificacion == "br":
+        cuerpo = brotli.compress(cuerpo, quality=5)
+        headers["Content-Encoding"] = codificacion
+    elif codificacion == "gzip":
+        cuerpo = gzip.compress(cuerpo, compresslevel=6)
+        headers["Content-Encoding"] = codificacion
+    return Response(cuerpo, media_type="application/json", headers=headers)
@@ -0,0 +1,110 @@
+# bench_correo.py
+# -- coding: utf-8 --
+# Throughput del envío de alertas contra un SMTP local (aiosmtpd, solo para
+# pruebas: pip install -r requirements-dev.txt). Compara el envío antiguo (una conexión,
+# EHLO y QUIT por correo) con correo_salida.BuzonSalida (outbox en SQLite y
+# una sola conexión reutilizada). Con --caida el servidor rechaza las
+# conexiones durante unos segundos para ver los reintentos.
+#
+# Uso: python bench_correo.py [correos] [--caida]
+# (por defecto 1_000 correos)
+
+import smtplib
+import sys
+import tempfile
+import time
+from email.mime.text import MIMEText
+from pathlib import Path
+
+from aiosmtpd.controller import Controller
+
+import correo_salida
+import db
+
+HOST = "127.0.0.1"
+PORT = 8025
+
+
+class Recibidos:
+    """Handler de aiosmtpd que solo cuenta los mensajes."""
+
+    def __init__(self):
+        self.total = 0
+        self.rechazar = False
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if self.rechazar:
+            return "421 Servicio no disponible"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.total += 1
+        return "250 OK"
+
+
+def enviar_antiguo(i: int) -> None:
+    """Como era watcher_polizas.enviar_correo_alerta: conexión nueva por correo."""
+    msg = MIMEText(f"Alerta {i}", _charset="utf-8")
+    msg["Subject"] = f"Bench {i}"
+    msg["From"] = "watcher@localhost"
+    msg["To"] = "destino@localhost"
+    server = smtplib.SMTP(HOST, PORT, timeout=20)
+    server.ehlo()
+    server.sendmail("watcher@localhost", ["destino@localhost"], msg.as_string())
+    server.quit()
+
+
+def esperar(handler: Recibidos, total: int, limite: float = 300) -> None:
+    fin = time.monotonic() + limite
+    while handler.total < total and time.monotonic() < fin:
+        time.sleep(0.01)
+
+
+def main() -> None:
+    correos = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 1_000
+    caida = "--caida" in sys.argv
+    db.DBPATH = Path(tempfile.mkdtemp(prefix="bench_correo_")) / "bench.sqlite3"
+    db.initdb()
+
+    handler = Recibidos()
+    controller = Controller(handler, hostname=HOST, port=PORT)
+    controller.start()
+    print(f"{correos} correos contra {HOST}:{PORT}")
+    try:
+        t = time.perf_counter()
+        for i in range(correos):
+            enviar_antiguo(i)
+        t_antes = time.perf_counter() - t
+        print(f"antes    correos/s: {correos / t_antes:8.0f}   conexiones: {correos}")
+
+        handler.total = 0
+        correo_salida.REINTENTO_BASE = 0.5
+        buzon = correo_salida.BuzonSalida(
+            correo_salida.ConexionSMTP(HOST, PORT, starttls=False)
+        )
+        if caida:
+            handler.rechazar = True
+        t = time.perf_counter()
+        for i in range(correos):
+            buzon.encolar(f"Bench {i}", f"Alerta {i}", "watcher@localhost", ["destino@localhost"])
+        t_encolar = time.perf_counter() - t
+        if caida:
+            time.sleep(2)
+            handler.rechazar = False
+        esperar(handler, correos)
+        t_despues = time.perf_counter() - t
+        stats = buzon.stats()
+        buzon.detener()
+        print(
+            f"despues  correos/s: {correos / t_despues:8.0f}   conexiones: {stats['conexiones']}"
+            f"   (encolar: {correos / t_encolar:.0f}/s, reintentos: {stats['reintentos']})"
+        )
+        print("outbox:", stats["outbox"])
+    finally:
+        controller.stop()
+        db.cerrar_conn()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# bench_db.py
+# -- coding: utf-8 --
+# Micro-benchmark de db.py: inserciones y búsquedas en alerts con la conexión
+# antigua (una conexión nueva por llamada, journal por defecto) y con la
+# conexión por hilo (WAL, synchronous=NORMAL, mmap, sentencias cacheadas).
+#
+# Uso: python bench_db.py [filas_alerts] [inserts] [lookups]
+# (por defecto 1_000_000 filas, 2_000 inserts, 20_000 lookups)
+
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import db
+
+
+def get_conn_antigua() -> sqlite3.Connection:
+    """Como era db.get_conn antes: conexión nueva en cada llamada."""
+    conn = sqlite3.connect(db.DBPATH)
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def poblar(filas: int) -> int:
+    """Crea `filas` alertas sobre filas/10 archivos. Devuelve cuántos archivos hay."""
+    n_files = max(filas // 10, 1)
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    with db.get_conn() as conn:
+        conn.executemany(
+            "INSERT INTO files (path, name, size, sha256, firstseen, lastseen) VALUES (?, ?, ?, ?, ?, ?)",
+            ((f"/p/{i}.pdf", f"{i}.pdf", i, f"{i:064x}", now, now) for i in range(n_files)),
+        )
+        conn.executemany(
+            "INSERT INTO alerts (fileid, subject, toemail, senttime, category) VALUES (?, ?, ?, ?, ?)",
+            ((i % n_files + 1, "s", "a@b", now, "nuevo_pdf") for i in range(filas)),
+        )
+    return n_files
+
+
+def medir(nombre: str, filas: int, inserts: int, lookups: int) -> None:
+    n_files = poblar(filas)
+    ids = [random.randint(1, n_files * 2) for _ in range(lookups)]  # ~50% aciertos
+
+    t = time.perf_counter()
+    for i in range(inserts):
+        db.add_alert(i % n_files + 1, "bench", "a@b", "nuevo_pdf")
+    t_ins = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for fid in ids:
+        db.alert_exists_for_file(fid, "nuevo_pdf")
+    t_look = time.perf_counter() - t
+
+    print(f"{nombre:8s} inserts/s: {inserts / t_ins:10.0f}   lookups/s: {lookups / t_look:10.0f}")
+
+
+def main() -> None:
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    inserts = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    lookups = int(sys.argv[3]) if len(sys.argv) > 3 else 20_000
+    print(f"alerts: {filas} filas, {inserts} inserts, {lookups} lookups")
+
+    directorio = Path(tempfile.mkdtemp(prefix="bench_db_"))
+    original = db.get_conn
+
+    # Antes: conexión por llamada, modo journal por defecto (DELETE, synchronous=FULL)
+    db.DBPATH = directorio / "antes.sqlite3"
+    db.get_conn = get_conn_antigua
+    db.initdb()
+    medir("antes", filas, inserts, lookups)
+
+    # Después: conexión por hilo con WAL y pragmas de db._abrir
+    db.get_conn = original
+    db.DBPATH = directorio / "despues.sqlite3"
+    db.initdb()
+    medir("despues", filas, inserts, lookups)
+    db.cerrar_conn()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# clasif_siniestros.py
+# -- coding: utf-8 --
+# Clasificación de correos de siniestros (ID de Graph -> N° de siniestro).
+# Mantiene en memoria un índice en ambos sentidos sobre la tabla
+# clasif_siniestros de db.py y solo lo recarga cuando otro proceso la cambió
+# (contador en db.versiones).
+#
+# Antes la clave era "{fecha} - {asunto} ({remitente})"; esas claves se
+# migran a IDs de mensaje a medida que aparecen los correos correspondientes.
+
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+import db
+
+VERSION = "clasif_siniestros"
+
+
+def es_clave_antigua(clave: str) -> bool:
+    # Los IDs de Graph no llevan espacios; las claves antiguas siempre (" - ")
+    return " " in clave
+
+
+def clave_antigua(fecha: str, asunto: str, remitente: str) -> str:
+    """Clave con el formato anterior, para encontrar clasificaciones por migrar."""
+    try:
+        fecha_dt = datetime.fromisoformat((fecha or "").replace("Z", "+00:00"))
+        fecha = fecha_dt.strftime("%Y-%m-%d %H:%M")
+    except ValueError:
+        pass
+    return f"{fecha} - {asunto} ({remitente})"
+
+
+class IndiceClasificacion:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._por_mail: Dict[str, str] = {}
+        self._por_numero: Dict[str, Set[str]] = {}
+        self._antiguas: Dict[str, str] = {}
+        # correos ya comparados con las claves antiguas (se hace una sola vez)
+        self._revisados: Set[str] = set()
+
+    def refrescar(self) -> None:
+        """Recarga desde SQLite solo si la tabla cambió desde la última carga."""
+        version = db.version_get(VERSION)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            por_mail: Dict[str, str] = {}
+            por_numero: Dict[str, Set[str]] = {}
+            antiguas: Dict[str, str] = {}
+            for clave, numero in db.clasif_siniestros_todas().items():
+                if es_clave_antigua(clave):
+                    antiguas[clave] = numero
+                    continue
+                por_mail[clave] = numero
+                por_numero.setdefault(numero, set()).add(clave)
+            self._por_mail, self._por_numero, self._antiguas = por_mail, por_numero, antiguas
+            self._version = version
+
+    def numero(self, mail_id: str) -> Optional[str]:
+        return self._por_mail.get(mail_id)
+
+    def mails(self, numero: str) -> Set[str]:
+        return self._por_numero.get(numero, set())
+
+    def numeros(self) -> List[str]:
+        return sorted(self._por_numero)
+
+    def pendientes_migrar(self) -> int:
+        return len(self._antiguas)
+
+    def aplicar(self, cambios: Dict[str, Optional[str]]) -> None:
+        """Guarda {mail_id: numero | None} (solo lo que difiere) y refresca."""
+        self.refrescar()
+        cambios = {k: v for k, v in cambios.items() if self._por_mail.get(k) != v}
+        if not cambios:
+            return
+        db.clasif_siniestros_aplicar(cambios)
+        self.refrescar()
+
+    def adoptar(self, mails: Iterable[Dict]) -> int:
+        """
+        Pasa a ID de mensaje las claves antiguas que coinciden con `mails`
+        (dicts con id, fecha, asunto, remitente). Devuelve cuántos correos
+        quedaron clasificados por ID.
+        """
+        self.refrescar()
+        if not self._antiguas:
+            return 0
+        cambios: Dict[str, Optional[str]] = {}
+        usadas: Set[str] = set()
+        for m in mails:
+            mail_id = m.get("id")
+            if not mail_id or mail_id in self._por_mail or mail_id in self._revisados:
+                continue
+            self._revisados.add(mail_id)
+            clave = clave_antigua(m.get("fecha", ""), m.get("asunto", ""), m.get("remitente", ""))
+            numero = self._antiguas.get(clave)
+            if numero:
+                # si dos correos compartían clave, ambos heredan el número
+                cambios[mail_id] = numero
+                usadas.add(clave)
+        if not cambios:
+            return 0
+        cambios.update({clave: None for clave in usadas})
+        db.clasif_siniestros_aplicar(cambios)
+        self.refrescar()
+        return len(cambios) - len(usadas)
+
+    def stats(self) -> Dict:
+        return {
+            "mails": len(self._por_mail),
+            "siniestros": len(self._por_numero),
+            "claves_antiguas": len(self._antiguas),
+            "version": self._version,
+        }
@@ -0,0 +1,142 @@
+# cola_eventos.py
+# -- coding: utf-8 --
+# Cola de eventos de archivos con "debounce": los eventos de una misma ruta
+# se juntan y la ruta solo se entrega cuando su tamaño y mtime no cambian
+# durante `quieto` segundos. Las rutas listas se procesan en un pool de hilos
+# acotado; quien llama a agregar() (el hilo del observer) nunca se bloquea.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+QUIETO = float(os.getenv("WATCHER_QUIETO", "2.0"))
+MAX_WORKERS = int(os.getenv("WATCHER_WORKERS", "4"))
+
+
+class _Pendiente:
+    __slots__ = ("eventos", "firma", "estable_desde")
+
+    def __init__(self):
+        self.eventos: list = []
+        self.firma: Optional[Tuple[int, int]] = None
+        self.estable_desde = time.monotonic()
+
+
+class ColaEstable:
+    def __init__(
+        self,
+        procesar: Callable[[Path, str], None],
+        quieto: float = QUIETO,
+        max_workers: int = MAX_WORKERS,
+    ):
+        self.procesar = procesar
+        self.quieto = quieto
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="watcher")
+        # como mucho max_workers * 4 archivos listos esperando un hilo libre
+        self._cupos = threading.BoundedSemaphore(max_workers * 4)
+        self._cond = threading.Condition()
+        self._pendientes: Dict[str, _Pendiente] = {}
+        self._en_proceso: set = set()
+        self._activo = True
+        self.recibidos = 0
+        self.fusionados = 0
+        self.procesados = 0
+        self._hilo = threading.Thread(target=self._despachar, name="watcher-debounce", daemon=True)
+        self._hilo.start()
+
+    def agregar(self, path: str, evento: str) -> None:
+        """Registra un evento; si la ruta ya estaba pendiente se fusiona."""
+        firma = self._firma(path)
+        with self._cond:
+            self.recibidos += 1
+            p = self._pendientes.get(path)
+            if p is None:
+                p = self._pendientes[path] = _Pendiente()
+            else:
+                self.fusionados += 1
+            if evento not in p.eventos:
+                p.eventos.append(evento)
+            p.firma = firma
+            p.estable_desde = time.monotonic()
+            self._cond.notify()
+
+    @staticmethod
+    def _firma(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _listos(self) -> Tuple[list, float]:
+        """Rutas estables para entregar y segundos hasta la próxima revisión."""
+        ahora = time.monotonic()
+        listos = []
+        espera = self.quieto
+        for path, p in list(self._pendientes.items()):
+            if path in self._en_proceso:
+                continue
+            restante = p.estable_desde + self.quieto - ahora
+            if restante > 0:
+                espera = min(espera, restante)
+                continue
+            firma = self._firma(path)
+            if firma is None:
+                # se borró o renombró antes de asentarse
+                del self._pendientes[path]
+                continue
+            if firma != p.firma:
+                # sigue copiándose: esperar otro periodo de quietud
+                p.firma = firma
+                p.estable_desde = ahora
+                espera = min(espera, self.quieto)
+                continue
+            del self._pendientes[path]
+            self._en_proceso.add(path)
+            listos.append((path, "+".join(p.eventos)))
+        return listos, espera
+
+    def _despachar(self) -> None:
+        while True:
+            with self._cond:
+                if not self._activo:
+                    return
+                listos, espera = self._listos()
+                if not listos:
+                    self._cond.wait(timeout=espera if self._pendientes else None)
+                    continue
+            for path, eventos in listos:
+                self._cupos.acquire()
+                self._pool.submit(self._ejecutar, path, eventos)
+
+    def _ejecutar(self, path: str, eventos: str) -> None:
+        try:
+            self.procesar(Path(path), eventos)
+        except Exception as e:
+            print(f"Error procesando {path}:", e)
+        finally:
+            with self._cond:
+                self._en_proceso.discard(path)
+                self.procesados += 1
+                self._cond.notify()
+            self._cupos.release()
+
+    def detener(self, esperar: bool = True) -> None:
+        with self._cond:
+            self._activo = False
+            self._cond.notify()
+        self._hilo.join(timeout=5)
+        self._pool.shutdown(wait=esperar)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "pendientes": len(self._pendientes),
+                "en_proceso": len(self._en_proceso),
+                "recibidos": self.recibidos,
+                "fusionados": self.fusionados,
+                "procesados": self.procesados,
+            }
@@ -0,0 +1,247 @@
+# correo_salida.py
+# -- coding: utf-8 --
+# Envío de correos del watcher. Cada correo se guarda primero en la tabla
+# outbox de db.py y un hilo lo entrega por una conexión SMTP autenticada que
+# se reutiliza entre correos (NOOP si estuvo inactiva, reconexión si el
+# servidor la cerró). Los fallos transitorios (DNS, red, 4xx) se reintentan
+# con backoff exponencial; un reinicio del proceso no pierde nada.
+
+import os
+import random
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+from typing import Callable, Dict, List, Optional
+
+import db
+
+REINTENTO_BASE = float(os.getenv("SMTP_REINTENTO_BASE", "5"))
+REINTENTO_MAX = float(os.getenv("SMTP_REINTENTO_MAX", "900"))
+MAX_INTENTOS = int(os.getenv("SMTP_MAX_INTENTOS", "12"))
+# Segundos sin uso tras los cuales se comprueba la conexión con NOOP
+INACTIVA = float(os.getenv("SMTP_INACTIVA", "30"))
+LOTE = 100
+
+
+def _espera(intentos: int) -> float:
+    """Segundos hasta el próximo intento tras `intentos` fallos."""
+    return min(REINTENTO_BASE * (2 ** (intentos - 1)), REINTENTO_MAX) * random.uniform(0.8, 1.2)
+
+
+def _permanente(e: Exception) -> bool:
+    """Errores 5xx que no se arreglan reintentando (menos la autenticación)."""
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(500 <= codigo < 600 for codigo, _ in e.recipients.values())
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        return False
+    return isinstance(e, smtplib.SMTPResponseException) and 500 <= e.smtp_code < 600
+
+
+def _de_conexion(e: Exception) -> bool:
+    """Fallos que afectarían a cualquier correo (DNS, red, saludo, login)."""
+    if isinstance(e, (smtplib.SMTPConnectError, smtplib.SMTPHeloError, smtplib.SMTPAuthenticationError)):
+        return True
+    # destinatarios rechazados: el servidor respondió, solo falla este correo
+    return not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+
+
+class ConexionSMTP:
+    """Una conexión SMTP autenticada que se reutiliza entre envíos."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 587,
+        usuario: str = "",
+        clave: str = "",
+        starttls: bool = True,
+        timeout: float = 20,
+    ):
+        self.host = host
+        self.port = port
+        self.usuario = usuario
+        self.clave = clave
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._ultimo_uso = 0.0
+        self.conexiones = 0
+
+    def _conectar(self) -> None:
+        self.cerrar()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            if self.usuario:
+                smtp.login(self.usuario, self.clave)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self.conexiones += 1
+
+    def _viva(self) -> bool:
+        if self._smtp is None:
+            return False
+        if time.monotonic() - self._ultimo_uso < INACTIVA:
+            return True
+        try:
+            return self._smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def enviar(self, remitente: str, destinatarios: List[str], mensaje: str) -> Dict:
+        """Envía por la conexión abierta; devuelve los destinatarios rechazados."""
+        if not self._viva():
+            self._conectar()
+        try:
+            rechazados = self._smtp.sendmail(remitente, destinatarios, mensaje)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # el servidor cortó la conexión entre correos: una vez más en una nueva
+            self._conectar()
+            rechazados = self._smtp.sendmail(remitente, destinatarios, mensaje)
+        self._ultimo_uso = time.monotonic()
+        return rechazados
+
+    def cerrar(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+
+class BuzonSalida:
+    """
+    Hilo que vacía db.outbox por una ConexionSMTP. al_resultado(fila, estado,
+    detalle) se llama tras cada intento con estado "OK", "REINTENTO" o "ERROR".
+    """
+
+    def __init__(
+        self,
+        conexion: ConexionSMTP,
+        al_resultado: Optional[Callable[[Dict, str, str], None]] = None,
+    ):
+        self.conexion = conexion
+        self.al_resultado = al_resultado
+        self._evento = threading.Event()
+        self._activo = True
+        # tras un fallo de conexión no se intenta nada hasta este momento (epoch)
+        self._pausa_hasta = 0.0
+        self.enviados = 0
+        self.reintentos = 0
+        self.fallidos = 0
+        self._hilo = threading.Thread(target=self._bucle, name="smtp-outbox", daemon=True)
+        self._hilo.start()
+
+    def encolar(
+        self,
+        asunto: str,
+        cuerpo: str,
+        remitente: str,
+        destinatarios: List[str],
+        fileids=(),
+        categoria: str = "nuevo_pdf",
+    ) -> int:
+        """Guarda el correo en db.outbox y despierta al hilo. Devuelve su id."""
+        outbox_id = db.outbox_agregar(
+            asunto, cuerpo, remitente, ", ".join(destinatarios), fileids, categoria
+        )
+        self._evento.set()
+        return outbox_id
+
+    def _bucle(self) -> None:
+        while self._activo:
+            self._evento.clear()
+            try:
+                self.vaciar()
+                proximo = max(db.outbox_proximo() or 0.0, self._pausa_hasta)
+            except Exception as e:
+                print("[SMTP] Error vaciando outbox:", e)
+                proximo = time.time() + REINTENTO_BASE
+            espera = INACTIVA if not proximo else min(max(proximo - time.time(), 0.0), INACTIVA)
+            self._evento.wait(espera)
+        self.conexion.cerrar()
+
+    def vaciar(self) -> int:
+        """Envía todo lo que ya venció. Devuelve cuántos correos salieron."""
+        enviados = 0
+        while self._activo and time.time() >= self._pausa_hasta:
+            filas = db.outbox_listos(time.time(), LOTE)
+            if not filas:
+                break
+            for fila in filas:
+                if not self._activo or time.time() < self._pausa_hasta:
+                    break
+                enviados += self._enviar(fila)
+        return enviados
+
+    def _enviar(self, fila: Dict) -> int:
+        tos = [t.strip() for t in fila["destinatarios"].split(",") if t.strip()]
+        msg = MIMEText(fila["cuerpo"], _charset="utf-8")
+        msg["Subject"] = fila["asunto"]
+        msg["From"] = fila["remitente"]
+        msg["To"] = ", ".join(tos)
+
+        inicio = time.perf_counter()
+        try:
+            rechazados = self.conexion.enviar(fila["remitente"], tos, msg.as_string())
+        except Exception as e:
+            fila["duracion_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+            self._fallo(fila, e)
+            return 0
+        fila["duracion_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+
+        db.outbox_enviado(fila)
+        self.enviados += 1
+        detalle = "Correo enviado"
+        if rechazados:
+            detalle += f" (rechazados: {', '.join(rechazados)})"
+        self._avisar(fila, "OK", detalle)
+        return 1
+
+    def _fallo(self, fila: Dict, e: Exception) -> None:
+        intentos = fila["intentos"] + 1
+        detalle = f"Error SMTP: {e}"
+        if _permanente(e) or intentos >= MAX_INTENTOS:
+            db.outbox_fallo(fila["id"], detalle, None)
+            self.fallidos += 1
+            self._avisar(fila, "ERROR", f"{detalle} (sin más reintentos)")
+            return
+        espera = _espera(intentos)
+        db.outbox_fallo(fila["id"], detalle, time.time() + espera)
+        self.reintentos += 1
+        if _de_conexion(e):
+            # el resto de la cola fallaría igual: pausa hasta el próximo intento
+            self.conexion.cerrar()
+            self._pausa_hasta = time.time() + espera
+        self._avisar(fila, "REINTENTO", f"{detalle} (intento {intentos}, próximo en {espera:.0f}s)")
+
+    def _avisar(self, fila: Dict, estado: str, detalle: str) -> None:
+        if self.al_resultado is None:
+            return
+        try:
+            self.al_resultado(fila, estado, detalle)
+        except Exception as e:
+            print("[SMTP] Error en al_resultado:", e)
+
+    def detener(self) -> None:
+        """Termina el hilo; lo no enviado queda en db.outbox para el próximo arranque."""
+        self._activo = False
+        self._evento.set()
+        self._hilo.join(timeout=30)
+
+    def stats(self) -> Dict:
+        return {
+            "enviados": self.enviados,
+            "reintentos": self.reintentos,
+            "fallidos": self.fallidos,
+            "conexiones": self.conexion.conexiones,
+            "outbox": db.outbox_stats(),
+        }
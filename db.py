@@ -1,23 +1,66 @@
 # db.py
 # -- coding: utf-8 --
 
+import json
+import os
 import sqlite3
+import threading
+import time
+from itertools import islice
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional, Tuple
 
 # Base en carpeta data/ al nivel del repo
 FILE = Path(__file__).resolve()
 DBPATH = FILE.resolve().parents[2] / "data" / "watcherstate.sqlite3"
 DBPATH.parent.mkdir(parents=True, exist_ok=True)
 
+# Ajustes de cada conexión
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+MMAP_BYTES = int(os.getenv("DB_MMAP_MB", "256")) * 1024 * 1024
+CACHE_SENTENCIAS = 256  # sentencias preparadas que sqlite3 reutiliza por conexión
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DBPATH)
+_local = threading.local()
+
+
+def _abrir(ruta: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        ruta,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=CACHE_SENTENCIAS,
+    )
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_BYTES}")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
 
+def get_conn() -> sqlite3.Connection:
+    """
+    Conexión del hilo actual (se abre una vez y se reutiliza). Usar siempre
+    como `with get_conn() as conn:`: el bloque confirma o revierte la
+    transacción pero no cierra la conexión.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.ruta != DBPATH:
+        if conn is not None:
+            conn.close()
+        conn = _abrir(DBPATH)
+        _local.conn, _local.ruta = conn, DBPATH
+    return conn
+
+
+def cerrar_conn() -> None:
+    """Cierra la conexión del hilo actual (la próxima get_conn abre otra)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
 def initdb() -> None:
     """Crea tablas e índices si no existen."""
     with get_conn() as conn:
@@ -31,10 +74,37 @@ def initdb() -> None:
                 sha256 TEXT NOT NULL,
                 firstseen TIMESTAMP NOT NULL,
                 lastseen TIMESTAMP NOT NULL,
+                mtime_ns INTEGER,
                 UNIQUE(sha256)
             )
             """
         )
+        # bases creadas antes de la huella (path, size, mtime_ns)
+        columnas = {r[1] for r in conn.execute("PRAGMA table_info(files)")}
+        if "mtime_ns" not in columnas:
+            conn.execute("ALTER TABLE files ADD COLUMN mtime_ns INTEGER")
+        # Huella por ruta: files es único por sha256 y guarda una sola ruta,
+        # así que dos copias idénticas se pisarían la huella entre sí.
+        nueva = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_huellas'"
+        ).fetchone() is None
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_huellas (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            )
+            """
+        )
+        if nueva:
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO file_huellas (path, size, mtime_ns, sha256)
+                SELECT path, size, mtime_ns, sha256 FROM files WHERE mtime_ns IS NOT NULL
+                """
+            )
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS alerts (
@@ -48,35 +118,241 @@ def initdb() -> None:
             )
             """
         )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS graph_cache (
+                clave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL,
+                expira REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sp_items (
+                id TEXT PRIMARY KEY,
+                drive_id TEXT NOT NULL,
+                parent_id TEXT,
+                name TEXT NOT NULL,
+                is_folder INTEGER NOT NULL,
+                last_modified TEXT,
+                size INTEGER,
+                download_url TEXT,
+                download_url_expira REAL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sp_delta (
+                drive_id TEXT PRIMARY KEY,
+                delta_link TEXT NOT NULL,
+                updated TIMESTAMP NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mail_messages (
+                id TEXT PRIMARY KEY,
+                folder TEXT NOT NULL,
+                received TEXT,
+                sender TEXT,
+                subject TEXT,
+                has_attachments INTEGER NOT NULL DEFAULT 0,
+                n_siniestro TEXT
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mail_delta (
+                folder TEXT PRIMARY KEY,
+                delta_link TEXT NOT NULL,
+                updated TIMESTAMP NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS attachment_blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS attachment_cache (
+                mail_id TEXT NOT NULL,
+                att_id TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                name TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                PRIMARY KEY (mail_id, att_id),
+                FOREIGN KEY(sha256) REFERENCES attachment_blobs(sha256) ON DELETE CASCADE
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS clasif_siniestros (
+                clave TEXT PRIMARY KEY,
+                n_siniestro TEXT NOT NULL,
+                updated TIMESTAMP NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS versiones (
+                nombre TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS migraciones (
+                nombre TEXT PRIMARY KEY,
+                aplicada TIMESTAMP NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bancos_polizas (
+                nombre TEXT PRIMARY KEY,
+                updated TIMESTAMP NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bancos_correos (
+                mail_id TEXT PRIMARY KEY,
+                carpeta TEXT NOT NULL,
+                fecha TEXT,
+                remitente TEXT,
+                asunto TEXT,
+                updated TIMESTAMP NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                asunto TEXT NOT NULL,
+                cuerpo TEXT NOT NULL,
+                remitente TEXT NOT NULL,
+                destinatarios TEXT NOT NULL,
+                fileids TEXT NOT NULL DEFAULT '[]',
+                categoria TEXT NOT NULL DEFAULT 'nuevo_pdf',
+                estado TEXT NOT NULL DEFAULT 'pendiente',
+                intentos INTEGER NOT NULL DEFAULT 0,
+                proximo REAL NOT NULL,
+                error TEXT,
+                creado TIMESTAMP NOT NULL,
+                enviado TIMESTAMP
+            )
+            """
+        )
         conn.execute("CREATE INDEX IF NOT EXISTS idx_files_sha ON files(sha256)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_path ON files(path)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_clasif_siniestro ON clasif_siniestros(n_siniestro)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_access ON attachment_blobs(last_access)")
+        # (folder, received, id): listado por páginas con cursor (received, id)
+        conn.execute("DROP INDEX IF EXISTS idx_mail_folder_received")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_mail_folder_received_id ON mail_messages(folder, received, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_mail_siniestro ON mail_messages(n_siniestro)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sp_items_parent ON sp_items(drive_id, parent_id)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_file ON alerts(fileid)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_time ON alerts(senttime)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_estado ON outbox(estado, proximo)")
+
+
+_SQL_UPSERT_FILE = """
+    INSERT INTO files (path, name, size, sha256, firstseen, lastseen, mtime_ns)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(sha256) DO UPDATE SET
+        path = excluded.path,
+        name = excluded.name,
+        size = excluded.size,
+        lastseen = excluded.lastseen,
+        -- una fila sin mtime_ns no borra la huella ya guardada
+        mtime_ns = COALESCE(excluded.mtime_ns, files.mtime_ns)
+"""
+_SQL_UPSERT_HUELLA = """
+    INSERT INTO file_huellas (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)
+    ON CONFLICT(path) DO UPDATE SET
+        size = excluded.size,
+        mtime_ns = excluded.mtime_ns,
+        sha256 = excluded.sha256
+"""
+BULK_CHUNK = 5000
 
 
-def upsert_file(path: Path, sha256: str) -> int:
-    """Inserta/actualiza por sha256 y retorna fileid."""
-    size = path.stat().st_size
+def upsert_file(
+    path: Path,
+    sha256: str,
+    size: Optional[int] = None,
+    mtime_ns: Optional[int] = None,
+) -> int:
+    """
+    Inserta/actualiza por sha256 y retorna fileid. size/mtime_ns deben ser
+    los del stat() con que se calculó sha256 (si faltan se hace stat ahora).
+    """
+    if size is None or mtime_ns is None:
+        st = path.stat()
+        size, mtime_ns = st.st_size, st.st_mtime_ns
     now = datetime.utcnow().isoformat(timespec="seconds")
     with get_conn() as conn:
-        try:
-            conn.execute(
-                """
-                INSERT INTO files (path, name, size, sha256, firstseen, lastseen)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (str(path), path.name, size, sha256, now, now),
+        cur = conn.execute(
+            _SQL_UPSERT_FILE + " RETURNING id",
+            (str(path), path.name, size, sha256, now, now, mtime_ns),
+        )
+        fileid = int(cur.fetchone()[0])
+        conn.execute(_SQL_UPSERT_HUELLA, (str(path), size, mtime_ns, sha256))
+        return fileid
+
+
+def upsert_files_bulk(filas: Iterable[Tuple]) -> List[int]:
+    """
+    Inserta/actualiza muchos archivos en una sola transacción.
+    filas: (path, sha256, size) o (path, sha256, size, mtime_ns), puede ser
+    un generador. Devuelve los fileid en el mismo orden.
+    """
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    ids: List[int] = []
+    with get_conn() as conn:
+        it = iter(filas)
+        while True:
+            bloque = list(islice(it, BULK_CHUNK))
+            if not bloque:
+                break
+            # executemany no entrega filas de RETURNING: los id se leen
+            # después, con una sola consulta por bloque
+            conn.executemany(
+                _SQL_UPSERT_FILE,
+                (
+                    (str(f[0]), Path(f[0]).name, f[2], f[1], now, now, f[3] if len(f) > 3 else None)
+                    for f in bloque
+                ),
             )
-        except sqlite3.IntegrityError:
-            conn.execute(
-                """
-                UPDATE files
-                SET path = ?, name = ?, size = ?, lastseen = ?
-                WHERE sha256 = ?
-                """,
-                (str(path), path.name, size, now, sha256),
+            conn.executemany(
+                _SQL_UPSERT_HUELLA,
+                ((str(f[0]), f[2], f[3], f[1]) for f in bloque if len(f) > 3 and f[3] is not None),
             )
-        cur = conn.execute("SELECT id FROM files WHERE sha256 = ?", (sha256,))
-        return int(cur.fetchone()[0])
+            shas = [f[1] for f in bloque]
+            cur = conn.execute(
+                "SELECT sha256, id FROM files WHERE sha256 IN (SELECT value FROM json_each(?))",
+                (json.dumps(shas),),
+            )
+            por_sha = dict(cur.fetchall())
+            ids.extend(por_sha[sha] for sha in shas)
+    return ids
 
 
 def alert_exists_for_file(fileid: int, category: Optional[str] = None) -> bool:
@@ -94,6 +370,43 @@ def alert_exists_for_file(fileid: int, category: Optional[str] = None) -> bool:
         return cur.fetchone() is not None
 
 
+def file_huella(path: str) -> Optional[Tuple[int, int, str]]:
+    """(size, mtime_ns, sha256) registrados para esa ruta, o None."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            "SELECT size, mtime_ns, sha256 FROM file_huellas WHERE path = ?",
+            (path,),
+        )
+        return cur.fetchone()
+
+
+def files_huellas() -> Dict[str, Tuple[int, int, str]]:
+    """{path: (size, mtime_ns, sha256)} de todos los archivos, para re-escaneos."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT path, size, mtime_ns, sha256 FROM file_huellas")
+        return {r[0]: (r[1], r[2], r[3]) for r in cur.fetchall()}
+
+
+def alerts_exist_bulk(fileids: Iterable[int], category: Optional[str] = None) -> set:
+    """Subconjunto de fileids que ya tienen alerta (y categoría opcional), en una consulta."""
+    lista = json.dumps([int(f) for f in fileids])
+    with get_conn() as conn:
+        if category:
+            cur = conn.execute(
+                """
+                SELECT DISTINCT fileid FROM alerts
+                WHERE fileid IN (SELECT value FROM json_each(?)) AND category = ?
+                """,
+                (lista, category),
+            )
+        else:
+            cur = conn.execute(
+                "SELECT DISTINCT fileid FROM alerts WHERE fileid IN (SELECT value FROM json_each(?))",
+                (lista,),
+            )
+        return {r[0] for r in cur.fetchall()}
+
+
 def add_alert(fileid: int, subject: str, toemail: str, category: str) -> None:
     """Registra una alerta enviada."""
     now = datetime.utcnow().isoformat(timespec="seconds")
@@ -129,3 +442,662 @@ def get_last_alerts(limit: int = 20) -> List[Dict]:
         }
         for r in rows
     ]
+
+
+def cache_get(clave: str, ahora: float) -> Optional[Tuple[str, float]]:
+    """(valor JSON, expira) guardado para clave si aún no expira, o None."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            "SELECT valor, expira FROM graph_cache WHERE clave = ? AND expira > ?",
+            (clave, ahora),
+        )
+        row = cur.fetchone()
+    return (row[0], float(row[1])) if row else None
+
+
+def cache_set(clave: str, valor: str, expira: float) -> None:
+    """Guarda/reemplaza un valor (JSON) con su instante de expiración (epoch)."""
+    with get_conn() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO graph_cache (clave, valor, expira) VALUES (?, ?, ?)",
+            (clave, valor, expira),
+        )
+
+
+def cache_delete(clave: str) -> None:
+    """Borra una clave de la caché persistente."""
+    with get_conn() as conn:
+        conn.execute("DELETE FROM graph_cache WHERE clave = ?", (clave,))
+
+
+def sp_delta_get(drive_id: str) -> Optional[str]:
+    """deltaLink guardado para el drive, o None si nunca se indexó."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            "SELECT delta_link FROM sp_delta WHERE drive_id = ?", (drive_id,)
+        )
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def sp_items_reset(drive_id: str) -> None:
+    """Borra el índice local de un drive (para una resincronización completa)."""
+    with get_conn() as conn:
+        conn.execute("DELETE FROM sp_items WHERE drive_id = ?", (drive_id,))
+        conn.execute("DELETE FROM sp_delta WHERE drive_id = ?", (drive_id,))
+
+
+def sp_items_apply(
+    drive_id: str,
+    upserts: List[tuple],
+    deletes: List[str],
+    delta_link: Optional[str],
+) -> None:
+    """
+    Aplica en una transacción una página de cambios delta.
+    upserts: (id, parent_id, name, is_folder, last_modified, size,
+              download_url, download_url_expira)
+    """
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    with get_conn() as conn:
+        if deletes:
+            conn.executemany(
+                "DELETE FROM sp_items WHERE id = ?", [(i,) for i in deletes]
+            )
+        if upserts:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO sp_items
+                    (id, drive_id, parent_id, name, is_folder, last_modified,
+                     size, download_url, download_url_expira)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(u[0], drive_id) + tuple(u[1:]) for u in upserts],
+            )
+        if delta_link:
+            conn.execute(
+                "INSERT OR REPLACE INTO sp_delta (drive_id, delta_link, updated) VALUES (?, ?, ?)",
+                (drive_id, delta_link, now),
+            )
+
+
+def sp_item_parent(item_id: str) -> Optional[str]:
+    """parent_id de un item indexado (None si no existe o es la raíz)."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT parent_id FROM sp_items WHERE id = ?", (item_id,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def sp_item_download_url(item_id: str) -> Optional[Tuple[str, float]]:
+    """(download_url, download_url_expira) guardados de un item, o None."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            "SELECT download_url, download_url_expira FROM sp_items WHERE id = ? AND download_url IS NOT NULL",
+            (item_id,),
+        )
+        row = cur.fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def sp_items_subarbol(drive_id: str, root_id: str) -> List[Dict]:
+    """
+    Archivos bajo root_id (a cualquier profundidad), cada uno con `carpeta`:
+    el nombre de su carpeta de primer nivel bajo root_id, o None si está
+    directamente en root_id. Se recorre solo ese subárbol (por parent_id).
+    """
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            WITH RECURSIVE sub(id, is_folder, carpeta) AS (
+                SELECT id, is_folder, CASE WHEN is_folder THEN name END
+                FROM sp_items
+                WHERE drive_id = ? AND parent_id = ?
+                UNION
+                SELECT c.id, c.is_folder, sub.carpeta
+                FROM sp_items c JOIN sub ON c.parent_id = sub.id
+                WHERE sub.is_folder AND c.drive_id = ?
+            )
+            SELECT i.id, sub.carpeta, i.name, i.last_modified, i.size,
+                   i.download_url, i.download_url_expira
+            FROM sub JOIN sp_items i ON i.id = sub.id
+            WHERE NOT sub.is_folder
+            """,
+            (drive_id, root_id, drive_id),
+        )
+        rows = cur.fetchall()
+    return [
+        {
+            "id": r[0],
+            "carpeta": r[1],
+            "name": r[2],
+            "last_modified": r[3],
+            "size": r[4],
+            "download_url": r[5],
+            "download_url_expira": r[6],
+        }
+        for r in rows
+    ]
+
+
+def mail_delta_get(folder: str) -> Optional[str]:
+    """deltaLink guardado para la carpeta de correo, o None."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT delta_link FROM mail_delta WHERE folder = ?", (folder,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def mail_reset(folder: str) -> None:
+    """Borra los mensajes guardados de una carpeta y su deltaLink."""
+    with get_conn() as conn:
+        conn.execute("DELETE FROM mail_messages WHERE folder = ?", (folder,))
+        conn.execute("DELETE FROM mail_delta WHERE folder = ?", (folder,))
+
+
+def mail_apply(
+    folder: str,
+    upserts: List[tuple],
+    deletes: List[str],
+    delta_link: Optional[str],
+) -> None:
+    """
+    Aplica en una transacción una página de messages/delta.
+    upserts: (id, received, sender, subject, has_attachments, n_siniestro)
+    """
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    with get_conn() as conn:
+        if deletes:
+            conn.executemany(
+                "DELETE FROM mail_messages WHERE id = ?", [(i,) for i in deletes]
+            )
+        if upserts:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO mail_messages
+                    (id, folder, received, sender, subject, has_attachments, n_siniestro)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(u[0], folder) + tuple(u[1:]) for u in upserts],
+            )
+        if delta_link:
+            conn.execute(
+                "INSERT OR REPLACE INTO mail_delta (folder, delta_link, updated) VALUES (?, ?, ?)",
+                (folder, delta_link, now),
+            )
+
+
+def _fila_mail(r) -> Dict:
+    return {
+        "id": r[0],
+        "fecha": r[1],
+        "remitente": r[2] or "",
+        "asunto": r[3] or "",
+        "tiene_adjuntos": bool(r[4]),
+        "n_siniestro_detectado": r[5],
+    }
+
+
+def mail_list(folder: str, limit: Optional[int] = None) -> List[Dict]:
+    """Mensajes de la carpeta, del más reciente al más antiguo."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            SELECT id, received, sender, subject, has_attachments, n_siniestro
+            FROM mail_messages
+            WHERE folder = ?
+            ORDER BY received DESC
+            LIMIT ?
+            """,
+            (folder, -1 if limit is None else limit),
+        )
+        rows = cur.fetchall()
+    return [_fila_mail(r) for r in rows]
+
+
+def mail_pagina(
+    folder: str,
+    limit: int,
+    antes: Optional[Tuple[str, str]] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    remitente: Optional[str] = None,
+    numero: Optional[str] = None,
+    clasificado: Optional[bool] = None,
+) -> List[Dict]:
+    """
+    Una página de mensajes de la carpeta, del más reciente al más antiguo, con
+    su N° de siniestro clasificado (n_siniestro). `antes` es (received, id) de
+    la última fila de la página anterior: se sigue por el índice desde ahí, así
+    que una página profunda cuesta lo mismo que la primera. desde/hasta son
+    fechas ISO (hasta excluida); remitente busca por contenido.
+    """
+    sql = """
+        SELECT m.id, m.received, m.sender, m.subject, m.has_attachments, m.n_siniestro, c.n_siniestro
+        FROM mail_messages m
+        LEFT JOIN clasif_siniestros c ON c.clave = m.id
+        WHERE m.folder = ?
+    """
+    params: list = [folder]
+    if antes:
+        sql += " AND (m.received, m.id) < (?, ?)"
+        params += list(antes)
+    if desde:
+        sql += " AND m.received >= ?"
+        params.append(desde)
+    if hasta:
+        sql += " AND m.received < ?"
+        params.append(hasta)
+    if remitente:
+        sql += " AND m.sender LIKE ? ESCAPE '\\'"
+        escapado = remitente.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{escapado}%")
+    if numero:
+        sql += " AND c.n_siniestro = ?"
+        params.append(numero)
+    if clasificado is True:
+        sql += " AND c.n_siniestro IS NOT NULL"
+    elif clasificado is False:
+        sql += " AND c.n_siniestro IS NULL"
+    sql += " ORDER BY m.received DESC, m.id DESC LIMIT ?"
+    params.append(limit)
+
+    with get_conn() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    mails = []
+    for r in rows:
+        mail = _fila_mail(r)
+        mail["n_siniestro"] = r[6]
+        mails.append(mail)
+    return mails
+
+
+def mail_por_siniestro(n_siniestro: str) -> List[Dict]:
+    """Mensajes cuyo asunto trae ese N° de siniestro."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            SELECT id, received, sender, subject, has_attachments, n_siniestro
+            FROM mail_messages
+            WHERE n_siniestro = ?
+            ORDER BY received DESC
+            """,
+            (n_siniestro,),
+        )
+        rows = cur.fetchall()
+    return [_fila_mail(r) for r in rows]
+
+
+def adj_get(mail_id: str, att_id: str, ahora: float) -> Optional[Dict]:
+    """Adjunto cacheado (y marca su blob como recién usado), o None."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            SELECT c.sha256, c.name, c.content_type, b.size
+            FROM attachment_cache c
+            JOIN attachment_blobs b ON b.sha256 = c.sha256
+            WHERE c.mail_id = ? AND c.att_id = ?
+            """,
+            (mail_id, att_id),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE attachment_blobs SET last_access = ? WHERE sha256 = ?",
+            (ahora, row[0]),
+        )
+    return {"sha256": row[0], "name": row[1], "content_type": row[2], "size": row[3]}
+
+
+def adj_put(
+    mail_id: str,
+    att_id: str,
+    sha256: str,
+    size: int,
+    name: str,
+    content_type: str,
+    ahora: float,
+    conn=None,
+) -> None:
+    """Registra un blob (si no existía) y la clave (mail_id, att_id) que apunta a él."""
+    if conn is None:
+        with get_conn() as conn:
+            return adj_put(mail_id, att_id, sha256, size, name, content_type, ahora, conn)
+    conn.execute(
+        """
+        INSERT INTO attachment_blobs (sha256, size, last_access) VALUES (?, ?, ?)
+        ON CONFLICT(sha256) DO UPDATE SET last_access = excluded.last_access
+        """,
+        (sha256, size, ahora),
+    )
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO attachment_cache
+            (mail_id, att_id, sha256, name, content_type)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (mail_id, att_id, sha256, name, content_type),
+    )
+
+
+def adj_total_size(conn=None) -> int:
+    if conn is None:
+        with get_conn() as conn:
+            return adj_total_size(conn)
+    cur = conn.execute("SELECT COALESCE(SUM(size), 0) FROM attachment_blobs")
+    return int(cur.fetchone()[0])
+
+
+def adj_lru(limit: int = 50, conn=None) -> List[tuple]:
+    """(sha256, size) de los blobs menos usados recientemente."""
+    if conn is None:
+        with get_conn() as conn:
+            return adj_lru(limit, conn)
+    cur = conn.execute(
+        "SELECT sha256, size FROM attachment_blobs ORDER BY last_access ASC LIMIT ?",
+        (limit,),
+    )
+    return [(r[0], int(r[1])) for r in cur.fetchall()]
+
+
+def adj_delete_blob(sha256: str, conn=None) -> None:
+    """Borra un blob y todas las claves que apuntan a él."""
+    if conn is None:
+        with get_conn() as conn:
+            return adj_delete_blob(sha256, conn)
+    conn.execute("DELETE FROM attachment_cache WHERE sha256 = ?", (sha256,))
+    conn.execute("DELETE FROM attachment_blobs WHERE sha256 = ?", (sha256,))
+
+
+def adj_bajo_bloqueo(fn):
+    """
+    Ejecuta fn(conn) en una transacción con el bloqueo de escritura tomado
+    desde el inicio (BEGIN IMMEDIATE): entre procesos (workers de gunicorn)
+    solo uno coloca o expulsa blobs de la caché de adjuntos a la vez.
+    """
+    with get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        return fn(conn)
+
+
+def migrar_una_vez(nombre: str, fn) -> bool:
+    """
+    Ejecuta fn(conn) dentro de una transacción solo si la migración `nombre`
+    no se aplicó antes (aunque varios procesos arranquen a la vez).
+    Devuelve True si la aplicó este llamado.
+    """
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    with get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute("SELECT 1 FROM migraciones WHERE nombre = ?", (nombre,))
+        if cur.fetchone():
+            return False
+        fn(conn)
+        conn.execute(
+            "INSERT INTO migraciones (nombre, aplicada) VALUES (?, ?)", (nombre, now)
+        )
+    return True
+
+
+class ConflictoVersion(Exception):
+    """Los datos cambiaron (otro usuario/proceso) desde la versión que se leyó."""
+
+
+def version_get(nombre: str) -> int:
+    """Contador de cambios de un conjunto de datos (0 si nunca cambió)."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT version FROM versiones WHERE nombre = ?", (nombre,))
+        row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _version_subir(conn, nombre: str) -> None:
+    conn.execute(
+        """
+        INSERT INTO versiones (nombre, version) VALUES (?, 1)
+        ON CONFLICT(nombre) DO UPDATE SET version = version + 1
+        """,
+        (nombre,),
+    )
+
+
+def clasif_siniestros_todas() -> Dict[str, str]:
+    """Mapa clave de correo -> N° de siniestro."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT clave, n_siniestro FROM clasif_siniestros")
+        return dict(cur.fetchall())
+
+
+def clasif_siniestros_aplicar(cambios: Dict[str, Optional[str]], conn=None) -> None:
+    """
+    Aplica en una transacción solo las filas cambiadas:
+    numero -> upsert, None -> se borra la clasificación.
+    La clave es el ID de Graph del correo (o una clave antigua por migrar).
+    """
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    upserts = [(k, v, now) for k, v in cambios.items() if v]
+    deletes = [(k,) for k, v in cambios.items() if not v]
+
+    def aplicar(c):
+        _version_subir(c, "clasif_siniestros")
+        if deletes:
+            c.executemany("DELETE FROM clasif_siniestros WHERE clave = ?", deletes)
+        if upserts:
+            c.executemany(
+                """
+                INSERT INTO clasif_siniestros (clave, n_siniestro, updated)
+                VALUES (?, ?, ?)
+                ON CONFLICT(clave) DO UPDATE SET
+                    n_siniestro = excluded.n_siniestro,
+                    updated = excluded.updated
+                """,
+                upserts,
+            )
+
+    if conn is not None:
+        aplicar(conn)
+        return
+    with get_conn() as conn:
+        aplicar(conn)
+
+
+def _con_version(nombre: str, esperada: Optional[int], fn) -> int:
+    """
+    Ejecuta fn(conn) en una transacción solo si la versión de `nombre` sigue
+    siendo `esperada` (None = sin chequeo). Devuelve la versión nueva; lanza
+    ConflictoVersion si alguien escribió antes.
+    """
+    with get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute("SELECT version FROM versiones WHERE nombre = ?", (nombre,))
+        row = cur.fetchone()
+        actual = row[0] if row else 0
+        if esperada is not None and esperada != actual:
+            raise ConflictoVersion(f"{nombre}: versión {esperada}, actual {actual}")
+        fn(conn)
+        _version_subir(conn, nombre)
+    return actual + 1
+
+
+def bancos_polizas_todas() -> set:
+    """Nombres de PDFs de pólizas marcadas con banco beneficiario."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT nombre FROM bancos_polizas")
+        return {r[0] for r in cur.fetchall()}
+
+
+def bancos_polizas_guardar(seleccion: set, version: Optional[int] = None) -> int:
+    """Deja la selección igual a `seleccion`, escribiendo solo las diferencias."""
+    now = datetime.utcnow().isoformat(timespec="seconds")
+
+    def aplicar(conn):
+        actuales = {r[0] for r in conn.execute("SELECT nombre FROM bancos_polizas")}
+        conn.executemany(
+            "DELETE FROM bancos_polizas WHERE nombre = ?",
+            [(n,) for n in actuales - set(seleccion)],
+        )
+        conn.executemany(
+            "INSERT INTO bancos_polizas (nombre, updated) VALUES (?, ?)",
+            [(n, now) for n in set(seleccion) - actuales],
+        )
+
+    return _con_version("bancos_polizas", version, aplicar)
+
+
+def bancos_correos_todos() -> Dict[str, List[Dict]]:
+    """{carpeta: [correos]} en el orden en que se clasificaron."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            "SELECT carpeta, mail_id, fecha, remitente, asunto FROM bancos_correos ORDER BY rowid"
+        )
+        rows = cur.fetchall()
+    resultado: Dict[str, List[Dict]] = {}
+    for carpeta, mail_id, fecha, remitente, asunto in rows:
+        resultado.setdefault(carpeta, []).append(
+            {"id": mail_id, "fecha": fecha, "remitente": remitente, "asunto": asunto}
+        )
+    return resultado
+
+
+def bancos_correos_asignar(filas: List[tuple], conn=None) -> int:
+    """
+    Asigna correos pendientes a subcarpetas: filas (mail_id, carpeta, fecha,
+    remitente, asunto). Solo toca esas filas; un correo que otro usuario ya
+    asignó no se pisa. Devuelve cuántos se asignaron.
+    """
+    now = datetime.utcnow().isoformat(timespec="seconds")
+
+    def aplicar(c) -> int:
+        antes = c.total_changes
+        c.executemany(
+            """
+            INSERT INTO bancos_correos (mail_id, carpeta, fecha, remitente, asunto, updated)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(mail_id) DO NOTHING
+            """,
+            [tuple(f) + (now,) for f in filas],
+        )
+        asignados = c.total_changes - antes
+        if asignados:
+            _version_subir(c, "bancos_correos")
+        return asignados
+
+    if conn is not None:
+        return aplicar(conn)
+    with get_conn() as conn:
+        return aplicar(conn)
+
+
+# outbox: un correo queda aquí hasta que el SMTP lo acepta; recién entonces se
+# registran sus filas en alerts (una por fileid).
+def outbox_agregar(
+    asunto: str,
+    cuerpo: str,
+    remitente: str,
+    destinatarios: str,
+    fileids: Iterable[int] = (),
+    categoria: str = "nuevo_pdf",
+) -> int:
+    """Encola un correo para enviar ya. Devuelve su id."""
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO outbox (asunto, cuerpo, remitente, destinatarios, fileids, categoria, proximo, creado)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING id
+            """,
+            (asunto, cuerpo, remitente, destinatarios, json.dumps([int(f) for f in fileids]),
+             categoria, time.time(), now),
+        )
+        return int(cur.fetchone()[0])
+
+
+def outbox_listos(ahora: float, limit: int = 100) -> List[Dict]:
+    """Correos pendientes cuyo próximo intento ya venció, del más antiguo al más nuevo."""
+    with get_conn() as conn:
+        cur = conn.execute(
+            """
+            SELECT id, asunto, cuerpo, remitente, destinatarios, fileids, categoria, intentos
+            FROM outbox
+            WHERE estado = 'pendiente' AND proximo <= ?
+            ORDER BY proximo, id
+            LIMIT ?
+            """,
+            (ahora, limit),
+        )
+        return [
+            {
+                "id": r[0],
+                "asunto": r[1],
+                "cuerpo": r[2],
+                "remitente": r[3],
+                "destinatarios": r[4],
+                "fileids": json.loads(r[5]),
+                "categoria": r[6],
+                "intentos": r[7],
+            }
+            for r in cur.fetchall()
+        ]
+
+
+def outbox_proximo() -> Optional[float]:
+    """Momento (epoch) del próximo intento pendiente, o None si no hay."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT MIN(proximo) FROM outbox WHERE estado = 'pendiente'")
+        return cur.fetchone()[0]
+
+
+def outbox_enviado(fila: Dict) -> None:
+    """Marca el correo como enviado y registra una alerta por cada fileid."""
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    with get_conn() as conn:
+        conn.execute(
+            "UPDATE outbox SET estado = 'enviado', enviado = ?, error = NULL, intentos = intentos + 1 WHERE id = ?",
+            (now, fila["id"]),
+        )
+        conn.executemany(
+            """
+            INSERT INTO alerts (fileid, subject, toemail, senttime, category)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            ((fileid, fila["asunto"], fila["destinatarios"], now, fila["categoria"]) for fileid in fila["fileids"]),
+        )
+
+
+def outbox_fallo(outbox_id: int, error: str, proximo: Optional[float]) -> None:
+    """Registra un intento fallido; con proximo=None se da por perdido."""
+    with get_conn() as conn:
+        if proximo is None:
+            conn.execute(
+                "UPDATE outbox SET estado = 'fallido', error = ?, intentos = intentos + 1 WHERE id = ?",
+                (error, outbox_id),
+            )
+        else:
+            conn.execute(
+                "UPDATE outbox SET error = ?, proximo = ?, intentos = intentos + 1 WHERE id = ?",
+                (error, proximo, outbox_id),
+            )
+
+
+def outbox_pendiente_para(fileid: int, category: Optional[str] = None) -> bool:
+    """Indica si hay un correo pendiente que incluye ese fileid."""
+    with get_conn() as conn:
+        sql = """
+            SELECT 1 FROM outbox, json_each(outbox.fileids)
+            WHERE outbox.estado = 'pendiente' AND json_each.value = ?
+        """
+        params: tuple = (fileid,)
+        if category:
+            sql += " AND outbox.categoria = ?"
+            params += (category,)
+        cur = conn.execute(sql + " LIMIT 1", params)
+        return cur.fetchone() is not None
+
+
+def outbox_stats() -> Dict[str, int]:
+    """{estado: cantidad} de la tabla outbox."""
+    with get_conn() as conn:
+        cur = conn.execute("SELECT estado, COUNT(*) FROM outbox GROUP BY estado")
+        return {r[0]: r[1] for r in cur.fetchall()}
@@ -0,0 +1,81 @@
+# estado_bancos.py
+# -- coding: utf-8 --
+# Estado compartido de la página /bancos entre workers: pólizas marcadas con
+# banco beneficiario y correos de Bancos asignados a subcarpetas. Vive en
+# SQLite (db.bancos_polizas / db.bancos_correos); cada worker guarda una
+# copia en memoria y la recarga solo cuando cambia su contador en
+# db.versiones. La selección de pólizas se guarda con la versión que vio el
+# usuario (db.ConflictoVersion si otro guardó antes); los correos se asignan
+# fila a fila sin pisar los que otro usuario ya clasificó.
+
+import threading
+from typing import Dict, List, Optional, Set
+
+import db
+
+POLIZAS = "bancos_polizas"
+CORREOS = "bancos_correos"
+
+
+class EstadoBancos:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version_polizas: Optional[int] = None
+        self.version_correos: Optional[int] = None
+        self._polizas: Set[str] = set()
+        self._correos: Dict[str, List[Dict]] = {}
+        self.recargas = 0
+        self.conflictos = 0
+
+    def refrescar(self) -> None:
+        """Recarga lo que otro worker haya cambiado (un SELECT por conjunto)."""
+        v_polizas = db.version_get(POLIZAS)
+        v_correos = db.version_get(CORREOS)
+        if v_polizas == self.version_polizas and v_correos == self.version_correos:
+            return
+        with self._lock:
+            if v_polizas != self.version_polizas:
+                self._polizas = db.bancos_polizas_todas()
+                self.version_polizas = v_polizas
+                self.recargas += 1
+            if v_correos != self.version_correos:
+                self._correos = db.bancos_correos_todos()
+                self.version_correos = v_correos
+                self.recargas += 1
+
+    def polizas_benef_banco(self) -> Set[str]:
+        return self._polizas
+
+    def correos_clasificados(self) -> Dict[str, List[Dict]]:
+        return self._correos
+
+    def guardar_polizas(self, seleccion: Set[str], version: Optional[int]) -> None:
+        try:
+            db.bancos_polizas_guardar(seleccion, version)
+        except db.ConflictoVersion:
+            self.conflictos += 1
+            raise
+        finally:
+            self.refrescar()
+
+    def asignar_correos(self, filas: List[tuple]) -> int:
+        """
+        filas: (mail_id, carpeta, fecha, remitente, asunto). Devuelve cuántos
+        correos quedaron sin asignar porque otro usuario los clasificó antes.
+        """
+        if not filas:
+            return 0
+        try:
+            omitidos = len(filas) - db.bancos_correos_asignar(filas)
+        finally:
+            self.refrescar()
+        self.conflictos += omitidos
+        return omitidos
+
+    def stats(self) -> Dict:
+        return {
+            "version_polizas": self.version_polizas,
+            "version_correos": self.version_correos,
+            "recargas": self.recargas,
+            "conflictos": self.conflictos,
+        }
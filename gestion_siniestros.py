@@ -1,23 +1,16 @@
-import json
-from pathlib import Path
-
-RUTA_CLASIF = Path("clasificacion_siniestros.json")
+import db
 
 
 def cargar():
-    if not RUTA_CLASIF.exists():
-        return {}
-    with RUTA_CLASIF.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    return {str(k): str(v) for k, v in data.items()}
+    return db.clasif_siniestros_todas()
 
 
-def guardar(mapa: dict[str, str]) -> None:
-    with RUTA_CLASIF.open("w", encoding="utf-8") as f:
-        json.dump(mapa, f, ensure_ascii=False, indent=2)
+def guardar(cambios: dict[str, str | None]) -> None:
+    db.clasif_siniestros_aplicar(cambios)
 
 
 def main():
+    db.initdb()
     datos = cargar()
     print(f"Hay {len(datos)} correos clasificados.")
     print("Opciones:")
@@ -34,15 +27,13 @@ def main():
         mid = input("ID mail: ").strip()
         nro = input("N° siniestro: ").strip()
         if mid and nro:
-            datos[mid] = nro
-            guardar(datos)
+            guardar({mid: nro})
             print("Guardado.")
 
     elif op == "3":
         mid = input("ID mail a borrar: ").strip()
         if mid in datos:
-            datos.pop(mid)
-            guardar(datos)
+            guardar({mid: None})
             print("Borrado.")
 
 
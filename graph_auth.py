@@ -0,0 +1,191 @@
+# graph_auth.py
+# -- coding: utf-8 --
+# Proveedor único de tokens de aplicación (client credentials) para Microsoft Graph.
+# Mantiene un ConfidentialClientApplication por tenant/credenciales y cachea el
+# token en memoria hasta poco antes de su expiración.
+
+import asyncio
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import msal
+
+GRAPH_SCOPE = ["https://graph.microsoft.com/.default"]
+
+# Segundos antes de expires_in en que el token ya no se entrega (renovación bloqueante)
+MARGEN_EXPIRACION = 60
+# Segundos antes de expires_in en que se renueva en segundo plano.
+# Debe ser menor a 300: MSAL entrega su propio token cacheado si le quedan más de 5 min.
+MARGEN_REFRESCO = 240
+
+
+class TokenProvider:
+    """Token de Graph cacheado para un juego de credenciales."""
+
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str,
+                 scopes: Optional[list] = None):
+        self.tenant_id = tenant_id
+        self.scopes = list(scopes or GRAPH_SCOPE)
+        self._app = msal.ConfidentialClientApplication(
+            client_id=client_id,
+            client_credential=client_secret,
+            authority=f"https://login.microsoftonline.com/{tenant_id}",
+        )
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expira: float = 0.0
+        # último token reemplazado: un 401 tardío con él también se reconoce
+        self._anterior: Optional[str] = None
+        self._refrescando = False
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def _pedir_token(self) -> None:
+        """Pide un token a Azure AD y lo deja en caché. Llamar con el lock tomado."""
+        result = self._app.acquire_token_for_client(scopes=self.scopes)
+        if "access_token" not in result:
+            self.errors += 1
+            raise RuntimeError(
+                f"No se pudo obtener token de Graph: "
+                f"{result.get('error')} {result.get('error_description')}"
+            )
+        if self._token and self._token != result["access_token"]:
+            self._anterior = self._token
+        self._token = result["access_token"]
+        self._expira = time.monotonic() + int(result.get("expires_in", 3599))
+
+    def _refrescar_en_segundo_plano(self) -> None:
+        try:
+            with self._lock:
+                if self._expira - time.monotonic() > MARGEN_REFRESCO:
+                    return  # otro hilo ya lo renovó
+                self._pedir_token()
+                self.refreshes += 1
+        except Exception as e:
+            print("[GRAPH] Error al renovar token en segundo plano:", e)
+        finally:
+            self._refrescando = False
+
+    def get_token(self) -> str:
+        restante = self._expira - time.monotonic()
+        token = self._token
+        if token and restante > MARGEN_EXPIRACION:
+            self.hits += 1
+            if restante <= MARGEN_REFRESCO and not self._refrescando:
+                self._refrescando = True
+                threading.Thread(
+                    target=self._refrescar_en_segundo_plano, daemon=True
+                ).start()
+            return token
+
+        # Token ausente o por vencer: un solo hilo lo pide, el resto espera.
+        with self._lock:
+            if self._token and self._expira - time.monotonic() > MARGEN_EXPIRACION:
+                self.hits += 1
+                return self._token
+            self.misses += 1
+            self._pedir_token()
+            return self._token
+
+    async def get_token_async(self) -> str:
+        """Como get_token, pero si hay que pedir token a Azure AD lo hace en un hilo."""
+        if self._token and self._expira - time.monotonic() > MARGEN_REFRESCO:
+            self.hits += 1
+            return self._token
+        return await asyncio.to_thread(self.get_token)
+
+    def invalidar(self) -> None:
+        """Descarta el token actual (por ejemplo, tras un 401 de Graph)."""
+        with self._lock:
+            self._descartar(self._token)
+
+    def _descartar(self, token: Optional[str]) -> None:
+        """Saca `token` de esta caché y de la de MSAL. Llamar con el lock tomado."""
+        if token:
+            cache = self._app.token_cache
+            for at in cache.search(msal.TokenCache.CredentialType.ACCESS_TOKEN):
+                if at.get("secret") == token:
+                    cache.remove_at(at)
+            self._anterior = token
+        self._token = None
+        self._expira = 0.0
+
+    def emitio(self, token: str) -> bool:
+        """True si `token` es el actual o el anterior de este proveedor."""
+        return token in (self._token, self._anterior)
+
+    def renovar(self, rechazado: str) -> str:
+        """
+        Token nuevo tras un 401 con `rechazado`. Si otro hilo ya lo renovó
+        se entrega ese, sin volver a pedir a Azure AD.
+        """
+        with self._lock:
+            if self._token == rechazado:
+                self._descartar(rechazado)
+        return self.get_token()
+
+    def stats(self) -> Dict:
+        return {
+            "tenant_id": self.tenant_id,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "expira_en_s": max(0, int(self._expira - time.monotonic())),
+        }
+
+
+_PROVEEDORES: Dict[Tuple[str, str, str], TokenProvider] = {}
+_PROVEEDORES_LOCK = threading.Lock()
+
+
+def get_provider(tenant_id: str, client_id: str, client_secret: str) -> TokenProvider:
+    """Devuelve el proveedor (único por proceso) para esas credenciales."""
+    clave = (tenant_id, client_id, client_secret)
+    prov = _PROVEEDORES.get(clave)
+    if prov is None:
+        with _PROVEEDORES_LOCK:
+            prov = _PROVEEDORES.get(clave)
+            if prov is None:
+                prov = TokenProvider(tenant_id, client_id, client_secret)
+                _PROVEEDORES[clave] = prov
+    return prov
+
+
+def get_token(tenant_id: str, client_id: str, client_secret: str) -> str:
+    """Token vigente para esas credenciales; lanza RuntimeError si Azure AD falla."""
+    return get_provider(tenant_id, client_id, client_secret).get_token()
+
+
+async def get_token_async(tenant_id: str, client_id: str, client_secret: str) -> str:
+    """Versión para código async: no bloquea el event loop al renovar."""
+    return await get_provider(tenant_id, client_id, client_secret).get_token_async()
+
+
+def descartar(rechazado: str) -> None:
+    """Tras un 401 de Graph: el próximo get_token pedirá uno nuevo."""
+    for prov in list(_PROVEEDORES.values()):
+        if prov.emitio(rechazado):
+            with prov._lock:
+                if prov._token == rechazado:
+                    prov._descartar(rechazado)
+
+
+async def renovar_async(rechazado: str) -> Optional[str]:
+    """
+    Tras un 401 de Graph: descarta `rechazado` en el proveedor que lo emitió
+    y devuelve un token nuevo. None si el token no es de ningún proveedor.
+    """
+    for prov in list(_PROVEEDORES.values()):
+        if prov.emitio(rechazado):
+            return await asyncio.to_thread(prov.renovar, rechazado)
+    return None
+
+
+def stats() -> list[Dict]:
+    """Contadores hit/miss/refresh de todos los proveedores del proceso."""
+    return [p.stats() for p in list(_PROVEEDORES.values())]
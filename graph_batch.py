@@ -0,0 +1,80 @@
+# graph_batch.py
+# -- coding: utf-8 --
+# Cliente mínimo para JSON $batch de Microsoft Graph: junta varias peticiones
+# GET independientes en un solo POST /$batch y devuelve cada sub-respuesta
+# en el mismo orden en que se pidió.
+
+import asyncio
+import json
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+
+import graph_client
+
+GRAPH_BASE = graph_client.GRAPH_BASE
+# Límite de Graph: 20 sub-peticiones por $batch
+MAX_POR_BATCH = 20
+
+
+class SubRespuesta:
+    """Respuesta de una sub-petición, con la misma forma básica que requests.Response."""
+
+    def __init__(self, status_code: int, headers: Optional[Dict], body):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+    def json(self):
+        if isinstance(self.body, (dict, list)):
+            return self.body
+        return json.loads(self.body or "null")
+
+    @property
+    def text(self) -> str:
+        if isinstance(self.body, (dict, list)):
+            return json.dumps(self.body, ensure_ascii=False)
+        return str(self.body or "")
+
+
+def peticion(url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None) -> Dict:
+    """Arma una sub-petición GET. url es relativa a /v1.0 (ej. '/users/x/messages')."""
+    if params:
+        url = f"{url}?{urlencode(params, safe='$,')}"
+    req = {"method": "GET", "url": url}
+    if headers:
+        req["headers"] = headers
+    return req
+
+
+async def ejecutar(token: str, peticiones: List[Dict]) -> List[SubRespuesta]:
+    """
+    Envía las peticiones en uno o más $batch (de a 20, en paralelo) y devuelve
+    las sub-respuestas en el mismo orden. Si el POST completo falla, cada
+    sub-respuesta lleva el status y el texto del error global.
+    """
+    resultado: List[Optional[SubRespuesta]] = [None] * len(peticiones)
+
+    async def enviar(inicio: int) -> None:
+        bloque = peticiones[inicio:inicio + MAX_POR_BATCH]
+        cuerpo = {
+            "requests": [
+                dict(p, id=str(inicio + i)) for i, p in enumerate(bloque)
+            ]
+        }
+        resp = await graph_client.post(f"{GRAPH_BASE}/$batch", token=token, json=cuerpo)
+        if resp.status_code != 200:
+            print("[GRAPH] Error en $batch:", resp.status_code, resp.text)
+            for i in range(len(bloque)):
+                resultado[inicio + i] = SubRespuesta(resp.status_code, {}, resp.text)
+            return
+
+        for r in resp.json().get("responses", []):
+            idx = int(r["id"])
+            resultado[idx] = SubRespuesta(r.get("status", 500), r.get("headers"), r.get("body"))
+
+    await asyncio.gather(*(enviar(i) for i in range(0, len(peticiones), MAX_POR_BATCH)))
+
+    # Graph siempre responde todas las sub-peticiones; por si acaso, las
+    # que falten se marcan como error.
+    return [r if r is not None else SubRespuesta(500, {}, "Sin respuesta en $batch")
+            for r in resultado]
@@ -0,0 +1,87 @@
+# graph_cache.py
+# -- coding: utf-8 --
+# Caché TTL para IDs de Graph que casi nunca cambian (sitio, drive, carpetas).
+# Vive en memoria y, opcionalmente, en la tabla graph_cache de db.py para que
+# un reinicio parta con la caché caliente.
+
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import db
+
+
+class CacheTTL:
+    """Diccionario clave -> valor (serializable a JSON) con expiración."""
+
+    def __init__(self, nombre: str, ttl: float, persistente: bool = True):
+        self.nombre = nombre
+        self.ttl = ttl
+        self.persistente = persistente
+        self._datos: Dict[str, Tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.persistente:
+            try:
+                db.initdb()
+            except Exception as e:
+                print(f"[CACHE {nombre}] Sin persistencia en SQLite:", e)
+                self.persistente = False
+
+    def _clave_db(self, clave: str) -> str:
+        return f"{self.nombre}:{clave}"
+
+    def get(self, clave: str) -> Optional[Any]:
+        ahora = time.time()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada and entrada[1] > ahora:
+                self.hits += 1
+                return entrada[0]
+
+        if self.persistente:
+            try:
+                fila = db.cache_get(self._clave_db(clave), ahora)
+            except Exception as e:
+                print(f"[CACHE {self.nombre}] Error al leer SQLite:", e)
+                fila = None
+            if fila is not None:
+                valor = json.loads(fila[0])
+                with self._lock:
+                    self._datos[clave] = (valor, fila[1])
+                    self.hits += 1
+                return valor
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, clave: str, valor: Any) -> None:
+        expira = time.time() + self.ttl
+        with self._lock:
+            self._datos[clave] = (valor, expira)
+        if self.persistente:
+            try:
+                db.cache_set(self._clave_db(clave), json.dumps(valor), expira)
+            except Exception as e:
+                print(f"[CACHE {self.nombre}] Error al guardar en SQLite:", e)
+
+    def invalidar(self, clave: str) -> None:
+        with self._lock:
+            self._datos.pop(clave, None)
+        if self.persistente:
+            try:
+                db.cache_delete(self._clave_db(clave))
+            except Exception as e:
+                print(f"[CACHE {self.nombre}] Error al invalidar en SQLite:", e)
+
+    def stats(self) -> Dict:
+        return {
+            "nombre": self.nombre,
+            "entradas": len(self._datos),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
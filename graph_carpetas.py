@@ -0,0 +1,118 @@
+# graph_carpetas.py
+# -- coding: utf-8 --
+# Resuelve nombres de carpetas de correo (ej. "Seguros", "Bancos") a su ID de
+# Graph. El mapa nombre -> ID se cachea con TTL (graph_cache) y solo se vuelve
+# a escanear Inbox cuando falta un nombre o cuando se invalida.
+
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+import graph_cache
+import graph_client
+
+GRAPH_BASE = graph_client.GRAPH_BASE
+TTL = int(os.getenv("GRAPH_FOLDERS_TTL", str(24 * 3600)))
+# Mínimo de segundos entre dos escaneos pedidos por revalidar(), y tiempo
+# durante el cual get_id da por inexistente un nombre que no apareció
+MIN_REESCANEO = float(os.getenv("GRAPH_FOLDERS_MIN_REESCANEO", "60"))
+
+
+class ResolverCarpetas:
+    def __init__(self, ttl: float = TTL, persistente: bool = True):
+        self.cache = graph_cache.CacheTTL("carpetas_correo", ttl=ttl, persistente=persistente)
+        self._lock: Optional[asyncio.Lock] = None
+        # user -> momento (monotonic) del último escaneo
+        self._escaneado: Dict[str, float] = {}
+        # "user:nombre" -> momento del escaneo en que no apareció
+        self._ausentes: Dict[str, float] = {}
+        self.escaneos = 0
+
+    async def _escanear(self, token: str, user: str) -> Dict[str, str]:
+        """
+        Recorre Inbox y sus subcarpetas (en anchura, con paginación) y
+        devuelve {nombre: id}. Las subcarpetas directas de Inbox se registran
+        por su displayName; las anidadas además como "Padre/Hija".
+        """
+        mapa: Dict[str, str] = {}
+        pendientes = [("inbox", "")]
+        while pendientes:
+            parent_id, prefijo = pendientes.pop(0)
+            url: Optional[str] = f"{GRAPH_BASE}/users/{user}/mailFolders/{parent_id}/childFolders"
+            params: Optional[Dict] = {"$top": 100, "$select": "id,displayName,childFolderCount"}
+            while url:
+                resp = await graph_client.get(url, token=token, params=params, timeout=15)
+                if resp.status_code != 200:
+                    print("[GRAPH] Error al listar carpetas:", resp.status_code, resp.text)
+                    break
+                data = resp.json()
+                for f in data.get("value", []):
+                    nombre = f.get("displayName") or ""
+                    ruta = f"{prefijo}/{nombre}" if prefijo else nombre
+                    mapa[ruta] = f["id"]
+                    # un nombre anidado no pisa a una carpeta directa de Inbox
+                    mapa.setdefault(nombre, f["id"])
+                    if f.get("childFolderCount"):
+                        pendientes.append((f["id"], ruta))
+                url = data.get("@odata.nextLink")
+                params = None
+        self.escaneos += 1
+        return mapa
+
+    async def get_id(self, token: str, user: str, nombre: str) -> Optional[str]:
+        """
+        ID de la carpeta `nombre` (o 'Padre/Hija'); None si no existe. Un
+        nombre que no apareció en un escaneo no provoca otro hasta pasados
+        MIN_REESCANEO segundos.
+        """
+        clave = f"{user}:{nombre}"
+        folder_id = self.cache.get(clave)
+        if folder_id or self._ausente(clave):
+            return folder_id
+
+        # Falta en caché: una sola corrutina reescanea, el resto reutiliza el resultado
+        async with self._get_lock():
+            folder_id = self.cache.get(clave)
+            if folder_id or self._ausente(clave):
+                return folder_id
+            mapa = await self._escanear_y_guardar(token, user)
+            if nombre not in mapa:
+                self._ausentes[clave] = time.monotonic()
+        return mapa.get(nombre)
+
+    def _ausente(self, clave: str) -> bool:
+        desde = self._ausentes.get(clave)
+        return desde is not None and time.monotonic() - desde < MIN_REESCANEO
+
+    async def revalidar(self, token: str, user: str, nombre: str) -> Optional[str]:
+        """
+        Como get_id, pero comprobando contra Graph (por si la carpeta cambió
+        de ID). Si el último escaneo de `user` tiene menos de MIN_REESCANEO
+        segundos no se vuelve a escanear y se devuelve el ID en caché.
+        """
+        async with self._get_lock():
+            ultimo = self._escaneado.get(user)
+            if ultimo is not None and time.monotonic() - ultimo < MIN_REESCANEO:
+                return self.cache.get(f"{user}:{nombre}")
+            mapa = await self._escanear_y_guardar(token, user)
+        return mapa.get(nombre)
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _escanear_y_guardar(self, token: str, user: str) -> Dict[str, str]:
+        mapa = await self._escanear(token, user)
+        for n, fid in mapa.items():
+            self.cache.set(f"{user}:{n}", fid)
+            self._ausentes.pop(f"{user}:{n}", None)
+        self._escaneado[user] = time.monotonic()
+        return mapa
+
+    def invalidar(self, user: str, nombre: str) -> None:
+        self.cache.invalidar(f"{user}:{nombre}")
+
+    def stats(self) -> Dict:
+        return dict(self.cache.stats(), escaneos=self.escaneos)
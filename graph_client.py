@@ -0,0 +1,138 @@
+# graph_client.py
+# -- coding: utf-8 --
+# Cliente HTTP asíncrono compartido para Microsoft Graph (httpx):
+# pool de conexiones con keep-alive, HTTP/2 si está instalado 'h2',
+# límite de concurrencia por host, timeouts y reintentos con backoff
+# ante 429/503/504 respetando Retry-After. Un 401 renueva el token (ver
+# graph_auth) y repite la petición una vez.
+
+import asyncio
+import importlib.util
+import os
+import random
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+import graph_auth
+
+GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+MAX_CONCURRENCIA_HOST = int(os.getenv("GRAPH_MAX_CONCURRENCIA", "16"))
+MAX_REINTENTOS = int(os.getenv("GRAPH_MAX_REINTENTOS", "4"))
+TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+REINTENTAR_STATUS = {429, 503, 504}
+
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_semaforos: Dict[str, asyncio.Semaphore] = {}
+
+stats = {"requests": 0, "reintentos": 0, "errores": 0, "renovaciones_token": 0}
+
+
+def get_client() -> httpx.AsyncClient:
+    """AsyncClient único por event loop (se recrea si el loop cambió)."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=_HTTP2,
+            timeout=TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENCIA_HOST * 2,
+                max_keepalive_connections=MAX_CONCURRENCIA_HOST,
+                keepalive_expiry=60,
+            ),
+        )
+        _client_loop = loop
+        _semaforos.clear()
+    return _client
+
+
+async def cerrar() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+def _semaforo(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    sem = _semaforos.get(host)
+    if sem is None:
+        sem = _semaforos[host] = asyncio.Semaphore(MAX_CONCURRENCIA_HOST)
+    return sem
+
+
+def _espera(resp: Optional[httpx.Response], intento: int) -> float:
+    """Segundos a esperar antes del reintento `intento` (Retry-After o backoff)."""
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), 60.0)
+    return min(0.5 * (2 ** intento), 30.0) + random.uniform(0, 0.25)
+
+
+async def request(
+    method: str,
+    url: str,
+    *,
+    token: Optional[str] = None,
+    headers: Optional[Dict] = None,
+    stream: bool = False,
+    **kwargs,
+) -> httpx.Response:
+    """
+    Hace la petición con reintentos. Con stream=True el cuerpo queda sin leer
+    y quien llama debe cerrar la respuesta (await resp.aclose()).
+    """
+    client = get_client()
+    headers = dict(headers or {})
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    intento = 0
+    renovado = False
+    while True:
+        resp: Optional[httpx.Response] = None
+        try:
+            async with _semaforo(url):
+                stats["requests"] += 1
+                req = client.build_request(method, url, headers=headers, **kwargs)
+                resp = await client.send(req, stream=stream)
+            if resp.status_code == 401 and token and not renovado:
+                renovado = True
+                try:
+                    nuevo = await graph_auth.renovar_async(token)
+                except RuntimeError as e:
+                    print("[GRAPH] No se pudo renovar el token tras 401:", e)
+                    nuevo = None
+                if nuevo:
+                    await resp.aclose()
+                    stats["renovaciones_token"] += 1
+                    token = nuevo
+                    headers["Authorization"] = f"Bearer {token}"
+                    continue
+            if resp.status_code not in REINTENTAR_STATUS or intento >= MAX_REINTENTOS:
+                return resp
+            if stream:
+                await resp.aclose()
+        except httpx.TransportError as e:
+            if intento >= MAX_REINTENTOS or method not in ("GET", "HEAD"):
+                stats["errores"] += 1
+                raise
+            print(f"[GRAPH] Error de red ({e!r}); reintentando.")
+
+        stats["reintentos"] += 1
+        await asyncio.sleep(_espera(resp, intento))
+        intento += 1
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs) -> httpx.Response:
+    return await request("POST", url, **kwargs)
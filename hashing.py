@@ -0,0 +1,133 @@
+# hashing.py
+# -- coding: utf-8 --
+# SHA-256 de PDFs para db.files. Lee en bloques grandes (o con mmap si el
+# archivo es muy grande) dentro de un pool de hilos: tanto la lectura como
+# hashlib sueltan el GIL, así que varios archivos se procesan en paralelo.
+# Si (path, size, mtime_ns) coincide con lo guardado en db.file_huellas no se
+# vuelve a leer el archivo: un re-escaneo sin cambios solo hace stat().
+
+import hashlib
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import db
+
+CHUNK = 1024 * 1024
+# Desde este tamaño se hashea vía mmap (sin copiar a un buffer de Python)
+MMAP_MIN = 64 * 1024 * 1024
+MAX_WORKERS = int(os.getenv("HASH_WORKERS", str(min(8, (os.cpu_count() or 2)))))
+
+
+def sha256_archivo(ruta: Path) -> str:
+    """SHA-256 del archivo, leído en bloques de CHUNK o con mmap."""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_MIN:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+        else:
+            buf = bytearray(CHUNK)
+            vista = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(vista[:n])
+    return h.hexdigest()
+
+
+class ServicioHash:
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hash")
+        self._lock = threading.Lock()
+        self.hasheados = 0
+        self.omitidos = 0
+        self.bytes_hasheados = 0
+
+    def _hashear(self, ruta: Path, size: int) -> str:
+        sha = sha256_archivo(ruta)
+        with self._lock:
+            self.hasheados += 1
+            self.bytes_hasheados += size
+        return sha
+
+    def huella(self, ruta: Path) -> Tuple[str, int, int, bool]:
+        """
+        (sha256, size, mtime_ns, recalculado) de un archivo. Si la huella
+        coincide con la guardada en db.file_huellas se devuelve ese sha256 sin
+        leerlo; si no, se hashea en el hilo que llama (los eventos del watcher
+        ya corren en un pool).
+        """
+        st = ruta.stat()
+        guardada = db.file_huella(str(ruta))
+        if guardada and guardada[0] == st.st_size and guardada[1] == st.st_mtime_ns:
+            with self._lock:
+                self.omitidos += 1
+            return guardada[2], st.st_size, st.st_mtime_ns, False
+        sha = self._hashear(ruta, st.st_size)
+        return sha, st.st_size, st.st_mtime_ns, True
+
+    def escanear(self, raiz: Path, patron: str = "*.pdf", registrar: bool = True) -> List[Dict]:
+        """
+        Recorre raiz (recursivo) y devuelve un dict por archivo:
+        {path, sha256, size, mtime_ns, recalculado, fileid}. Solo se leen los
+        archivos cuya huella cambió; con registrar=True se guardan en db.files
+        en una sola transacción (fileid queda en None si registrar=False).
+        """
+        guardadas = db.files_huellas()
+        resultado: List[Dict] = []
+        pendientes = []
+        for ruta in raiz.rglob(patron):
+            try:
+                st = ruta.stat()
+            except OSError:
+                continue
+            if not ruta.is_file():
+                continue
+            item = {
+                "path": ruta,
+                "sha256": None,
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "recalculado": False,
+                "fileid": None,
+            }
+            g = guardadas.get(str(ruta))
+            if g and g[0] == st.st_size and g[1] == st.st_mtime_ns:
+                item["sha256"] = g[2]
+                with self._lock:
+                    self.omitidos += 1
+            else:
+                pendientes.append((item, self._pool.submit(self._hashear, ruta, st.st_size)))
+            resultado.append(item)
+
+        for item, fut in pendientes:
+            try:
+                item["sha256"] = fut.result()
+                item["recalculado"] = True
+            except OSError as e:
+                print(f"[HASH] No se pudo leer {item['path']}:", e)
+        resultado = [r for r in resultado if r["sha256"]]
+
+        if registrar and resultado:
+            ids = db.upsert_files_bulk(
+                (r["path"], r["sha256"], r["size"], r["mtime_ns"]) for r in resultado
+            )
+            for r, fileid in zip(resultado, ids):
+                r["fileid"] = fileid
+        return resultado
+
+    def cerrar(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    def stats(self) -> Dict:
+        return {
+            "hasheados": self.hasheados,
+            "omitidos": self.omitidos,
+            "bytes_hasheados": self.bytes_hasheados,
+        }
@@ -0,0 +1,146 @@
+# mail_store.py
+# -- coding: utf-8 --
+# Almacén local (SQLite, ver db.mail_messages) de los encabezados de correo de
+# las carpetas Seguros y Bancos, alimentado por messages/delta de Graph.
+# La primera pasada trae toda la carpeta; las siguientes solo los cambios.
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+import db
+import graph_auth
+
+GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+INTERVALO = int(os.getenv("MAIL_SYNC_INTERVALO", "60"))
+CAMPOS = "subject,from,receivedDateTime,hasAttachments"
+
+_lock_sync = threading.Lock()
+
+
+def _fila(item: Dict, detectar: Optional[Callable[[str], Optional[str]]]) -> tuple:
+    asunto = item.get("subject") or ""
+    remitente = (
+        (item.get("from") or {})
+        .get("emailAddress", {})
+        .get("address", "")
+    )
+    return (
+        item["id"],
+        item.get("receivedDateTime"),
+        remitente,
+        asunto,
+        1 if item.get("hasAttachments") else 0,
+        detectar(asunto) if detectar else None,
+    )
+
+
+def sincronizar(
+    token: str,
+    user: str,
+    folder: str,
+    folder_id: str,
+    detectar: Optional[Callable[[str], Optional[str]]] = None,
+    session=None,
+) -> int:
+    """
+    Aplica al almacén los cambios de messages/delta de una carpeta.
+    folder es el nombre lógico (ej. "Seguros"); folder_id su ID en Graph.
+    Si el deltaLink expiró (410) se vuelve a enumerar la carpeta completa.
+    """
+    session = session or requests
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Prefer": "odata.maxpagesize=200",
+    }
+    inicial = f"{GRAPH_BASE}/users/{user}/mailFolders/{folder_id}/messages/delta?$select={CAMPOS}"
+
+    with _lock_sync:
+        url: Optional[str] = db.mail_delta_get(folder)
+        if url is None:
+            db.mail_reset(folder)
+            url = inicial
+
+        procesados = 0
+        while url:
+            resp = session.get(url, headers=headers, timeout=30)
+            if resp.status_code in (404, 410):
+                # 410: deltaLink vencido. 404: la carpeta cambió de ID.
+                db.mail_reset(folder)
+                if resp.status_code == 404:
+                    raise RuntimeError(f"Carpeta {folder} no encontrada en Graph (404)")
+                print(f"[MAIL STORE] deltaLink de {folder} expirado; resincronización completa.")
+                procesados = 0
+                url = inicial
+                continue
+            resp.raise_for_status()
+            data = resp.json()
+
+            upserts, deletes = [], []
+            for item in data.get("value", []):
+                if "@removed" in item:
+                    deletes.append(item["id"])
+                else:
+                    upserts.append(_fila(item, detectar))
+            procesados += len(upserts) + len(deletes)
+
+            db.mail_apply(folder, upserts, deletes, data.get("@odata.deltaLink"))
+            url = data.get("@odata.nextLink")
+        return procesados
+
+
+def listo(folder: str) -> bool:
+    """True si la carpeta ya tiene una enumeración completa en el almacén."""
+    try:
+        return db.mail_delta_get(folder) is not None
+    except Exception:
+        return False
+
+
+def listar(folder: str, limit: Optional[int] = None) -> List[Dict]:
+    """Mensajes guardados de la carpeta, del más reciente al más antiguo."""
+    return db.mail_list(folder, limit)
+
+
+def iniciar_en_segundo_plano(
+    resolver: Callable[[], Tuple[str, str, Iterable[Tuple[str, Optional[str]]]]],
+    detectar: Optional[Callable[[str], Optional[str]]] = None,
+    intervalo: int = INTERVALO,
+    al_fallar: Optional[Callable[[str], None]] = None,
+    al_sincronizar: Optional[Callable[[str, int], None]] = None,
+) -> threading.Thread:
+    """
+    Lanza un hilo daemon que sincroniza las carpetas cada `intervalo` segundos.
+    resolver() devuelve (token, user, [(folder, folder_id), ...]).
+    al_fallar(folder) se llama si una carpeta falla (ej. para invalidar su ID).
+    al_sincronizar(folder, n) se llama tras aplicar n > 0 cambios a una carpeta.
+    """
+    def bucle():
+        while True:
+            try:
+                token, user, carpetas = resolver()
+                for folder, folder_id in carpetas:
+                    if not folder_id:
+                        continue
+                    try:
+                        n = sincronizar(token, user, folder, folder_id, detectar)
+                        if n:
+                            print(f"[MAIL STORE] {folder}: {n} cambios aplicados.")
+                            if al_sincronizar:
+                                al_sincronizar(folder, n)
+                    except Exception as e:
+                        print(f"[MAIL STORE] Error al sincronizar {folder}:", e)
+                        if getattr(getattr(e, "response", None), "status_code", None) == 401:
+                            graph_auth.descartar(token)
+                        elif al_fallar:
+                            al_fallar(folder)
+            except Exception as e:
+                print("[MAIL STORE] Error al sincronizar:", e)
+            time.sleep(intervalo)
+
+    hilo = threading.Thread(target=bucle, name="mail-store", daemon=True)
+    hilo.start()
+    return hilo
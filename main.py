@@ -1,7 +1,6 @@
 from pathlib import Path
+import asyncio
 import os
-import msal
-import requests
 from typing import List, Optional
 
 from fastapi.responses import (
@@ -16,32 +15,53 @@ from fastapi.responses import (
     HTMLResponse,
     RedirectResponse,
     FileResponse,   # aquí va FileResponse
+    StreamingResponse,
+    PlainTextResponse,
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
 import json
 import re
-from msal import ConfidentialClientApplication
-from datetime import datetime, date
+import unicodedata
+from datetime import datetime, date, timedelta
+from urllib.parse import parse_qsl, unquote, urlencode
 from dotenv import load_dotenv
+import httpx
+
+import adjuntos_cache
+import api_json
+import clasif_siniestros
+import db
+import estado_bancos
+import graph_auth
+import graph_batch
+import graph_carpetas
+import graph_client
+import mail_store
+import paginacion
+import paginas_cache
+import graph_cache
+import sharepoint_crawler
+import sharepoint_index
 
+load_dotenv()
 
-# === CONFIGURACIÓN MSAL / GRAPH (SharePoint viejo) ===
-TENANT_ID = os.getenv("TENANT_ID")
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-GRAPH_SCOPE = ["https://graph.microsoft.com/.default"]
+# === CONFIGURACIÓN MSAL / GRAPH (SharePoint) ===
+# Si no hay credenciales propias de SharePoint se usan las de correo (GRAPH_*).
+TENANT_ID = os.getenv("TENANT_ID") or os.getenv("GRAPH_TENANT_ID", "")
+CLIENT_ID = os.getenv("CLIENT_ID") or os.getenv("GRAPH_CLIENT_ID", "")
+CLIENT_SECRET = os.getenv("CLIENT_SECRET") or os.getenv("GRAPH_CLIENT_SECRET", "")
+GRAPH_SCOPE = graph_auth.GRAPH_SCOPE
 SHAREPOINT_HOST = "servicioscruzdelsur.sharepoint.com"
 SHAREPOINT_SITE_PATH = "/sites/Gestion"
 POLIZAS_FOLDER_PATH = "/Seguros/Pólizas"
 BANCOS_FOLDER_PATH = "/Seguros/Pólizas"
 
 # ---------------------------------------------------------------------
-# Cargar .env y configuración Graph (correo)
+# Configuración Graph (correo)
 # ---------------------------------------------------------------------
-load_dotenv()
-
 GRAPH_TENANT_ID = os.getenv("GRAPH_TENANT_ID", "")
 GRAPH_CLIENT_ID = os.getenv("GRAPH_CLIENT_ID", "")
 GRAPH_CLIENT_SECRET = os.getenv("GRAPH_CLIENT_SECRET", "")
@@ -54,30 +74,50 @@ RUTA_POLIZAS = Path(
     r"/sites/Gestion/Documentos compartidos/Seguros/Pólizas"
 )
 
+# IDs de sitio/drive/carpetas de SharePoint (cambian muy rara vez)
+SP_IDS_TTL = int(os.getenv("SP_IDS_TTL", str(7 * 24 * 3600)))
+CACHE_IDS_SHAREPOINT = graph_cache.CacheTTL(
+    "sharepoint",
+    ttl=SP_IDS_TTL,
+    persistente=os.getenv("SP_IDS_PERSISTENTE", "1") == "1",
+)
+
+# IDs de carpetas de correo (Seguros, Bancos), compartidos por todas las rutas
+RESOLVER_CARPETAS = graph_carpetas.ResolverCarpetas(
+    persistente=os.getenv("SP_IDS_PERSISTENTE", "1") == "1",
+)
+
+# Almacén local de encabezados de correo (ver mail_store)
+MAIL_STORE_ACTIVO = os.getenv("MAIL_STORE_ACTIVO", "1") == "1"
+
+# Caché en disco de adjuntos de siniestros (ver adjuntos_cache)
+ADJUNTOS_CACHE_ACTIVO = os.getenv("ADJUNTOS_CACHE_ACTIVO", "1") == "1"
+CACHE_ADJUNTOS = adjuntos_cache.CacheAdjuntos() if ADJUNTOS_CACHE_ACTIVO else None
+
+# Índice delta local del drive de SharePoint (ver sharepoint_index)
+SP_INDEX_ACTIVO = os.getenv("SP_INDEX_ACTIVO", "1") == "1"
+
+# Caché de /polizas y /polizas_publicas ya renderizadas (ver paginas_cache)
+CACHE_PAGINAS = paginas_cache.CachePaginas()
+# clientState esperado en las notificaciones del webhook de SharePoint
+POLIZAS_WEBHOOK_SECRET = os.getenv("POLIZAS_WEBHOOK_SECRET", "")
+
+# Clasificación de correos de siniestros por ID de mensaje (ver clasif_siniestros)
+INDICE_SINIESTROS = clasif_siniestros.IndiceClasificacion()
+
+# Listado paginado de /siniestros
+SINIESTROS_POR_PAGINA = int(os.getenv("SINIESTROS_POR_PAGINA", "50"))
+SINIESTROS_MAX_POR_PAGINA = 200
+DIAS_NUEVOS = 10
+
 # Rutas de clasificación en disco
 RUTA_CLASIF = Path("clasificacion_siniestros.json")
 RUTA_CLASIF_BANCOS = Path("clasificacion_bancos.json")
 
 
-def cargar_clasificacion_bancos() -> dict[str, list[dict]]:
-    if not RUTA_CLASIF_BANCOS.exists():
-        return {}
-    try:
-        with RUTA_CLASIF_BANCOS.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        return {str(k): list(v) for k, v in data.items()}
-    except Exception as e:
-        print("[BANCOS] Error al leer clasificacion bancos:", e)
-        return {}
-
-CORREOS_BANCOS_CLASIFICADOS: dict[str, list[dict]] = cargar_clasificacion_bancos()
-
-def guardar_clasificacion_bancos(mapa: dict[str, list[dict]]) -> None:
-    try:
-        with RUTA_CLASIF_BANCOS.open("w", encoding="utf-8") as f:
-            json.dump(mapa, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("[BANCOS] Error al guardar clasificacion bancos:", e)
+# Pólizas con banco beneficiario y correos de Bancos clasificados,
+# compartidos entre workers (ver estado_bancos)
+ESTADO_BANCOS = estado_bancos.EstadoBancos()
 
 
 # ---------------------------------------------------------------------
@@ -86,7 +126,6 @@ def guardar_clasificacion_bancos(mapa: dict[str, list[dict]]) -> None:
 # Siniestros
 CLASIFICACION_SINIESTROS: dict[str, list[dict]] = {}
 CORREOS_CLASIFICADOS: set[str] = set()
-CLASIF_SINIESTROS_MAIL: dict[str, str] = {}
 PATRON_SINIESTRO = re.compile(r"[Nn][°o]\s*([0-9]{3,})")
 
 # ---------------------------------------------------------------------
@@ -166,55 +205,81 @@ def listar_subcarpetas_polizas() -> list[str]:
         [p.name for p in RUTA_POLIZAS.iterdir() if p.is_dir()]
     )  # [web:148][web:149]
 
-def cargar_clasificacion_siniestros() -> dict[str, str]:
+def migrar_clasificacion_siniestros() -> None:
+    """Copia una sola vez clasificacion_siniestros.json a la tabla clasif_siniestros."""
     if not RUTA_CLASIF.exists():
-        return {}
+        return
     try:
         with RUTA_CLASIF.open("r", encoding="utf-8") as f:
             data = json.load(f)
-        return {str(k): str(v) for k, v in data.items()}
+        mapa = {str(k): str(v) for k, v in data.items()}
+        if db.migrar_una_vez(
+            "clasificacion_siniestros_json",
+            lambda conn: db.clasif_siniestros_aplicar(mapa, conn=conn),
+        ):
+            print(f"[SINIESTROS] {len(mapa)} clasificaciones migradas desde {RUTA_CLASIF}.")
+    except Exception as e:
+        print("[SINIESTROS] Error al migrar clasificacion:", e)
+
+
+def clasificar_mails(mails: list[dict]) -> None:
+    """Completa n_siniestro de cada correo (por ID de mensaje) desde el índice."""
+    try:
+        INDICE_SINIESTROS.refrescar()
+        if INDICE_SINIESTROS.pendientes_migrar():
+            INDICE_SINIESTROS.adoptar(mails)
     except Exception as e:
         print("[SINIESTROS] Error al leer clasificacion:", e)
-        return {}
+    for m in mails:
+        m["n_siniestro"] = INDICE_SINIESTROS.numero(m["id"])
 
 
-def guardar_clasificacion_siniestros(mapa: dict[str, str]) -> None:
+def resumen_siniestros() -> list[tuple[str, int]]:
+    """(N° de siniestro, cantidad de correos) de todo lo clasificado."""
     try:
-        with RUTA_CLASIF.open("w", encoding="utf-8") as f:
-            json.dump(mapa, f, ensure_ascii=False, indent=2)
+        INDICE_SINIESTROS.refrescar()
     except Exception as e:
-        print("[SINIESTROS] Error al guardar clasificacion:", e)
+        print("[SINIESTROS] Error al leer clasificacion:", e)
+    return [(n, len(INDICE_SINIESTROS.mails(n))) for n in INDICE_SINIESTROS.numeros()]
+
+async def get_sharepoint_token() -> str:
+    """Token de aplicación para SharePoint (cacheado en graph_auth)."""
+    if not (TENANT_ID and CLIENT_ID and CLIENT_SECRET):
+        raise RuntimeError("Faltan variables de entorno para autenticación de SharePoint.")
+    return await graph_auth.get_token_async(TENANT_ID, CLIENT_ID, CLIENT_SECRET)
+
+
+# Event loop de la app, para que los hilos de fondo (índice SharePoint,
+# almacén de correos) puedan usar los helpers async de Graph.
+_APP_LOOP: asyncio.AbstractEventLoop | None = None
 
-def get_graph_token() -> str:
-    """Obtiene un token de aplicación para Microsoft Graph."""
-    app = msal.ConfidentialClientApplication(
-        client_id=CLIENT_ID,
-        authority=f"https://login.microsoftonline.com/{TENANT_ID}",
-        client_credential=CLIENT_SECRET,
-    )
-    result = app.acquire_token_for_client(scopes=GRAPH_SCOPE)
-    if "access_token" not in result:
-        raise RuntimeError(f"No se pudo obtener token de Graph: {result}")
-    return result["access_token"]
 
+def _en_loop_app(coro, timeout: float = 120):
+    """Ejecuta una corrutina en el event loop de la app desde un hilo de fondo."""
+    return asyncio.run_coroutine_threadsafe(coro, _APP_LOOP).result(timeout=timeout)
 
-def get_sharepoint_site_and_drive():
+
+async def get_sharepoint_site_and_drive():
     """
     Devuelve (site_id, drive_id) del sitio /sites/Gestion y la biblioteca
     'Documentos compartidos'.
     """
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}"}
+    clave = f"site_drive:{SHAREPOINT_HOST}:{SHAREPOINT_SITE_PATH}"
+    cacheado = CACHE_IDS_SHAREPOINT.get(clave)
+    if cacheado:
+        return cacheado[0], cacheado[1]
+
+    token = await get_sharepoint_token()
 
     # 1) Resolver el sitio
     site_url = f"https://graph.microsoft.com/v1.0/sites/{SHAREPOINT_HOST}:{SHAREPOINT_SITE_PATH}"
-    resp_site = requests.get(site_url, headers=headers)
+    resp_site = await graph_client.get(site_url, token=token)
     resp_site.raise_for_status()
     site_id = resp_site.json()["id"]
 
     # 2) Encontrar el drive de documentos
     drives_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives"
-    resp_drives = requests.get(drives_url, headers=headers)
+    resp_drives = await graph_client.get(drives_url, token=token)
     resp_drives.raise_for_status()
     drives = resp_drives.json().get("value", [])
 
@@ -233,97 +298,110 @@ def get_sharepoint_site_and_drive():
             f"Drives encontrados: {[d.get('name') for d in drives]}"
         )
 
+    CACHE_IDS_SHAREPOINT.set(clave, [site_id, drive_id])
     return site_id, drive_id
 
 
+async def get_sharepoint_folder_id(drive_id: str, folder_path: str) -> str:
+    """Devuelve el item id de root:{folder_path} dentro del drive (cacheado)."""
+    clave = f"root:{drive_id}:{folder_path}"
+    item_id = CACHE_IDS_SHAREPOINT.get(clave)
+    if item_id:
+        return item_id
 
-from datetime import datetime
-import requests
+    token = await get_sharepoint_token()
+    folder_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root:{folder_path}"
+    resp_folder = await graph_client.get(folder_url, token=token)
+    resp_folder.raise_for_status()
+    item_id = resp_folder.json()["id"]
+
+    CACHE_IDS_SHAREPOINT.set(clave, item_id)
+    return item_id
+
+
+def invalidar_ids_sharepoint(folder_path: str | None = None) -> None:
+    """Olvida los IDs cacheados del sitio/drive (y de la carpeta, si se indica)."""
+    clave = f"site_drive:{SHAREPOINT_HOST}:{SHAREPOINT_SITE_PATH}"
+    cacheado = CACHE_IDS_SHAREPOINT.get(clave)
+    if cacheado and folder_path:
+        CACHE_IDS_SHAREPOINT.invalidar(f"root:{cacheado[1]}:{folder_path}")
+    CACHE_IDS_SHAREPOINT.invalidar(clave)
 
 
-def get_sharepoint_folder_tree(folder_path: str):
+async def con_carpeta_sharepoint(folder_path: str, fn):
     """
-    Versión interna:
-    - Siempre PDFs
-    - Filtra por nombre que contenga 'póliza' / 'poliza'
-      y por año (actual y anterior),
-      excepto en la carpeta de primer nivel 'Tasaciones',
-      donde NO se aplica ningún filtro de nombre ni de año.
+    Resuelve (drive_id, item_id) de folder_path y ejecuta await fn(drive_id, item_id).
+    Si Graph responde 404 (IDs cacheados que ya no existen) invalida la caché
+    y reintenta una vez con IDs frescos.
     """
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}"}
-    _, drive_id = get_sharepoint_site_and_drive()
-
-    # Carpeta raíz (ej /Seguros/Pólizas)
-    folder_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root:{folder_path}"
-    resp_folder = requests.get(folder_url, headers=headers)
-    resp_folder.raise_for_status()
-    root = resp_folder.json()
-    root_id = root["id"]
+    for intento in range(2):
+        try:
+            _, drive_id = await get_sharepoint_site_and_drive()
+            item_id = await get_sharepoint_folder_id(drive_id, folder_path)
+            return await fn(drive_id, item_id)
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code if e.response is not None else None
+            if intento == 0 and status == 404:
+                print("[SHAREPOINT] 404 con IDs cacheados; se vuelven a resolver.")
+                invalidar_ids_sharepoint(folder_path)
+                continue
+            raise
 
-    year_now = datetime.utcnow().year
-    years_validos = {year_now, year_now - 1}
 
-    def listar_recursivo(item_id: str, nombre_carpeta: str, acumulador: dict):
-        """
-        Recorre una carpeta y sus subcarpetas, acumulando archivos por
-        'nombre_carpeta' (clave de primer nivel).
-        """
-        url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}/children"
-        resp = requests.get(url, headers=headers)
-        resp.raise_for_status()
-        items = resp.json().get("value", [])
-
-        for it in items:
-            # Si es subcarpeta, seguimos recursivamente
-            if "folder" in it:
-                sub_id = it["id"]
-                sub_name = it["name"]
-                # nombre_carpeta es siempre la carpeta de primer nivel
-                if nombre_carpeta is None:
-                    agrupador = sub_name
-                else:
-                    agrupador = nombre_carpeta
-                listar_recursivo(sub_id, agrupador, acumulador)
-
-            # Si es archivo
-            elif "file" in it:
-                nombre_archivo = it.get("name", "")
-                if not nombre_archivo.lower().endswith(".pdf"):
-                    continue
 
-                carpeta_key = nombre_carpeta or "Otros"
-                es_tasaciones = carpeta_key.lower() == "tasaciones"
+async def _arbol_pdfs_sharepoint(folder_path: str, incluir) -> list[dict]:
+    """
+    Recorre folder_path y agrupa los PDFs por carpeta de primer nivel. Usa el
+    índice delta local (sharepoint_index) si ya está listo; si no, recorre
+    SharePoint en anchura y en paralelo (sharepoint_crawler):
+    [{"carpeta": str, "cantidad": int, "archivos": [{"nombre", "url", "fecha"}]}]
+    incluir(carpeta_key, nombre_archivo, fecha_dt) decide si un PDF entra.
+    "url" es siempre /polizas/archivo/{id}: el árbol se cachea (CACHE_PAGINAS)
+    y los downloadUrl de Graph vencen en ~1 hora.
+    """
+    token = await get_sharepoint_token()
+
+    async def recorrer(drive_id: str, root_id: str) -> dict[str, list[dict]]:
+        if SP_INDEX_ACTIVO and await run_in_threadpool(sharepoint_index.listo, drive_id):
+            fuente = await run_in_threadpool(
+                lambda: list(
+                    sharepoint_index.recorrer_archivos(
+                        drive_id, root_id, lambda item_id: f"/polizas/archivo/{item_id}"
+                    )
+                )
+            )
+        else:
+            fuente = await sharepoint_crawler.recorrer_archivos(drive_id, root_id, token)
 
-                # En TODAS menos Tasaciones exigimos 'póliza' / 'poliza' en el nombre
-                if not es_tasaciones:
-                    if "póliza" not in nombre_archivo.lower() and "poliza" not in nombre_archivo.lower():
-                        continue
+        acumulador: dict[str, list[dict]] = {}
+        for nombre_carpeta, it in fuente:
+            nombre_archivo = it.get("name", "")
+            if not nombre_archivo.lower().endswith(".pdf"):
+                continue
 
-                fecha_str = it.get("lastModifiedDateTime")
-                try:
-                    fecha_dt = datetime.fromisoformat(fecha_str.replace("Z", "+00:00"))
-                except Exception:
-                    # si no se puede parsear, se descarta
-                    continue
+            carpeta_key = nombre_carpeta or "Otros"
 
-                # En TODAS menos Tasaciones filtramos por año
-                if not es_tasaciones:
-                    if fecha_dt.year not in years_validos:
-                        continue
+            fecha_str = it.get("lastModifiedDateTime")
+            try:
+                fecha_dt = datetime.fromisoformat(fecha_str.replace("Z", "+00:00"))
+            except Exception:
+                # si no se puede parsear, se descarta
+                continue
 
-                download_url = it.get("@microsoft.graph.downloadUrl")
+            if not incluir(carpeta_key, nombre_archivo, fecha_dt):
+                continue
 
-                acumulador.setdefault(carpeta_key, []).append(
-                    {
-                        "nombre": nombre_archivo,
-                        "url": download_url,
-                        "fecha": fecha_dt.strftime("%Y-%m-%d %H:%M"),
-                    }
-                )
+            acumulador.setdefault(carpeta_key, []).append(
+                {
+                    "nombre": nombre_archivo,
+                    "url": f"/polizas/archivo/{it['id']}",
+                    "fecha": fecha_dt.strftime("%Y-%m-%d %H:%M"),
+                }
+            )
+        return acumulador
 
-    acumulador: dict[str, list[dict]] = {}
-    listar_recursivo(root_id, None, acumulador)
+    # Carpeta raíz (ej /Seguros/Pólizas)
+    acumulador = await con_carpeta_sharepoint(folder_path, recorrer)
 
     resultado = []
     for carpeta, archivos in acumulador.items():
@@ -340,224 +418,253 @@ def get_sharepoint_folder_tree(folder_path: str):
     return resultado
 
 
-from datetime import datetime
-import requests
+def _resolver_indice_sharepoint() -> tuple[str, dict]:
+    token = _en_loop_app(get_sharepoint_token())
+    _, drive_id = _en_loop_app(get_sharepoint_site_and_drive())
+    return drive_id, {"Authorization": f"Bearer {token}"}
+
+
+@app.on_event("startup")
+async def registrar_loop_app():
+    global _APP_LOOP
+    _APP_LOOP = asyncio.get_running_loop()
+
+
+@app.on_event("shutdown")
+async def cerrar_graph_client():
+    await graph_client.cerrar()
+
+
+@app.on_event("startup")
+async def iniciar_indice_sharepoint():
+    if not SP_INDEX_ACTIVO:
+        return
+    if not (TENANT_ID and CLIENT_ID and CLIENT_SECRET):
+        print("[SP INDEX] Sin credenciales de SharePoint; el índice no se inicia.")
+        return
+    db.initdb()
+    sharepoint_index.iniciar_en_segundo_plano(
+        _resolver_indice_sharepoint,
+        # el hilo del índice no toca CACHE_PAGINAS: la invalidación va al event loop
+        al_cambiar=lambda: _APP_LOOP.call_soon_threadsafe(CACHE_PAGINAS.invalidar),
+    )
+
+
+def _ruta_bajo(parent_path: str, folder_path: str) -> bool:
+    """True si parentReference.path ("/drive/root:/Seguros/Pólizas/X") está bajo folder_path."""
+    def normalizar(ruta: str) -> str:
+        return unicodedata.normalize("NFC", unquote(ruta)).rstrip("/").casefold()
+
+    ruta = normalizar(parent_path.partition("root:")[2])
+    base = normalizar(folder_path)
+    return ruta == base or ruta.startswith(base + "/")
 
 
-def get_sharepoint_folder_tree_sin_filtros(folder_path: str):
+@app.get("/polizas/archivo/{item_id}")
+async def descargar_archivo_poliza(item_id: str):
     """
-    Versión para la página pública:
-    - Siempre PDFs
-    - Filtra por año (actual y anterior) en todas las carpetas,
-      excepto en la carpeta de primer nivel 'Tasaciones',
-      donde NO se filtra por año ni por nombre.
+    Redirige a un downloadUrl vigente de un PDF de POLIZAS_FOLDER_PATH. Las
+    páginas cacheadas enlazan aquí porque los downloadUrl vencen.
     """
-    token = get_graph_token()
-    headers = {"Authorization": f"Bearer {token}"}
-    _, drive_id = get_sharepoint_site_and_drive()
+    _, drive_id = await get_sharepoint_site_and_drive()
+    con_indice = SP_INDEX_ACTIVO and await run_in_threadpool(sharepoint_index.listo, drive_id)
+    if con_indice:
+        root_id = await get_sharepoint_folder_id(drive_id, POLIZAS_FOLDER_PATH)
+        if not await run_in_threadpool(sharepoint_index.pertenece, item_id, root_id):
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+        guardada = await run_in_threadpool(sharepoint_index.url_vigente, item_id)
+        if guardada:
+            return RedirectResponse(url=guardada, status_code=307)
+
+    token = await get_sharepoint_token()
+    resp = await graph_client.get(
+        f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}",
+        token=token,
+        timeout=15,
+    )
+    if resp.status_code != 200:
+        raise HTTPException(status_code=resp.status_code, detail=resp.text)
+    item = resp.json()
+    ruta_padre = (item.get("parentReference") or {}).get("path", "")
+    if not con_indice and not _ruta_bajo(ruta_padre, POLIZAS_FOLDER_PATH):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    download_url = item.get("@microsoft.graph.downloadUrl")
+    if not download_url:
+        raise HTTPException(status_code=404, detail="Archivo sin URL de descarga")
+    return RedirectResponse(url=download_url, status_code=307)
 
-    # Carpeta raíz (ej /Seguros/Pólizas)
-    folder_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root:{folder_path}"
-    resp_folder = requests.get(folder_url, headers=headers)
-    resp_folder.raise_for_status()
-    root = resp_folder.json()
-    root_id = root["id"]
 
+async def get_sharepoint_folder_tree(folder_path: str):
+    """
+    Versión interna:
+    - Siempre PDFs
+    - Filtra por nombre que contenga 'póliza' / 'poliza'
+      y por año (actual y anterior),
+      excepto en la carpeta de primer nivel 'Tasaciones',
+      donde NO se aplica ningún filtro de nombre ni de año.
+    """
     year_now = datetime.utcnow().year
     years_validos = {year_now, year_now - 1}
 
-    def listar_recursivo(item_id: str, nombre_carpeta: str, acumulador: dict):
-        """
-        Recorre una carpeta y sus subcarpetas, acumulando archivos por
-        'nombre_carpeta' (clave de primer nivel).
-        """
-        url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}/children"
-        resp = requests.get(url, headers=headers)
-        resp.raise_for_status()
-        items = resp.json().get("value", [])
-
-        for it in items:
-            # Si es subcarpeta, seguimos recursivamente
-            if "folder" in it:
-                sub_id = it["id"]
-                sub_name = it["name"]
-                if nombre_carpeta is None:
-                    agrupador = sub_name  # carpeta de primer nivel
-                else:
-                    agrupador = nombre_carpeta
-                listar_recursivo(sub_id, agrupador, acumulador)
-
-            # Si es archivo
-            elif "file" in it:
-                nombre_archivo = it.get("name", "")
-                if not nombre_archivo.lower().endswith(".pdf"):
-                    continue
+    def incluir(carpeta_key: str, nombre_archivo: str, fecha_dt: datetime) -> bool:
+        if carpeta_key.lower() == "tasaciones":
+            return True
+        # En TODAS menos Tasaciones exigimos 'póliza' / 'poliza' en el nombre
+        nombre = nombre_archivo.lower()
+        if "póliza" not in nombre and "poliza" not in nombre:
+            return False
+        return fecha_dt.year in years_validos
 
-                carpeta_key = nombre_carpeta or "Otros"
+    return await _arbol_pdfs_sharepoint(folder_path, incluir)
 
-                fecha_str = it.get("lastModifiedDateTime")
-                try:
-                    fecha_dt = datetime.fromisoformat(fecha_str.replace("Z", "+00:00"))
-                except Exception:
-                    # si no se puede parsear, se descarta
-                    continue
 
-                # En Tasaciones NO se aplica filtro de año
-                if carpeta_key.lower() not in {"tasaciones"}:
-                    if fecha_dt.year not in years_validos:
-                        continue
+async def get_sharepoint_folder_tree_sin_filtros(folder_path: str):
+    """
+    Versión para la página pública:
+    - Siempre PDFs
+    - Filtra por año (actual y anterior) en todas las carpetas,
+      excepto en la carpeta de primer nivel 'Tasaciones',
+      donde NO se filtra por año ni por nombre.
+    """
+    year_now = datetime.utcnow().year
+    years_validos = {year_now, year_now - 1}
 
-                fecha_fmt = fecha_dt.strftime("%Y-%m-%d %H:%M")
-                download_url = it.get("@microsoft.graph.downloadUrl")
+    def incluir(carpeta_key: str, nombre_archivo: str, fecha_dt: datetime) -> bool:
+        # En Tasaciones NO se aplica filtro de año
+        if carpeta_key.lower() == "tasaciones":
+            return True
+        return fecha_dt.year in years_validos
 
-                acumulador.setdefault(carpeta_key, []).append(
-                    {
-                        "nombre": nombre_archivo,
-                        "url": download_url,
-                        "fecha": fecha_fmt,
-                    }
-                )
+    return await _arbol_pdfs_sharepoint(folder_path, incluir)
 
-    acumulador: dict[str, list[dict]] = {}
-    listar_recursivo(root_id, None, acumulador)
-
-    resultado = []
-    for carpeta, archivos in acumulador.items():
-        archivos_ordenados = sorted(archivos, key=lambda x: x["nombre"].lower())
-        resultado.append(
-            {
-                "carpeta": carpeta,
-                "cantidad": len(archivos_ordenados),
-                "archivos": archivos_ordenados,
-            }
-        )
-
-    resultado.sort(key=lambda x: x["carpeta"].lower())
-    return resultado
 
+async def arbol_polizas(filtro: str = "") -> list[dict]:
+    """
+    Árbol de POLIZAS_FOLDER_PATH desde CACHE_PAGINAS (se invalida con el
+    webhook de SharePoint). filtro="polizas" usa get_sharepoint_folder_tree.
+    """
+    async def generar():
+        if filtro == "polizas":
+            arbol = await get_sharepoint_folder_tree(POLIZAS_FOLDER_PATH)
+        else:
+            arbol = await get_sharepoint_folder_tree_sin_filtros(POLIZAS_FOLDER_PATH)
+        return arbol, ""
 
-def cargar_clasificacion_bancos() -> dict[str, list[dict]]:
-    if not RUTA_CLASIF_BANCOS.exists():
-        return {}
-    try:
-        with RUTA_CLASIF_BANCOS.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        # asegurar tipos correctos
-        return {str(k): list(v) for k, v in data.items()}
-    except Exception as e:
-        print("[BANCOS] Error al leer clasificacion bancos:", e)
-        return {}
+    pagina = await CACHE_PAGINAS.obtener(f"arbol_polizas_{filtro or 'todas'}", generar)
+    return pagina.arbol
 
 
-def guardar_clasificacion_bancos(mapa: dict[str, list[dict]]) -> None:
-    try:
-        with RUTA_CLASIF_BANCOS.open("w", encoding="utf-8") as f:
-            json.dump(mapa, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("[BANCOS] Error al guardar clasificacion bancos:", e)
 
 # ---------------------------------------------------------------------
 # Utilidades Microsoft Graph (correo)
 # ---------------------------------------------------------------------
-def get_graph_token() -> str | None:
+async def get_graph_token() -> str | None:
+    """Token de aplicación para Graph (correo), cacheado en graph_auth."""
     if not (GRAPH_TENANT_ID and GRAPH_CLIENT_ID and GRAPH_CLIENT_SECRET):
         print("[GRAPH] Faltan variables de entorno para autenticación.")
         return None
 
-    authority = f"https://login.microsoftonline.com/{GRAPH_TENANT_ID}"
-    app_conf = ConfidentialClientApplication(
-        client_id=GRAPH_CLIENT_ID,
-        client_credential=GRAPH_CLIENT_SECRET,
-        authority=authority,
-    )
+    try:
+        return await graph_auth.get_token_async(GRAPH_TENANT_ID, GRAPH_CLIENT_ID, GRAPH_CLIENT_SECRET)
+    except RuntimeError as e:
+        print("[GRAPH] Error al obtener token:", e)
+        return None
 
-    result = app_conf.acquire_token_for_client(
-        scopes=["https://graph.microsoft.com/.default"]
-    )
-    if "access_token" in result:
-        return result["access_token"]
-    else:
-        print(
-            "[GRAPH] Error al obtener token:",
-            result.get("error"),
-            result.get("error_description"),
+async def get_mail_folder_id(token: str, display_name: str) -> str | None:
+    """ID de la subcarpeta de Inbox con ese displayName (cacheado, ver graph_carpetas)."""
+    return await RESOLVER_CARPETAS.get_id(token, GRAPH_USER or "me", display_name)
+
+
+async def leer_mensajes_carpeta(token: str, display_name: str, params: dict):
+    """
+    GET de los mensajes de una carpeta de correo. Si el ID cacheado ya no
+    existe (404) se invalida y se reintenta una vez. Devuelve la respuesta,
+    o None si la carpeta no existe.
+    """
+    user = GRAPH_USER or "me"
+    for intento in range(2):
+        folder_id = await get_mail_folder_id(token, display_name)
+        if folder_id is None:
+            print(f"[GRAPH] Carpeta '{display_name}' no encontrada en Inbox.")
+            return None
+        resp = await graph_client.get(
+            f"https://graph.microsoft.com/v1.0/users/{user}/mailFolders/{folder_id}/messages",
+            token=token,
+            params=params,
+            timeout=15,
         )
-        return None
+        if resp.status_code == 404 and intento == 0:
+            RESOLVER_CARPETAS.invalidar(user, display_name)
+            continue
+        return resp
 
-def leercorreo_siniestro_por_id(mail_id: str) -> dict | None:
+
+async def es_de_carpeta(token: str, item: dict, display_name: str) -> bool:
+    """
+    True si el mensaje está en la carpeta display_name. Si no coincide con el
+    ID cacheado se revalida contra Graph (la carpeta pudo cambiar de ID),
+    como mucho una vez por graph_carpetas.MIN_REESCANEO segundos.
+    """
+    parent = item.get("parentFolderId")
+    if not parent:
+        return False
+    if parent == await get_mail_folder_id(token, display_name):
+        return True
+    return parent == await RESOLVER_CARPETAS.revalidar(token, GRAPH_USER or "me", display_name)
+
+
+async def leercorreo_siniestro_por_id(mail_id: str) -> dict | None:
     """
     Devuelve un correo de la carpeta Siniestros (GRAPHFOLDERDISPLAYNAME)
     con body HTML y lista de adjuntos (nombre y url de descarga), 
     o None si no existe.
     """
-    token = get_graph_token()
+    token = await get_graph_token()
     if not token:
         return None
 
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Prefer": "outlook.body-content-type=\"html\"",
-    }
-    baseurl = "https://graph.microsoft.com/v1.0"
     user = GRAPH_USER or "me"
 
-    # 1) localizar carpeta Siniestros dentro de Inbox (igual que leercorreosgraph)
-    resp = requests.get(
-        f"{baseurl}/users/{user}/mailFolders/inbox/childFolders",
-        headers=headers,
-        params={"top": 200},
-        timeout=15,
-    )
-    if resp.status_code != 200:
-        print("GRAPH Error al listar carpetas Siniestros:", resp.status_code, resp.text)
-        return None
-
-    folders = resp.json().get("value", [])
-    folder_id = None
-    for f in folders:
-        if f.get("displayName") == GRAPH_FOLDER_DISPLAY_NAME:
-            folder_id = f.get("id")
-            break
-    if folder_id is None:
-        print(f"GRAPH Carpeta {GRAPH_FOLDER_DISPLAY_NAME} no encontrada en Inbox.")
-        return None
-
-    # 2) leer mensaje concreto por id dentro de esa carpeta
-    resp = requests.get(
-        f"{baseurl}/users/{user}/mailFolders/{folder_id}/messages/{mail_id}",
-        headers=headers,
-        params={"select": "id,subject,from,receivedDateTime,body,hasAttachments"},
-        timeout=15,
+    # Mensaje y lista de adjuntos en un solo $batch
+    resp, resp_att = await graph_batch.ejecutar(
+        token,
+        [
+            graph_batch.peticion(
+                f"/users/{user}/messages/{mail_id}",
+                {"$select": "id,subject,from,receivedDateTime,body,hasAttachments,parentFolderId"},
+                {"Prefer": "outlook.body-content-type=\"html\""},
+            ),
+            graph_batch.peticion(
+                f"/users/{user}/messages/{mail_id}/attachments",
+                {"$select": "id,name,contentType"},
+            ),
+        ],
     )
     if resp.status_code != 200:
         print("GRAPH Error al leer mensaje Siniestros por id:", resp.status_code, resp.text)
         return None
 
     item = resp.json()
+    # solo correos de la carpeta Siniestros
+    if not await es_de_carpeta(token, item, GRAPH_FOLDER_DISPLAY_NAME):
+        return None
+
     remitente = item.get("from", {}).get("emailAddress", {}).get("address")
     body = item.get("body", {}) or {}
     body_html = body.get("content", "")
 
-    # 3) si tiene adjuntos, listarlos
+    # adjuntos (ya vienen en el mismo $batch)
     adjuntos = []
-    if item.get("hasAttachments"):
-        resp_att = requests.get(
-            f"{baseurl}/users/{user}/mailFolders/{folder_id}/messages/{mail_id}/attachments",
-            headers=headers,
-            timeout=15,
-        )
-        if resp_att.status_code == 200:
-            for att in resp_att.json().get("value", []):
-                if att.get("@odata.type") == "#microsoft.graph.fileAttachment":
-                    adjuntos.append(
-                        {
-                            "id": att["id"],
-                            "nombre": att.get("name"),
-                            "contentType": att.get("contentType", "application/octet-stream"),
-                        }
-                    )
-
-
+    if item.get("hasAttachments") and resp_att.status_code == 200:
+        for att in resp_att.json().get("value", []):
+            if att.get("@odata.type") == "#microsoft.graph.fileAttachment":
+                adjuntos.append(
+                    {
+                        "id": att["id"],
+                        "nombre": att.get("name"),
+                        "contentType": att.get("contentType", "application/octet-stream"),
+                    }
+                )
 
     return {
         "id": item.get("id"),
@@ -568,48 +675,223 @@ def leercorreo_siniestro_por_id(mail_id: str) -> dict | None:
         "adjuntos": adjuntos,
     }
 
+ADJUNTO_CHUNK = 64 * 1024
+
+
+def _rango_pedido(valor: str | None) -> tuple[int | None, int | None] | None:
+    """
+    Rango único de un header Range ("bytes=a-b", "bytes=a-", "bytes=-n")
+    como (a, b), (a, None) o (None, n). None si no hay, trae varios rangos o
+    es inválido (ej. "bytes=5-3"): en ese caso se ignora y va el archivo
+    completo (RFC 9110).
+    """
+    if not valor or not valor.startswith("bytes=") or "," in valor:
+        return None
+    m = re.fullmatch(r"(\d*)-(\d*)", valor[len("bytes="):].strip())
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    inicio = int(m.group(1)) if m.group(1) else None
+    fin = int(m.group(2)) if m.group(2) else None
+    if inicio is not None and fin is not None and inicio > fin:
+        return None
+    return inicio, fin
+
+
+def _parse_range(valor: str | None, total: int | None) -> tuple[int, int] | None:
+    """
+    (inicio, fin) inclusivos del header Range sobre un archivo de `total`
+    bytes, o None si no aplica. Lanza ValueError si el rango es válido pero
+    no satisfacible (empieza después del final, o sufijo de 0 bytes).
+    """
+    pedido = _rango_pedido(valor)
+    if pedido is None or total is None:
+        return None
+    inicio, fin = pedido
+    if inicio is None:
+        if fin == 0 or total == 0:
+            raise ValueError("rango fuera del archivo")
+        return max(total - fin, 0), total - 1
+    if inicio >= total:
+        raise ValueError("rango fuera del archivo")
+    return inicio, total - 1 if fin is None else min(fin, total - 1)
+
+
+def _content_range(valor: str | None) -> tuple[int, int, int] | None:
+    """Header Content-Range "bytes a-b/total" -> (a, b, total), o None."""
+    m = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", (valor or "").strip())
+    return (int(m.group(1)), int(m.group(2)), int(m.group(3))) if m else None
+
+
+async def _iter_rango(resp: httpx.Response, inicio: int, fin: int | None):
+    """Relaya el cuerpo de resp en trozos, recortado a [inicio, fin]."""
+    try:
+        pos = 0
+        async for chunk in resp.aiter_bytes(ADJUNTO_CHUNK):
+            if not chunk:
+                continue
+            desde = max(inicio - pos, 0)
+            hasta = len(chunk) if fin is None else min(len(chunk), fin + 1 - pos)
+            pos += len(chunk)
+            if hasta > desde:
+                yield chunk[desde:hasta]
+            if fin is not None and pos > fin:
+                break
+    finally:
+        await resp.aclose()
+
+
+async def _iter_y_cachear(resp: httpx.Response, mail_id: str, att_id: str, filename: str, content_type: str):
+    """
+    Relaya el adjunto completo y, si llega entero, lo deja en CACHE_ADJUNTOS.
+    La escritura a disco va al threadpool para no bloquear el event loop.
+    """
+    escritor = await run_in_threadpool(CACHE_ADJUNTOS.escritor)
+    completo = False
+    try:
+        async for chunk in _iter_rango(resp, 0, None):
+            await run_in_threadpool(escritor.escribir, chunk)
+            yield chunk
+        completo = True
+    finally:
+        if completo:
+            try:
+                await run_in_threadpool(escritor.terminar, mail_id, att_id, filename, content_type)
+            except Exception as e:
+                print("[ADJUNTOS] Error al guardar en caché:", e)
+                escritor.descartar()
+        else:
+            escritor.descartar()
+
+
 @app.get("/siniestros/mail/{mail_id}/adjunto/{att_id}")
-async def descargar_adjunto_siniestro(mail_id: str, att_id: str):
-    token = get_graph_token()
+async def descargar_adjunto_siniestro(request: Request, mail_id: str, att_id: str):
+    # 1) Caché local: sin llamadas a Graph
+    if ADJUNTOS_CACHE_ACTIVO:
+        info = await run_in_threadpool(CACHE_ADJUNTOS.buscar, mail_id, att_id)
+        if info is not None:
+            etag = f'"{info["sha256"]}"'
+            cache_headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+            if api_json.etag_coincide(request.headers.get("if-none-match"), etag):
+                return Response(status_code=304, headers=cache_headers)
+            return FileResponse(
+                info["ruta"],
+                media_type=info["content_type"],
+                headers=dict(
+                    cache_headers,
+                    **{"Content-Disposition": f'attachment; filename="{info["name"]}"'},
+                ),
+            )
+
+    # 2) Graph
+    token = await get_graph_token()
     if not token:
         raise HTTPException(status_code=500, detail="No se pudo obtener token de Graph")
 
-    headers = {"Authorization": f"Bearer {token}"}
     baseurl = "https://graph.microsoft.com/v1.0"
     user = GRAPH_USER or "me"
-
-    # 1) Obtener metadatos del adjunto (nombre y tipo)
-    meta_resp = requests.get(
-        f"{baseurl}/users/{user}/messages/{mail_id}/attachments/{att_id}",
-        headers=headers,
-        timeout=15,
+    att_url = f"{baseurl}/users/{user}/messages/{mail_id}/attachments/{att_id}"
+
+    # Sin compresión: Content-Length y los rangos se cuentan sobre los mismos
+    # bytes que se relayan. Un Range del cliente se pasa a Graph.
+    data_headers = {"Accept-Encoding": "identity"}
+    rango_pedido = request.headers.get("range")
+    if _rango_pedido(rango_pedido) is not None:
+        data_headers["Range"] = rango_pedido
+
+    # Metadatos (sin contentBytes) y contenido en paralelo; el contenido
+    # queda en streaming, sin bajarlo entero a memoria.
+    meta_resp, data_resp = await asyncio.gather(
+        graph_client.get(
+            att_url,
+            token=token,
+            params={"$select": "name,contentType,size"},
+            timeout=15,
+        ),
+        graph_client.request("GET", f"{att_url}/$value", token=token, headers=data_headers, stream=True),
+        return_exceptions=True,
     )
-    if meta_resp.status_code != 200:
-        raise HTTPException(status_code=meta_resp.status_code, detail=meta_resp.text)
+    # si una de las dos falló, el stream que sí se abrió no debe quedar colgado
+    for r in (meta_resp, data_resp):
+        if isinstance(r, BaseException):
+            if isinstance(data_resp, httpx.Response):
+                await data_resp.aclose()
+            raise r
+    if meta_resp.status_code != 200 or data_resp.status_code not in (200, 206):
+        await data_resp.aread()
+        await data_resp.aclose()
+        if meta_resp.status_code == 200 and data_resp.status_code == 416:
+            return Response(
+                status_code=416,
+                headers={"Content-Range": data_resp.headers.get("Content-Range", "bytes */*")},
+            )
+        fallo = meta_resp if meta_resp.status_code != 200 else data_resp
+        raise HTTPException(status_code=fallo.status_code, detail=fallo.text)
 
     meta = meta_resp.json()
     filename = meta.get("name", "adjunto.bin")
     content_type = meta.get("contentType", "application/octet-stream")
 
-    # 2) Descargar contenido del adjunto
-    data_resp = requests.get(
-        f"{baseurl}/users/{user}/messages/{mail_id}/attachments/{att_id}/$value",
-        headers=headers,
-        timeout=30,
-    )
-    if data_resp.status_code != 200:
-        raise HTTPException(status_code=data_resp.status_code, detail=data_resp.text)
+    # Si Graph comprimió igual, el largo no corresponde a lo que se relaya
+    codificado = data_resp.headers.get("Content-Encoding", "identity").lower() != "identity"
+    largo = None if codificado else data_resp.headers.get("Content-Length")
+    total = int(largo) if largo and largo.isdigit() else None
+
+    resp_headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Accept-Ranges": "bytes" if total is not None else "none",
+    }
+
+    # Graph respetó el Range: se relaya su 206 tal cual
+    if data_resp.status_code == 206:
+        parcial = None if codificado else _content_range(data_resp.headers.get("Content-Range"))
+        if parcial is None:
+            await data_resp.aclose()
+            raise HTTPException(status_code=502, detail="Respuesta parcial de Graph no válida")
+        inicio, fin, completo = parcial
+        resp_headers["Accept-Ranges"] = "bytes"
+        resp_headers["Content-Length"] = str(fin - inicio + 1)
+        resp_headers["Content-Range"] = f"bytes {inicio}-{fin}/{completo}"
+        return StreamingResponse(
+            _iter_rango(data_resp, 0, fin - inicio),
+            status_code=206,
+            media_type=content_type,
+            headers=resp_headers,
+        )
+
+    # Graph lo ignoró (200 completo): se recorta aquí
+    try:
+        rango = _parse_range(request.headers.get("range"), total)
+    except ValueError:
+        await data_resp.aclose()
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+
+    if rango is None:
+        if total is not None:
+            resp_headers["Content-Length"] = str(total)
+        if ADJUNTOS_CACHE_ACTIVO:
+            cuerpo = _iter_y_cachear(data_resp, mail_id, att_id, filename, content_type)
+        else:
+            cuerpo = _iter_rango(data_resp, 0, None)
+        return StreamingResponse(
+            cuerpo,
+            media_type=content_type,
+            headers=resp_headers,
+        )
 
-    return Response(
-        content=data_resp.content,
+    inicio, fin = rango
+    resp_headers["Content-Length"] = str(fin - inicio + 1)
+    resp_headers["Content-Range"] = f"bytes {inicio}-{fin}/{total}"
+    return StreamingResponse(
+        _iter_rango(data_resp, inicio, fin),
+        status_code=206,
         media_type=content_type,
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        headers=resp_headers,
     )
 
 
 @app.get("/siniestros/mail/{mail_id}", name="ver_mail_siniestros", response_class=HTMLResponse)
 async def ver_mail_siniestros(request: Request, mail_id: str):
-    mail = leercorreo_siniestro_por_id(mail_id)
+    mail = await leercorreo_siniestro_por_id(mail_id)
     if not mail:
         raise HTTPException(status_code=404, detail="Correo de siniestros no encontrado")
 
@@ -621,50 +903,33 @@ async def ver_mail_siniestros(request: Request, mail_id: str):
         },
     )
 
-def leer_correos_graph(max_mails: int = 50):
+async def leer_correos_graph(max_mails: int = 50):
+    """
+    Correos de la carpeta Seguros. Con el almacén local listo (mail_store)
+    se devuelven todos desde SQLite; max_mails solo limita la lectura
+    directa desde Graph.
+    """
+    if MAIL_STORE_ACTIVO and await run_in_threadpool(mail_store.listo, GRAPH_FOLDER_DISPLAY_NAME):
+        return await run_in_threadpool(mail_store.listar, GRAPH_FOLDER_DISPLAY_NAME)
+
     mails: list[dict] = []
 
-    token = get_graph_token()
+    token = await get_graph_token()
     if not token:
         return mails
 
-    headers = {"Authorization": f"Bearer {token}"}
-    base_url = "https://graph.microsoft.com/v1.0"
-    user = GRAPH_USER or "me"
-
-    # Buscar carpeta "Seguros" dentro de Inbox
-    resp = requests.get(
-        f"{base_url}/users/{user}/mailFolders/inbox/childFolders",
-        headers=headers,
-        params={"$top": 200},
-        timeout=15,
-    )
-    if resp.status_code != 200:
-        print("[GRAPH] Error al listar carpetas:", resp.status_code, resp.text)
-        return mails
-
-    folders = resp.json().get("value", [])
-    folder_id = None
-    for f in folders:
-        if f.get("displayName") == GRAPH_FOLDER_DISPLAY_NAME:
-            folder_id = f.get("id")
-            break
-
-    if folder_id is None:
-        print(f"[GRAPH] Carpeta '{GRAPH_FOLDER_DISPLAY_NAME}' no encontrada en Inbox.")
-        return mails
-
-    # Leer correos de esa carpeta
-    resp = requests.get(
-        f"{base_url}/users/{user}/mailFolders/{folder_id}/messages",
-        headers=headers,
-        params={
+    # Leer correos de la carpeta "Seguros" dentro de Inbox
+    resp = await leer_mensajes_carpeta(
+        token,
+        GRAPH_FOLDER_DISPLAY_NAME,
+        {
             "$top": max_mails,
             "$select": "subject,from,receivedDateTime",
             "$orderby": "receivedDateTime desc",
         },
-        timeout=15,
     )
+    if resp is None:
+        return mails
     if resp.status_code != 200:
         print("[GRAPH] Error al leer mensajes:", resp.status_code, resp.text)
         return mails
@@ -688,32 +953,6 @@ def leer_correos_graph(max_mails: int = 50):
 
     return mails
 
-def cargar_clasificacion_siniestros() -> dict[str, str]:
-    if not RUTA_CLASIF.exists():
-        return {}
-    try:
-        with RUTA_CLASIF.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        return {str(k): str(v) for k, v in data.items()}
-    except Exception as e:
-        print("[SINIESTROS] Error al leer clasificacion:", e)
-        return {}
-
-
-def guardar_clasificacion_siniestros(mapa: dict[str, str]) -> None:
-    try:
-        with RUTA_CLASIF.open("w", encoding="utf-8") as f:
-            json.dump(mapa, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("[SINIESTROS] Error al guardar clasificacion:", e)
-
-
-CLASIF_SINIESTROS_MAIL = cargar_clasificacion_siniestros()
-
-
-
-
-
 def detectar_numero_siniestro(asunto: str) -> str | None:
     if not asunto:
         return None
@@ -722,47 +961,60 @@ def detectar_numero_siniestro(asunto: str) -> str | None:
         return m.group(1)
     return None
 
-def cargar_clasificacion_siniestros() -> dict[str, str]:
-    if not RUTA_CLASIF.exists():
-        return {}
-    try:
-        with RUTA_CLASIF.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        # asegurarse de que todo es str -> str
-        return {str(k): str(v) for k, v in data.items()}
-    except Exception as e:
-        print("[SINIESTROS] Error al leer clasificacion:", e)
-        return {}
 
+def _resolver_carpetas_correo():
+    token = _en_loop_app(get_graph_token())
+    if not token:
+        raise RuntimeError("Sin token de Graph")
+    carpetas = [
+        (nombre, _en_loop_app(get_mail_folder_id(token, nombre)))
+        for nombre in (GRAPH_FOLDER_DISPLAY_NAME, GRAPH_BANKS_FOLDER_DISPLAY_NAME)
+    ]
+    return token, GRAPH_USER or "me", carpetas
+
+
+@app.on_event("startup")
+async def iniciar_almacen_correos():
+    if not MAIL_STORE_ACTIVO:
+        return
+    if not (GRAPH_TENANT_ID and GRAPH_CLIENT_ID and GRAPH_CLIENT_SECRET):
+        print("[MAIL STORE] Sin credenciales de Graph; el almacén no se inicia.")
+        return
+    db.initdb()
+    mail_store.iniciar_en_segundo_plano(
+        _resolver_carpetas_correo,
+        detectar=detectar_numero_siniestro,
+        al_fallar=lambda nombre: RESOLVER_CARPETAS.invalidar(GRAPH_USER or "me", nombre),
+        al_sincronizar=adoptar_claves_antiguas,
+    )
 
-def guardar_clasificacion_siniestros(mapa: dict[str, str]) -> None:
-    try:
-        with RUTA_CLASIF.open("w", encoding="utf-8") as f:
-            json.dump(mapa, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("[SINIESTROS] Error al guardar clasificacion:", e)
-        
-CLASIF_SINIESTROS_MAIL = cargar_clasificacion_siniestros()
 
-def cargar_clasificacion_bancos() -> dict[str, list[dict]]:
-    if not RUTA_CLASIF_BANCOS.exists():
-        return {}
+def adoptar_claves_antiguas(folder: str = GRAPH_FOLDER_DISPLAY_NAME, _cambios: int = 0) -> None:
+    """
+    Pasa las claves antiguas "{fecha} - {asunto} ({remitente})" a ID de
+    mensaje con los correos del almacén. Se llama al arrancar y tras cada
+    sincronización de mail_store (en el primer despliegue el almacén aún
+    está vacío al arrancar).
+    """
+    if folder != GRAPH_FOLDER_DISPLAY_NAME:
+        return
     try:
-        with RUTA_CLASIF_BANCOS.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        # aseguramos tipos
-        return {str(k): list(v) for k, v in data.items()}
+        INDICE_SINIESTROS.refrescar()
+        if not INDICE_SINIESTROS.pendientes_migrar():
+            return
+        n = INDICE_SINIESTROS.adoptar(db.mail_list(folder))
+        if n:
+            print(f"[SINIESTROS] {n} clasificaciones pasadas a ID de mensaje.")
     except Exception as e:
-        print("[BANCOS] Error al leer clasificacion bancos:", e)
-        return {}
+        print("[SINIESTROS] Error al migrar claves antiguas:", e)
 
 
-def guardar_clasificacion_bancos(mapa: dict[str, list[dict]]) -> None:
-    try:
-        with RUTA_CLASIF_BANCOS.open("w", encoding="utf-8") as f:
-            json.dump(mapa, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("[BANCOS] Error al guardar clasificacion bancos:", e)
+@app.on_event("startup")
+def iniciar_clasificacion_siniestros():
+    db.initdb()
+    migrar_clasificacion_siniestros()
+    adoptar_claves_antiguas()
+
 
 # ---------------------------------------------------------------------
 # Endpoints
@@ -776,118 +1028,243 @@ async def home(request: Request):
         },
     )
 
-@app.get("/polizas", response_class=HTMLResponse)
-async def pagina_polizas(request: Request):
-    try:
-        polizas = get_sharepoint_folder_tree_sin_filtros(POLIZAS_FOLDER_PATH)
+@app.get("/metricas")
+async def metricas():
+    """Contadores internos (caché de tokens Graph, etc.)."""
+    return {
+        "graph_token": graph_auth.stats(),
+        "cache_ids_sharepoint": CACHE_IDS_SHAREPOINT.stats(),
+        "carpetas_correo": RESOLVER_CARPETAS.stats(),
+        "adjuntos": CACHE_ADJUNTOS.stats() if CACHE_ADJUNTOS else None,
+        "paginas": CACHE_PAGINAS.stats(),
+        "clasif_siniestros": INDICE_SINIESTROS.stats(),
+        "bancos": ESTADO_BANCOS.stats(),
+    }
+
+async def _pagina_polizas(request: Request, template: str) -> Response:
+    """
+    Sirve la página de pólizas desde CACHE_PAGINAS (con 304 si el navegador
+    ya la tiene). Solo se cachea si SharePoint respondió bien.
+    """
+    async def generar():
+        polizas = await get_sharepoint_folder_tree_sin_filtros(POLIZAS_FOLDER_PATH)
         mensaje = "" if polizas else "No se encontraron archivos PDF en la carpeta de SharePoint configurada."
+        html = templates.get_template(template).render(
+            {
+                "request": request,
+                "polizas": polizas,                     # árbol desde SharePoint
+                "ruta_base": f"SharePoint: {POLIZAS_FOLDER_PATH}",
+                "mensaje": mensaje,
+            }
+        )
+        return polizas, html
+
+    try:
+        pagina = await CACHE_PAGINAS.obtener(template, generar)
     except Exception as e:
-        polizas = []
-        mensaje = f"Error al leer pólizas desde SharePoint: {e}"
+        return templates.TemplateResponse(
+            template,
+            {
+                "request": request,
+                "polizas": [],
+                "ruta_base": f"SharePoint: {POLIZAS_FOLDER_PATH}",
+                "mensaje": f"Error al leer pólizas desde SharePoint: {e}",
+            },
+        )
+
+    cache_headers = {
+        "ETag": pagina.etag,
+        "Last-Modified": pagina.last_modified,
+        "Cache-Control": "no-cache",
+    }
+    if pagina.no_modificada(
+        request.headers.get("if-none-match"), request.headers.get("if-modified-since")
+    ):
+        return Response(status_code=304, headers=cache_headers)
+    return HTMLResponse(pagina.cuerpo, headers=cache_headers)
 
-    return templates.TemplateResponse(
-        "polizas.html",
-        {
-            "request": request,
-            "polizas": polizas,                     # árbol desde SharePoint
-            "ruta_base": f"SharePoint: {POLIZAS_FOLDER_PATH}",
-            "mensaje": mensaje,
-        },
-    )
+
+@app.get("/polizas", response_class=HTMLResponse)
+async def pagina_polizas(request: Request):
+    return await _pagina_polizas(request, "polizas.html")
 
 @app.get("/polizas_publicas", response_class=HTMLResponse)
 async def pagina_polizas_publicas(request: Request):
-    try:
-        polizas = get_sharepoint_folder_tree_sin_filtros(POLIZAS_FOLDER_PATH)
-        mensaje = "" if polizas else "No se encontraron archivos PDF en la carpeta de SharePoint configurada."
-    except Exception as e:
-        polizas = []
-        mensaje = f"Error al leer pólizas desde SharePoint: {e}"
+    return await _pagina_polizas(request, "polizas_publica.html")
 
-    return templates.TemplateResponse(
-        "polizas_publica.html",
-        {
-            "request": request,
-            "polizas": polizas,
-            "ruta_base": f"SharePoint: {POLIZAS_FOLDER_PATH}",
-            "mensaje": mensaje,
-        },
-    )
 
+@app.post("/polizas/cache/invalidar")
+async def invalidar_cache_polizas(request: Request):
+    """
+    Invalida las páginas de pólizas cacheadas. Sirve como webhook de
+    Graph (suscripción a cambios del drive) o para el watcher local.
+    """
+    # Validación de la suscripción: Graph espera el token de vuelta en texto plano
+    validation_token = request.query_params.get("validationToken")
+    if validation_token is not None:
+        return PlainTextResponse(validation_token)
 
+    if POLIZAS_WEBHOOK_SECRET:
+        try:
+            cuerpo = await request.json()
+        except Exception:
+            cuerpo = {}
+        estados = [n.get("clientState") for n in (cuerpo or {}).get("value", [])]
+        if request.headers.get("x-webhook-secret") != POLIZAS_WEBHOOK_SECRET and (
+            not estados or any(e != POLIZAS_WEBHOOK_SECRET for e in estados)
+        ):
+            raise HTTPException(status_code=403, detail="clientState inválido")
 
-@app.get("/siniestros", response_class=HTMLResponse)
-async def pagina_siniestros(request: Request):
-    mails_base = leer_correos_graph(max_mails=200)
-    modo_demo = False
-    if not mails_base:
-        modo_demo = True
-        mails_base = [
-            {
-                "id": "demo1",
-                "fecha": "2025-12-16T10:15:00",
-                "remitente": "cliente1@ejemplo.cl",
-                "asunto": "[ALERTA] Nuevo siniestro N°123",
-            },
-            # ...
-        ]
+    CACHE_PAGINAS.invalidar()
+    return Response(status_code=202)
 
-    nuevos: list[dict] = []
-    historicos: list[dict] = []
 
-    ahora = datetime.utcnow()
-    for idx, m in enumerate(mails_base):
-        fecha_str = m.get("fecha", "")
+
+def _filtros_siniestros(params) -> dict:
+    """Filtros del listado desde la query string (fechas YYYY-MM-DD, ambas incluidas)."""
+    def fecha(nombre: str) -> str:
+        valor = (params.get(nombre) or "").strip()
+        if not valor:
+            return ""
         try:
-            fecha_dt = datetime.fromisoformat(fecha_str.replace("Z", "+00:00"))
-        except Exception:
-            fecha_dt = None
+            return date.fromisoformat(valor).isoformat()
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Fecha inválida en '{nombre}': {valor}")
 
-        diff_dias = None
-        if fecha_dt is not None:
-            diff_dias = (ahora - fecha_dt.replace(tzinfo=None)).days
+    estado = params.get("estado") or "todos"
+    if estado not in ("todos", "clasificados", "sin_clasificar"):
+        raise HTTPException(status_code=400, detail=f"Estado inválido: {estado}")
+    return {
+        "desde": fecha("desde"),
+        "hasta": fecha("hasta"),
+        "remitente": (params.get("remitente") or "").strip(),
+        "numero": (params.get("numero") or "").strip(),
+        "estado": estado,
+    }
 
-        mail_id = m.get("id") or f"mail{idx}"
-        remitente = m.get("remitente", "")
-        asunto = m.get("asunto", "")
 
-        if fecha_dt:
-            clave = f'{fecha_dt.strftime("%Y-%m-%d %H:%M")} - {asunto} ({remitente})'
-        else:
-            clave = f"{fecha_str} - {asunto} ({remitente})"
+def _limite_pagina(params) -> int:
+    try:
+        limite = int(params.get("limite") or SINIESTROS_POR_PAGINA)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="limite debe ser un número")
+    return max(1, min(limite, SINIESTROS_MAX_POR_PAGINA))
+
+
+def _filtrar_siniestros(mails: list[dict], filtros: dict, antes, limite: int) -> list[dict]:
+    """Mismo criterio que db.mail_pagina, sobre correos ya leídos desde Graph."""
+    hasta = (date.fromisoformat(filtros["hasta"]) + timedelta(days=1)).isoformat() if filtros["hasta"] else ""
+    remitente = filtros["remitente"].lower()
+    pagina = []
+    for m in sorted(mails, key=lambda m: (m.get("fecha") or "", m.get("id") or ""), reverse=True):
+        fecha = m.get("fecha") or ""
+        if antes and (fecha, m.get("id") or "") >= tuple(antes):
+            continue
+        if (filtros["desde"] and fecha < filtros["desde"]) or (hasta and fecha >= hasta):
+            continue
+        if remitente and remitente not in (m.get("remitente") or "").lower():
+            continue
+        n = m.get("n_siniestro")
+        if filtros["numero"] and n != filtros["numero"]:
+            continue
+        if (filtros["estado"] == "clasificados" and not n) or (filtros["estado"] == "sin_clasificar" and n):
+            continue
+        pagina.append(m)
+        if len(pagina) >= limite:
+            break
+    return pagina
+
+
+def _registro_siniestro(m: dict, ahora: datetime) -> dict:
+    fecha_str = m.get("fecha") or ""
+    try:
+        fecha_dt = datetime.fromisoformat(fecha_str.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        fecha_dt = None
+    return {
+        "id": m["id"],
+        "fecha": fecha_str,
+        "fecha_mostrar": fecha_dt.strftime("%Y-%m-%d %H:%M") if fecha_dt else fecha_str,
+        "remitente": m.get("remitente", ""),
+        "asunto": m.get("asunto", ""),
+        "n_siniestro": m.get("n_siniestro"),
+        "nuevo": fecha_dt is not None and (ahora - fecha_dt).days <= DIAS_NUEVOS,
+    }
 
-        numero_guardado = CLASIF_SINIESTROS_MAIL.get(clave)
 
+async def listar_siniestros(filtros: dict, cursor: Optional[str], limite: int):
+    """
+    Una página de correos de Seguros, del más reciente al más antiguo.
+    Devuelve (correos, cursor de la página siguiente o None, modo_demo).
+    Con el almacén local listo la página sale de un SELECT por índice
+    (keyset sobre receivedDateTime); si no, de los últimos 200 de Graph.
+    """
+    try:
+        antes = paginacion.decodificar(cursor, 2)
+    except paginacion.CursorInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        registro = {
-            "id": mail_id,
-            "fecha": fecha_str,
-            "fecha_mostrar": fecha_dt.strftime("%Y-%m-%d %H:%M") if fecha_dt else fecha_str,
-            "remitente": m.get("remitente", ""),
-            "asunto": m.get("asunto", ""),
-            "n_siniestro": numero_guardado,  # puede ser None
-        }
+    modo_demo = False
+    if MAIL_STORE_ACTIVO and await run_in_threadpool(mail_store.listo, GRAPH_FOLDER_DISPLAY_NAME):
+        hasta = (date.fromisoformat(filtros["hasta"]) + timedelta(days=1)).isoformat() if filtros["hasta"] else None
+        clasificado = {"clasificados": True, "sin_clasificar": False}.get(filtros["estado"])
+        mails = await run_in_threadpool(
+            db.mail_pagina,
+            GRAPH_FOLDER_DISPLAY_NAME,
+            limite + 1,
+            antes,
+            filtros["desde"] or None,
+            hasta,
+            filtros["remitente"] or None,
+            filtros["numero"] or None,
+            clasificado,
+        )
+    else:
+        mails = await leer_correos_graph(max_mails=200)
+        if not mails:
+            modo_demo = True
+            mails = [
+                {
+                    "id": "demo1",
+                    "fecha": "2025-12-16T10:15:00",
+                    "remitente": "cliente1@ejemplo.cl",
+                    "asunto": "[ALERTA] Nuevo siniestro N°123",
+                },
+                # ...
+            ]
+        await run_in_threadpool(clasificar_mails, mails)
+        mails = _filtrar_siniestros(mails, filtros, antes, limite + 1)
+
+    siguiente = None
+    if len(mails) > limite:
+        mails = mails[:limite]
+        siguiente = paginacion.codificar(mails[-1]["fecha"], mails[-1]["id"])
+    ahora = datetime.utcnow()
+    return [_registro_siniestro(m, ahora) for m in mails], siguiente, modo_demo
 
-        if diff_dias is not None and diff_dias <= 10:
-            nuevos.append(registro)
-        else:
-            historicos.append(registro)
 
-    agrupado: dict[str, list[dict]] = {}
-    for m in nuevos + historicos:
-        numero = m.get("n_siniestro")
-        if not numero:
-            continue
-        agrupado.setdefault(numero, []).append(m)
+@app.get("/siniestros", response_class=HTMLResponse)
+async def pagina_siniestros(request: Request):
+    params = request.query_params
+    filtros = _filtros_siniestros(params)
+    mails, siguiente, modo_demo = await listar_siniestros(
+        filtros, params.get("cursor"), _limite_pagina(params)
+    )
+    resumen = await run_in_threadpool(resumen_siniestros)
 
     return templates.TemplateResponse(
         "siniestros.html",
         {
             "request": request,
-            "nuevos": nuevos,
-            "historicos": historicos,
+            "nuevos": [m for m in mails if m["nuevo"]],
+            "historicos": [m for m in mails if not m["nuevo"]],
             "modo_demo": modo_demo,
-            "agrupado": agrupado,
+            "filtros": filtros,
+            "resumen": resumen,
+            "es_primera": not params.get("cursor"),
+            "url_primera": str(request.url.remove_query_params("cursor")),
+            "url_siguiente": str(request.url.include_query_params(cursor=siguiente)) if siguiente else None,
+            "volver": request.url.query,
         },
     )
 
@@ -895,7 +1272,7 @@ from fastapi import HTTPException
 
 @app.get("/siniestros/mail/{mail_id}", name="ver_mail_siniestros", response_class=HTMLResponse)
 async def ver_mail_siniestros(request: Request, mail_id: str):
-    mail = leercorreo_siniestro_por_id(mail_id)
+    mail = await leercorreo_siniestro_por_id(mail_id)
     if not mail:
         raise HTTPException(status_code=404, detail="Correo de siniestros no encontrado")
 
@@ -912,23 +1289,17 @@ async def clasificar_siniestros(request: Request):
     form = await request.form()
     origen = form.get("origen", "")
 
-    global CLASIF_SINIESTROS_MAIL
+    # ID de mensaje -> número (o None para desclasificar), según el formulario
+    pedidos: dict[str, str | None] = {}
 
     # Nuevos
     if origen == "nuevos":
         idx = 0
         while f"id_nuevo_{idx}" in form:
+            mail_id = form.get(f"id_nuevo_{idx}", "").strip()
             numero = form.get(f"siniestro_nuevo_{idx}", "").strip()
-            fecha = form.get(f"fecha_nuevo_{idx}", "").strip()
-            remitente = form.get(f"remitente_nuevo_{idx}", "").strip()
-            asunto = form.get(f"asunto_nuevo_{idx}", "").strip()
-
-            clave = f"{fecha} - {asunto} ({remitente})"
-
-            if numero:
-                CLASIF_SINIESTROS_MAIL[clave] = numero
-            else:
-                CLASIF_SINIESTROS_MAIL.pop(clave, None)
+            if mail_id:
+                pedidos[mail_id] = numero or None
 
             idx += 1
 
@@ -936,27 +1307,26 @@ async def clasificar_siniestros(request: Request):
     elif origen == "historicos":
         idx = 0
         while f"id_historico_{idx}" in form:
+            mail_id = form.get(f"id_historico_{idx}", "").strip()
             numero = form.get(f"siniestro_historico_{idx}", "").strip()
-            fecha = form.get(f"fecha_historico_{idx}", "").strip()
-            remitente = form.get(f"remitente_historico_{idx}", "").strip()
-            asunto = form.get(f"asunto_historico_{idx}", "").strip()
-
-            clave = f"{fecha} - {asunto} ({remitente})"
-
-            if numero:
-                CLASIF_SINIESTROS_MAIL[clave] = numero
-            else:
-                CLASIF_SINIESTROS_MAIL.pop(clave, None)
+            if mail_id:
+                pedidos[mail_id] = numero or None
 
             idx += 1
 
-    guardar_clasificacion_siniestros(CLASIF_SINIESTROS_MAIL)
-    return RedirectResponse(url="/siniestros", status_code=303)
+    # Solo se escriben las filas que realmente cambian
+    try:
+        await run_in_threadpool(INDICE_SINIESTROS.aplicar, pedidos)
+    except Exception as e:
+        print("[SINIESTROS] Error al guardar clasificacion:", e)
+    # de vuelta a la misma página y filtros
+    volver = urlencode(parse_qsl(str(form.get("volver", ""))))
+    return RedirectResponse(url="/siniestros" + (f"?{volver}" if volver else ""), status_code=303)
 
 
 @app.get("/siniestros/clasificar", response_class=HTMLResponse)
 async def mostrar_clasificacion(request: Request):
-    mails_base = leer_correos_graph(max_mails=50)
+    mails_base = await leer_correos_graph(max_mails=50)
     modo_demo = False
     if not mails_base:
         modo_demo = True
@@ -1044,82 +1414,63 @@ from datetime import datetime
 # BANCOS: helpers y almacenamiento
 # ------------------------------
 
-RUTA_CLASIF_BANCOS = Path("clasificacion_bancos.json")
-
-
-def cargar_clasificacion_bancos() -> dict[str, list[dict]]:
-    """Lee clasificacion_bancos.json y devuelve {carpeta: [mails...]}."""
+def migrar_clasificacion_bancos() -> None:
+    """Copia una sola vez clasificacion_bancos.json a la tabla bancos_correos."""
     if not RUTA_CLASIF_BANCOS.exists():
-        return {}
+        return
     try:
         with RUTA_CLASIF_BANCOS.open("r", encoding="utf-8") as f:
             data = json.load(f)
-        return {str(k): list(v) for k, v in data.items()}
-    except Exception as e:
-        print("[BANCOS] Error al leer clasificacion bancos:", e)
-        return {}
-
-
-def guardar_clasificacion_bancos(mapa: dict[str, list[dict]]) -> None:
-    """Guarda {carpeta: [mails...]} en clasificacion_bancos.json."""
-    try:
-        with RUTA_CLASIF_BANCOS.open("w", encoding="utf-8") as f:
-            json.dump(mapa, f, ensure_ascii=False, indent=2)
+        filas = [
+            (m["id"], str(carpeta), m.get("fecha"), m.get("remitente"), m.get("asunto"))
+            for carpeta, mails in data.items()
+            for m in mails
+            if m.get("id")
+        ]
+        if db.migrar_una_vez(
+            "clasificacion_bancos_json",
+            lambda conn: db.bancos_correos_asignar(filas, conn=conn),
+        ):
+            print(f"[BANCOS] {len(filas)} correos clasificados migrados desde {RUTA_CLASIF_BANCOS}.")
     except Exception as e:
-        print("[BANCOS] Error al guardar clasificacion bancos:", e)
+        print("[BANCOS] Error al migrar clasificacion bancos:", e)
 
 
-POLIZAS_BENEF_BANCO: set[str] = set()
-CORREOS_BANCOS_CLASIFICADOS: dict[str, list[dict]] = cargar_clasificacion_bancos()
+@app.on_event("startup")
+def iniciar_estado_bancos():
+    db.initdb()
+    migrar_clasificacion_bancos()
 
 
 # ------------------------------
 # BANCOS: leer correos desde Graph
 # ------------------------------
 
-def leer_correos_bancos(max_mails: int = 50) -> list[dict]:
-    """Lee correos desde la subcarpeta Bancos de la Bandeja de entrada."""
+async def leer_correos_bancos(max_mails: int = 50) -> list[dict]:
+    """
+    Lee correos desde la subcarpeta Bancos de la Bandeja de entrada
+    (desde el almacén local si ya está listo, igual que leer_correos_graph).
+    """
+    if MAIL_STORE_ACTIVO and await run_in_threadpool(mail_store.listo, GRAPH_BANKS_FOLDER_DISPLAY_NAME):
+        return await run_in_threadpool(mail_store.listar, GRAPH_BANKS_FOLDER_DISPLAY_NAME)
+
     mails: list[dict] = []
-    token = get_graph_token()
+    token = await get_graph_token()
     if not token:
         return mails
 
-    headers = {"Authorization": f"Bearer {token}"}
-    base_url = "https://graph.microsoft.com/v1.0/"
-    user = GRAPH_USER or "me"
-
-    # 1) Buscar subcarpeta "Bancos" dentro de Inbox
-    resp = requests.get(
-        f"{base_url}users/{user}/mailFolders/inbox/childFolders",
-        headers=headers,
-        params={"$top": 200},
-        timeout=15,
-    )
-    if resp.status_code != 200:
-        print("[GRAPH] Error al listar carpetas Bancos:", resp.status_code, resp.text)
-        return mails
-
-    folders = resp.json().get("value", [])
-    folder_id = None
-    for f in folders:
-        if f.get("displayName") == GRAPH_BANKS_FOLDER_DISPLAY_NAME:
-            folder_id = f.get("id")
-            break
-    if folder_id is None:
-        print(f"[GRAPH] Carpeta {GRAPH_BANKS_FOLDER_DISPLAY_NAME} no encontrada en Inbox.")
-        return mails
-
-    # 2) Leer mensajes de esa carpeta
-    resp = requests.get(
-        f"{base_url}users/{user}/mailFolders/{folder_id}/messages",
-        headers=headers,
-        params={
+    # Leer mensajes de la subcarpeta "Bancos" dentro de Inbox
+    resp = await leer_mensajes_carpeta(
+        token,
+        GRAPH_BANKS_FOLDER_DISPLAY_NAME,
+        {
             "$top": max_mails,
             "$select": "id,subject,from,receivedDateTime",
             "$orderby": "receivedDateTime desc",
         },
-        timeout=15,
     )
+    if resp is None:
+        return mails
     if resp.status_code != 200:
         print("[GRAPH] Error al leer mensajes Bancos:", resp.status_code, resp.text)
         return mails
@@ -1141,48 +1492,21 @@ def leer_correos_bancos(max_mails: int = 50) -> list[dict]:
         )
     return mails
 
-def leer_correo_bancos_por_id(mail_id: str) -> dict | None:
+async def leer_correo_bancos_por_id(mail_id: str) -> dict | None:
     """
     Devuelve un correo de la carpeta Bancos con body HTML, o None si no existe.
     """
-    token = get_graph_token()
+    token = await get_graph_token()
     if not token:
         return None
 
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Prefer": 'outlook.body-content-type="html"',
-    }
-    base_url = "https://graph.microsoft.com/v1.0/"
     user = GRAPH_USER or "me"
 
-    # 1) localizar la carpeta Bancos (igual que antes)
-    resp = requests.get(
-    f"{base_url}users/{user}/messages/{mail_id}",
-    headers=headers,
-    params={"$select": "id,subject,from,receivedDateTime,body"},
-    timeout=15,
-    )
-
-    if resp.status_code != 200:
-        print("[GRAPH] Error al listar carpetas Bancos (body):", resp.status_code, resp.text)
-        return None
-
-    folders = resp.json().get("value", [])
-    folder_id = None
-    for f in folders:
-        if f.get("displayName") == GRAPH_BANKS_FOLDER_DISPLAY_NAME:
-            folder_id = f.get("id")
-            break
-    if folder_id is None:
-        print(f"[GRAPH] Carpeta {GRAPH_BANKS_FOLDER_DISPLAY_NAME} no encontrada (body).")
-        return None
-
-    # 2) obtener el mensaje concreto
-    resp = requests.get(
-        f"{base_url}users/{user}/mailFolders/{folder_id}/messages/{mail_id}",
-        headers=headers,
-        params={"$select": "id,subject,from,receivedDateTime,body"},
+    resp = await graph_client.get(
+        f"https://graph.microsoft.com/v1.0/users/{user}/messages/{mail_id}",
+        token=token,
+        headers={"Prefer": 'outlook.body-content-type="html"'},
+        params={"$select": "id,subject,from,receivedDateTime,body,parentFolderId"},
         timeout=15,
     )
     if resp.status_code != 200:
@@ -1190,6 +1514,9 @@ def leer_correo_bancos_por_id(mail_id: str) -> dict | None:
         return None
 
     item = resp.json()
+    if not await es_de_carpeta(token, item, GRAPH_BANKS_FOLDER_DISPLAY_NAME):
+        return None
+
     remitente = (
         item.get("from", {})
         .get("emailAddress", {})
@@ -1211,17 +1538,36 @@ def leer_correo_bancos_por_id(mail_id: str) -> dict | None:
 # BANCOS: página GET
 # ------------------------------
 
-@app.get("/bancos", response_class=HTMLResponse)
-async def pagina_bancos(request: Request):
-    anio_actual = datetime.now().year
+class CargaBancos:
+    """
+    Datos de /bancos para una sola petición: cada recurso (árbol de pólizas,
+    correos de Bancos) se pide como mucho una vez aunque varios pasos lo
+    necesiten, y los correos quedan indexados por ID.
+    """
+
+    def __init__(self):
+        self._tareas: dict[str, asyncio.Future] = {}
+        self._por_id: dict[str, dict] | None = None
+
+    def _una_vez(self, nombre: str, fabrica) -> asyncio.Future:
+        if nombre not in self._tareas:
+            self._tareas[nombre] = asyncio.ensure_future(fabrica())
+        return self._tareas[nombre]
+
+    async def polizas(self) -> list[dict]:
+        return await self._una_vez("polizas", lambda: arbol_polizas("polizas"))
+
+    async def mails(self) -> list[dict]:
+        return await self._una_vez("mails", lambda: leer_correos_bancos(max_mails=50))
+
+    async def mails_por_id(self) -> dict[str, dict]:
+        if self._por_id is None:
+            self._por_id = {m["id"]: m for m in await self.mails() if m.get("id")}
+        return self._por_id
 
-    try:
-        polizas_data = get_sharepoint_folder_tree(POLIZAS_FOLDER_PATH)
-        mensaje = None
-    except Exception as e:
-        polizas_data = []
-        mensaje = f"Error al cargar pólizas desde SharePoint: {e}"
 
+def _carpetas_anio(polizas_data: list[dict], anio: int) -> dict[str, list[dict]]:
+    """PDFs de cada carpeta modificados en `anio`, como los espera bancos.html."""
     carpetas_filtradas: dict[str, list[dict]] = {}
     for carpeta_info in polizas_data:
         carpeta = carpeta_info["carpeta"]
@@ -1229,7 +1575,7 @@ async def pagina_bancos(request: Request):
         for a in carpeta_info["archivos"]:
             fecha_str = a["fecha"]          # "YYYY-mm-dd HH:MM"
             fechadt = datetime.strptime(fecha_str, "%Y-%m-%d %H:%M")
-            if fechadt.year != anio_actual:
+            if fechadt.year != anio:
                 continue
             filtrados.append(
                 {
@@ -1241,19 +1587,50 @@ async def pagina_bancos(request: Request):
             )
         if filtrados:
             carpetas_filtradas[carpeta] = filtrados
+    return carpetas_filtradas
 
-    mails_bancos = leer_correos_bancos(max_mails=50)
-    subcarpetas_polizas = [c["carpeta"] for c in polizas_data]
+
+# Avisos que el POST deja en la URL del redirect (?aviso=...&n=...)
+AVISOS_BANCOS = {
+    "conflicto": (
+        "Otro usuario modificó la selección de pólizas mientras la editabas; "
+        "se muestra la selección actual, revisa y vuelve a guardar."
+    ),
+    "omitidos": "{n} correo(s) ya habían sido clasificados por otro usuario.",
+}
+
+
+@app.get("/bancos", response_class=HTMLResponse)
+async def pagina_bancos(request: Request):
+    carga = CargaBancos()
+    # árbol (CACHE_PAGINAS) y correos en paralelo
+    tarea_mails = asyncio.ensure_future(carga.mails())
+
+    try:
+        polizas_data = await carga.polizas()
+        mensaje = None
+    except Exception as e:
+        polizas_data = []
+        mensaje = f"Error al cargar pólizas desde SharePoint: {e}"
+
+    aviso = AVISOS_BANCOS.get(request.query_params.get("aviso", ""))
+    if aviso and not mensaje:
+        n = request.query_params.get("n", "")
+        mensaje = aviso.format(n=int(n) if n.isdigit() else "Algunos")
+
+    mails_bancos = await tarea_mails
+    await run_in_threadpool(ESTADO_BANCOS.refrescar)
 
     return templates.TemplateResponse(
         "bancos.html",
         {
             "request": request,
-            "carpetas": carpetas_filtradas,
-            "polizas_benef_banco": POLIZAS_BENEF_BANCO,
+            "carpetas": _carpetas_anio(polizas_data, datetime.now().year),
+            "polizas_benef_banco": ESTADO_BANCOS.polizas_benef_banco(),
+            "version_polizas": ESTADO_BANCOS.version_polizas,
             "mails_bancos": mails_bancos,
-            "subcarpetas_polizas": subcarpetas_polizas,
-            "correos_bancos_clasificados": CORREOS_BANCOS_CLASIFICADOS,
+            "subcarpetas_polizas": [c["carpeta"] for c in polizas_data],
+            "correos_bancos_clasificados": ESTADO_BANCOS.correos_clasificados(),
             "mensaje": mensaje,
         },
     )
@@ -1270,120 +1647,138 @@ async def clasificar_bancos(
     seleccion: Optional[list[str]] = Form(default=None),       # PDFs
     mail_id: Optional[list[str]] = Form(default=None),         # correos
     mail_carpeta: Optional[list[str]] = Form(default=None),    # subcarpetas
+    version: Optional[int] = Form(default=None),               # versión vista de la selección
 ):
-    global POLIZAS_BENEF_BANCO, CORREOS_BANCOS_CLASIFICADOS
-
+    """Guarda y redirige al GET (POST/redirect/GET): la página no se arma aquí."""
     seleccion = seleccion or []
     mail_id = mail_id or []
     mail_carpeta = mail_carpeta or []
 
-    print("[DEBUG BANCOS] origen       =", origen)
-    print("[DEBUG BANCOS] seleccion    =", seleccion)
-    print("[DEBUG BANCOS] mail_id      =", mail_id)
-    print("[DEBUG BANCOS] mail_carpeta =", mail_carpeta)
+    destino = "/bancos"
 
-    # 1) Si viene del bloque de pólizas: actualizar set de PDFs con banco
+    # 1) Si viene del bloque de pólizas: guardar la selección de PDFs con banco
     if origen == "polizas":
-        POLIZAS_BENEF_BANCO = set(seleccion)
-        print("[DEBUG BANCOS] POLIZAS_BENEF_BANCO =", POLIZAS_BENEF_BANCO)
+        try:
+            await run_in_threadpool(ESTADO_BANCOS.guardar_polizas, set(seleccion), version)
+        except db.ConflictoVersion:
+            destino = "/bancos?aviso=conflicto"
 
-    # 2) Si viene del bloque de correos: reconstruir clasificación de correos
+    # 2) Si viene del bloque de correos: asignar solo los correos enviados
     if origen == "mails":
-        mails_bancos = leer_correos_bancos(max_mails=50)
-        CORREOS_BANCOS_CLASIFICADOS = {}
+        filas = []
+        pedidos = [(mid, (c or "").strip()) for mid, c in zip(mail_id, mail_carpeta)]
+        if any(c for _, c in pedidos):
+            mails_por_id = await CargaBancos().mails_por_id()
+            for mid, carpeta_destino in pedidos:
+                info = mails_por_id.get(mid)
+                if not carpeta_destino or not info:
+                    continue
+                filas.append(
+                    (mid, carpeta_destino, info.get("fecha"), info.get("remitente"), info.get("asunto"))
+                )
 
-        for mid, carpeta_destino in zip(mail_id, mail_carpeta):
-            carpeta_destino = (carpeta_destino or "").strip()
-            if not carpeta_destino:
-                continue
-            info = next((m for m in mails_bancos if m.get("id") == mid), None)
-            if not info:
-                continue
-            CORREOS_BANCOS_CLASIFICADOS.setdefault(carpeta_destino, []).append(info)
+        omitidos = await run_in_threadpool(ESTADO_BANCOS.asignar_correos, filas)
+        if omitidos:
+            destino = f"/bancos?aviso=omitidos&n={omitidos}"
 
-        print("[DEBUG BANCOS] CLASIFICADOS =", CORREOS_BANCOS_CLASIFICADOS)
+    return RedirectResponse(url=destino, status_code=303)
 
-        guardar_clasificacion_bancos(CORREOS_BANCOS_CLASIFICADOS)
 
-    # 3) Volver a armar la página igual que el GET
-    anio_actual = datetime.now().year
-    try:
-        polizas_data = get_sharepoint_folder_tree(POLIZAS_FOLDER_PATH)
-        mensaje = None
-    except Exception as e:
-        polizas_data = []
-        mensaje = f"Error al cargar pólizas desde SharePoint: {e}"
-
-    carpetas_filtradas: dict[str, list[dict]] = {}
-    for carpeta_info in polizas_data:
-        carpeta = carpeta_info["carpeta"]
-        filtrados = []
-        for a in carpeta_info["archivos"]:
-            fecha_str = a["fecha"]
-            fechadt = datetime.strptime(fecha_str, "%Y-%m-%d %H:%M")
-            if fechadt.year != anio_actual:
-                continue
-            filtrados.append(
-                {
-                    "nombre": a["nombre"],
-                    "mtime": fecha_str,
-                    "mtime_date": fechadt.date(),
-                    "rel_path": a["nombre"],
-                }
-            )
-        if filtrados:
-            carpetas_filtradas[carpeta] = filtrados
-
-    subcarpetas_polizas = [c["carpeta"] for c in polizas_data]
-    mails_bancos = leer_correos_bancos(max_mails=50)
+@app.get("/bancos/mail/{mail_id}", name="ver_mail_bancos", response_class=HTMLResponse)
+async def ver_mail_bancos(request: Request, mail_id: str):
+    mail = await leer_correo_bancos_por_id(mail_id)
+    if not mail:
+        raise HTTPException(status_code=404, detail="Correo no encontrado")
 
     return templates.TemplateResponse(
-        "bancos.html",
+        "preview_mail_bancos.html",
         {
             "request": request,
-            "carpetas": carpetas_filtradas,
-            "polizas_benef_banco": POLIZAS_BENEF_BANCO,
-            "mails_bancos": mails_bancos,
-            "subcarpetas_polizas": subcarpetas_polizas,
-            "correos_bancos_clasificados": CORREOS_BANCOS_CLASIFICADOS,
-            "mensaje": mensaje,
+            "mail": mail,
         },
     )
 
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 
+# ---------------------------------------------------------------------
+# API JSON (v1): mismos datos que las páginas HTML, con ?campos=a,b,
+# ?cursor=&limite=, ETag/304 y compresión (ver api_json)
+# ---------------------------------------------------------------------
+@app.get("/api/v1/polizas")
+async def api_polizas(request: Request):
+    """
+    Carpetas de pólizas [{carpeta, cantidad, archivos}] como en /polizas, por
+    páginas de carpetas. ?filtro=polizas aplica el filtro interno (solo PDFs
+    con 'póliza' en el nombre). Sale de arbol_polizas (CACHE_PAGINAS).
+    """
+    params = request.query_params
+    filtro = params.get("filtro", "")
+    if filtro not in ("", "polizas"):
+        raise HTTPException(status_code=400, detail=f"Filtro inválido: {filtro}")
+    try:
+        arbol = await arbol_polizas(filtro)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Error al leer pólizas desde SharePoint: {e}")
 
-from fastapi import HTTPException
+    carpetas, siguiente = api_json.pagina_en_memoria(
+        arbol,
+        lambda c: (c["carpeta"].lower(), c["carpeta"]),
+        params.get("cursor"),
+        _limite_pagina(params),
+    )
+    return api_json.respuesta(
+        request,
+        {"datos": api_json.seleccionar(carpetas, api_json.campos_pedidos(request)), "siguiente": siguiente},
+    )
 
-@app.get("/bancos/mail/{mail_id}", name="ver_mail_bancos", response_class=HTMLResponse)
-async def ver_mail_bancos(request: Request, mail_id: str):
-    mails = leer_correos_bancos(max_mails=50)
-    mail = next((m for m in mails if m.get("id") == mail_id), None)
-    if not mail:
-        raise HTTPException(status_code=404, detail="Correo no encontrado")
 
-    return templates.TemplateResponse(
-        "preview_mail_bancos.html",
+@app.get("/api/v1/siniestros")
+async def api_siniestros(request: Request):
+    """Correos de Seguros como en /siniestros (mismos filtros y cursor)."""
+    params = request.query_params
+    mails, siguiente, modo_demo = await listar_siniestros(
+        _filtros_siniestros(params), params.get("cursor"), _limite_pagina(params)
+    )
+    if modo_demo:
+        # Graph no respondió: los correos de ejemplo son solo para la página HTML
+        raise HTTPException(status_code=502, detail="No se pudieron leer los correos de Seguros desde Graph")
+    return api_json.respuesta(
+        request,
         {
-            "request": request,
-            "mail": mail,
+            "datos": api_json.seleccionar(mails, api_json.campos_pedidos(request)),
+            "siguiente": siguiente,
         },
     )
 
-from fastapi import HTTPException
-
-@app.get("/bancos/mail/{mail_id}", name="ver_mail_bancos", response_class=HTMLResponse)
-async def ver_mail_bancos(request: Request, mail_id: str):
-    mail = leer_correo_bancos_por_id(mail_id)
-    if not mail:
-        raise HTTPException(status_code=404, detail="Correo no encontrado")
 
-    return templates.TemplateResponse(
-        "preview_mail_bancos.html",
+@app.get("/api/v1/bancos")
+async def api_bancos(request: Request):
+    """
+    Correos de Bancos (del más reciente al más antiguo) con la subcarpeta a
+    la que se asignaron, y las pólizas marcadas con banco beneficiario. Las
+    carpetas de pólizas están en /api/v1/polizas?filtro=polizas.
+    """
+    params = request.query_params
+    mails = await leer_correos_bancos(max_mails=50)
+    await run_in_threadpool(ESTADO_BANCOS.refrescar)
+    carpeta_de = {
+        c["id"]: carpeta
+        for carpeta, lista in ESTADO_BANCOS.correos_clasificados().items()
+        for c in lista
+    }
+    mails = [dict(m, carpeta=carpeta_de.get(m.get("id"))) for m in mails]
+    pagina, siguiente = api_json.pagina_en_memoria(
+        mails,
+        lambda m: (m.get("fecha") or "", m.get("id") or ""),
+        params.get("cursor"),
+        _limite_pagina(params),
+        descendente=True,
+    )
+    return api_json.respuesta(
+        request,
         {
-            "request": request,
-            "mail": mail,
+            "datos": api_json.seleccionar(pagina, api_json.campos_pedidos(request)),
+            "siguiente": siguiente,
+            "polizas_benef_banco": sorted(ESTADO_BANCOS.polizas_benef_banco()),
+            "version_polizas": ESTADO_BANCOS.version_polizas,
         },
     )
@@ -0,0 +1,32 @@
+# paginacion.py
+# -- coding: utf-8 --
+# Cursores opacos para listados paginados por clave (keyset): el cursor
+# guarda los valores de orden de la última fila entregada y la página
+# siguiente continúa desde ahí, en vez de usar OFFSET.
+
+import base64
+import json
+from typing import Optional, Tuple
+
+
+class CursorInvalido(ValueError):
+    """El cursor no se puede decodificar o no tiene la forma esperada."""
+
+
+def codificar(*valores) -> str:
+    crudo = json.dumps(valores, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(crudo).decode("ascii").rstrip("=")
+
+
+def decodificar(cursor: Optional[str], n: int) -> Optional[Tuple]:
+    """Valores guardados en el cursor (None si no hay cursor)."""
+    if not cursor:
+        return None
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valores = json.loads(crudo)
+    except (ValueError, TypeError) as e:
+        raise CursorInvalido(f"Cursor inválido: {cursor!r}") from e
+    if not isinstance(valores, list) or len(valores) != n:
+        raise CursorInvalido(f"Cursor inválido: {cursor!r}")
+    return tuple(valores)
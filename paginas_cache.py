@@ -0,0 +1,128 @@
+# paginas_cache.py
+# -- coding: utf-8 --
+# Caché de páginas renderizadas (árbol de datos + HTML) con
+# stale-while-revalidate: una entrada vencida se sigue entregando al instante
+# mientras una sola tarea de fondo la regenera. Cada entrada lleva ETag y
+# Last-Modified para que el navegador pueda pedir 304.
+
+import asyncio
+import hashlib
+import os
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+TTL = int(os.getenv("POLIZAS_CACHE_TTL", "300"))
+# Si una revalidación falla, se reintenta recién pasado este plazo
+REINTENTO = 30
+
+# generar() -> (arbol, html)
+Generador = Callable[[], Awaitable[Tuple[Any, str]]]
+
+
+class Pagina:
+    """Una página ya renderizada."""
+
+    def __init__(self, arbol: Any, html: str, ttl: float = TTL):
+        self.arbol = arbol
+        self.cuerpo = html.encode("utf-8")
+        self.etag = f'"{hashlib.sha256(self.cuerpo).hexdigest()[:32]}"'
+        self.generada = time.time()
+        self.last_modified = formatdate(self.generada, usegmt=True)
+        self.vence = time.monotonic() + ttl
+
+    def vigente(self) -> bool:
+        return time.monotonic() < self.vence
+
+    def no_modificada(self, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+        """True si el navegador ya tiene esta versión (responder 304)."""
+        if if_none_match:
+            candidatos = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+            return "*" in candidatos or self.etag in candidatos
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= int(self.generada)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class CachePaginas:
+    def __init__(self, ttl: float = TTL):
+        self.ttl = ttl
+        self._paginas: Dict[str, Pagina] = {}
+        self._en_curso: Dict[str, asyncio.Task] = {}
+        self._version = 0
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.revalidaciones = 0
+        self.errores = 0
+
+    async def _generar(self, clave: str, generar: Generador) -> Pagina:
+        version = self._version
+        arbol, html = await generar()
+        pagina = Pagina(arbol, html, self.ttl)
+        if version != self._version:
+            # se invalidó mientras se generaba: puede traer datos viejos
+            pagina.vence = 0.0
+        self._paginas[clave] = pagina
+        return pagina
+
+    async def _revalidar(self, clave: str, generar: Generador) -> None:
+        try:
+            await self._generar(clave, generar)
+            self.revalidaciones += 1
+        except Exception as e:
+            self.errores += 1
+            print(f"[PAGINAS] Error al revalidar '{clave}':", e)
+            vieja = self._paginas.get(clave)
+            if vieja is not None:
+                vieja.vence = time.monotonic() + REINTENTO
+        finally:
+            self._en_curso.pop(clave, None)
+
+    async def obtener(self, clave: str, generar: Generador) -> Pagina:
+        """
+        Página `clave`: la cacheada si está vigente; la vencida (y se revalida
+        en segundo plano) si existe; si no, se genera ahora. Las peticiones
+        simultáneas comparten una misma generación.
+        """
+        pagina = self._paginas.get(clave)
+        if pagina is not None:
+            if pagina.vigente():
+                self.hits += 1
+            else:
+                self.stale += 1
+                if clave not in self._en_curso:
+                    self._en_curso[clave] = asyncio.create_task(self._revalidar(clave, generar))
+            return pagina
+
+        self.misses += 1
+        tarea = self._en_curso.get(clave)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._generar(clave, generar))
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda _: self._en_curso.pop(clave, None))
+        return await asyncio.shield(tarea)
+
+    def invalidar(self, clave: Optional[str] = None) -> None:
+        """
+        Marca como vencida una página (o todas). Se sigue sirviendo hasta que
+        la revalidación termine. Llamar desde el event loop; desde otro hilo,
+        con loop.call_soon_threadsafe(cache.invalidar).
+        """
+        self._version += 1
+        for k, pagina in list(self._paginas.items()):
+            if clave is None or k == clave:
+                pagina.vence = 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "entradas": len(self._paginas),
+            "hits": self.hits,
+            "stale": self.stale,
+            "misses": self.misses,
+            "revalidaciones": self.revalidaciones,
+            "errores": self.errores,
+        }
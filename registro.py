@@ -0,0 +1,94 @@
+# registro.py
+# -- coding: utf-8 --
+# Registro estructurado del watcher: una línea JSON por evento, solo
+# anexando al final del archivo. Quien registra solo pone el evento en una
+# cola; un hilo (logging.handlers.QueueListener) lo escribe. El archivo rota
+# al pasar LOG_MAX_MB o al cambiar el día, y se guardan LOG_RESPALDOS copias.
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import Optional
+
+LOG_MAX_BYTES = int(float(os.getenv("LOG_MAX_MB", "10")) * 1024 * 1024)
+LOG_RESPALDOS = int(os.getenv("LOG_RESPALDOS", "14"))
+
+# campos de cada línea aparte de ts/estado/mensaje (en este orden)
+CAMPOS = ("evento", "path", "duracion_ms", "smtp", "correo", "sha256", "detalle")
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        linea = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "estado": record.getMessage(),
+        }
+        for campo, valor in getattr(record, "campos", {}).items():
+            if valor is not None:
+                linea[campo] = valor if isinstance(valor, (int, float, bool)) else str(valor)
+        return json.dumps(linea, ensure_ascii=False)
+
+
+class RotacionTamanoYDia(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler que además rota cuando cambia la fecha."""
+
+    def __init__(self, ruta: Path, max_bytes: int, respaldos: int):
+        super().__init__(ruta, maxBytes=max_bytes, backupCount=respaldos, encoding="utf-8", delay=True)
+        self._dia = date.fromtimestamp(ruta.stat().st_mtime) if ruta.exists() else date.today()
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        if date.fromtimestamp(record.created) != self._dia:
+            return 1
+        return super().shouldRollover(record)
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self._dia = date.today()
+
+
+class Registro:
+    """
+    registrar(estado, evento=..., path=..., ...) no bloquea ni toca el disco:
+    el costo por evento es el mismo sea cual sea el tamaño del archivo.
+    """
+
+    def __init__(
+        self,
+        ruta: Path,
+        max_bytes: int = LOG_MAX_BYTES,
+        respaldos: int = LOG_RESPALDOS,
+        consola: bool = True,
+    ):
+        self.ruta = ruta
+        self.consola = consola
+        self._archivo = RotacionTamanoYDia(ruta, max_bytes, respaldos)
+        self._archivo.setFormatter(FormatoJSON())
+        self._cola: queue.SimpleQueue = queue.SimpleQueue()
+        self._logger = logging.getLogger(f"registro.{ruta}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.handlers = [logging.handlers.QueueHandler(self._cola)]
+        self._listener = logging.handlers.QueueListener(self._cola, self._archivo)
+        self._listener.start()
+
+    def registrar(self, estado: str, **campos) -> None:
+        self._logger.info(estado, extra={"campos": campos})
+        if self.consola:
+            partes = [f"{c}={campos[c]}" for c in CAMPOS if campos.get(c) is not None]
+            partes += [f"{c}={v}" for c, v in campos.items() if c not in CAMPOS and v is not None]
+            print(" | ".join([time.strftime("%Y-%m-%d %H:%M:%S"), estado] + partes))
+
+    def cerrar(self) -> None:
+        """Escribe lo que quede en la cola y cierra el archivo."""
+        self._listener.stop()
+        self._archivo.close()
+
+
+def duracion_ms(inicio: float, fin: Optional[float] = None) -> float:
+    """Milisegundos desde `inicio` (time.perf_counter)."""
+    return round(((fin or time.perf_counter()) - inicio) * 1000, 1)
@@ -0,0 +1,61 @@
+# sharepoint_crawler.py
+# -- coding: utf-8 --
+# Recorre una carpeta de SharePoint (Graph) en anchura, listando carpetas
+# hermanas en paralelo con una concurrencia acotada y siguiendo @odata.nextLink.
+
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
+import graph_client
+
+GRAPH_BASE = graph_client.GRAPH_BASE
+MAX_WORKERS = int(os.getenv("SP_CRAWLER_WORKERS", "8"))
+PAGE_SIZE = 999
+
+
+async def listar_hijos(drive_id: str, item_id: str, token: str) -> List[Dict]:
+    """Todos los hijos directos de un item, siguiendo la paginación."""
+    url: Optional[str] = f"{GRAPH_BASE}/drives/{drive_id}/items/{item_id}/children"
+    params: Optional[Dict] = {"$top": PAGE_SIZE}
+    items: List[Dict] = []
+    while url:
+        resp = await graph_client.get(url, token=token, params=params)
+        resp.raise_for_status()
+        data = resp.json()
+        items.extend(data.get("value", []))
+        url = data.get("@odata.nextLink")
+        params = None  # nextLink ya trae la query completa
+    return items
+
+
+async def recorrer_archivos(
+    drive_id: str,
+    root_id: str,
+    token: str,
+    max_workers: int = MAX_WORKERS,
+) -> List[Tuple[Optional[str], Dict]]:
+    """
+    Devuelve (carpeta_primer_nivel, item) por cada archivo bajo root_id.
+    carpeta_primer_nivel es None para archivos directamente en la raíz.
+    Cada nivel se lista completo (en paralelo) antes de bajar al siguiente.
+    """
+    sem = asyncio.Semaphore(max_workers)
+    archivos: List[Tuple[Optional[str], Dict]] = []
+
+    async def listar(item_id: str) -> List[Dict]:
+        async with sem:
+            return await listar_hijos(drive_id, item_id, token)
+
+    nivel: List[Tuple[str, Optional[str]]] = [(root_id, None)]
+    while nivel:
+        hijos = await asyncio.gather(*(listar(item_id) for item_id, _ in nivel))
+        siguiente: List[Tuple[str, Optional[str]]] = []
+        for (_, agrupador), items in zip(nivel, hijos):
+            for it in items:
+                if "folder" in it:
+                    siguiente.append((it["id"], agrupador if agrupador is not None else it["name"]))
+                elif "file" in it:
+                    archivos.append((agrupador, it))
+        nivel = siguiente
+    return archivos
@@ -0,0 +1,164 @@
+# sharepoint_index.py
+# -- coding: utf-8 --
+# Índice local (SQLite, ver db.sp_items) del drive de SharePoint alimentado por
+# el endpoint delta de Graph. La primera pasada enumera todo el drive; las
+# siguientes aplican solo los cambios desde el último deltaLink.
+#
+# En SharePoint/OneDrive for Business delta solo funciona sobre la raíz del
+# drive, por eso se indexa el drive completo y el subárbol (ej. /Seguros/Pólizas)
+# se arma al leer con una consulta recursiva desde la carpeta raíz pedida.
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import requests
+
+import db
+import graph_auth
+
+GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+# Graph no informa la vigencia de @microsoft.graph.downloadUrl; dura ~1 hora.
+DOWNLOAD_URL_TTL = 55 * 60
+INTERVALO = int(os.getenv("SP_INDEX_INTERVALO", "60"))
+
+_lock_sync = threading.Lock()
+
+
+def _fila(it: Dict, ahora: float) -> tuple:
+    download_url = it.get("@microsoft.graph.downloadUrl")
+    return (
+        it["id"],
+        (it.get("parentReference") or {}).get("id"),
+        it.get("name", ""),
+        1 if ("folder" in it or "root" in it) else 0,
+        it.get("lastModifiedDateTime"),
+        it.get("size"),
+        download_url,
+        ahora + DOWNLOAD_URL_TTL if download_url else None,
+    )
+
+
+def sincronizar(drive_id: str, headers: Dict, session=None) -> int:
+    """
+    Trae los cambios delta del drive y los aplica al índice local.
+    Devuelve la cantidad de items procesados. Si el deltaLink expiró
+    (410 Gone) se borra el índice y se vuelve a enumerar desde cero.
+    session: objeto con .get() compatible con requests (inyectable en pruebas).
+    """
+    session = session or requests
+    with _lock_sync:
+        url: Optional[str] = db.sp_delta_get(drive_id)
+        if url is None:
+            db.sp_items_reset(drive_id)
+            url = f"{GRAPH_BASE}/drives/{drive_id}/root/delta"
+
+        procesados = 0
+        while url:
+            resp = session.get(url, headers=headers, timeout=60)
+            if resp.status_code == 410:
+                print("[SP INDEX] deltaLink expirado; resincronización completa.")
+                db.sp_items_reset(drive_id)
+                procesados = 0
+                url = f"{GRAPH_BASE}/drives/{drive_id}/root/delta"
+                continue
+            resp.raise_for_status()
+            data = resp.json()
+
+            ahora = time.time()
+            upserts, deletes = [], []
+            for it in data.get("value", []):
+                if "deleted" in it:
+                    deletes.append(it["id"])
+                else:
+                    upserts.append(_fila(it, ahora))
+            procesados += len(upserts) + len(deletes)
+
+            delta_link = data.get("@odata.deltaLink")
+            db.sp_items_apply(drive_id, upserts, deletes, delta_link)
+            url = data.get("@odata.nextLink")
+        return procesados
+
+
+def listo(drive_id: str) -> bool:
+    """True si el drive ya tiene una enumeración completa en el índice."""
+    try:
+        return db.sp_delta_get(drive_id) is not None
+    except Exception:
+        return False
+
+
+def pertenece(item_id: str, root_id: str) -> bool:
+    """True si item_id está (a cualquier profundidad) bajo root_id."""
+    actual: Optional[str] = item_id
+    vistos = set()
+    while actual and actual not in vistos:
+        vistos.add(actual)
+        actual = db.sp_item_parent(actual)
+        if actual == root_id:
+            return True
+    return False
+
+
+def url_vigente(item_id: str, margen: float = 300) -> Optional[str]:
+    """downloadUrl guardado del item si le quedan más de `margen` segundos."""
+    guardada = db.sp_item_download_url(item_id)
+    if guardada and (guardada[1] or 0) - time.time() > margen:
+        return guardada[0]
+    return None
+
+
+def recorrer_archivos(
+    drive_id: str,
+    root_id: str,
+    url_descarga: Callable[[str], str],
+) -> Iterator[Tuple[Optional[str], Dict]]:
+    """
+    Igual que sharepoint_crawler.recorrer_archivos, pero desde el índice local:
+    entrega (carpeta_primer_nivel, item) por cada archivo bajo root_id.
+    url_descarga(item_id) se usa cuando el downloadUrl guardado ya venció.
+    """
+    ahora = time.time()
+    for fila in db.sp_items_subarbol(drive_id, root_id):
+        url = fila["download_url"]
+        if not url or (fila["download_url_expira"] or 0) <= ahora:
+            url = url_descarga(fila["id"])
+        yield fila["carpeta"], {
+            "id": fila["id"],
+            "name": fila["name"],
+            "size": fila["size"],
+            "lastModifiedDateTime": fila["last_modified"],
+            "@microsoft.graph.downloadUrl": url,
+        }
+
+
+def iniciar_en_segundo_plano(
+    resolver: Callable[[], Tuple[str, Dict]],
+    intervalo: int = INTERVALO,
+    al_cambiar: Optional[Callable[[], None]] = None,
+) -> threading.Thread:
+    """
+    Lanza un hilo daemon que sincroniza el índice cada `intervalo` segundos.
+    resolver() debe devolver (drive_id, headers) con un token vigente.
+    al_cambiar(), si se da, se llama cada vez que el delta trae cambios.
+    """
+    def bucle():
+        while True:
+            headers: Dict = {}
+            try:
+                drive_id, headers = resolver()
+                n = sincronizar(drive_id, headers)
+                if n:
+                    print(f"[SP INDEX] {n} cambios aplicados.")
+                    if al_cambiar is not None:
+                        al_cambiar()
+            except Exception as e:
+                print("[SP INDEX] Error al sincronizar:", e)
+                if headers and getattr(getattr(e, "response", None), "status_code", None) == 401:
+                    graph_auth.descartar(headers["Authorization"].removeprefix("Bearer "))
+            time.sleep(intervalo)
+
+    hilo = threading.Thread(target=bucle, name="sp-index", daemon=True)
+    hilo.start()
+    return hilo
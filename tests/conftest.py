@@ -0,0 +1,21 @@
+# conftest.py
+# -- coding: utf-8 --
+# Las pruebas importan los módulos de la raíz del repo y usan una base
+# SQLite temporal por prueba (db.DBPATH).
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def db_temporal(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DBPATH", tmp_path / "watcherstate.sqlite3")
+    db.initdb()
+    yield db
+    db.cerrar_conn()
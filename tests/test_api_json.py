@@ -0,0 +1,74 @@
+# test_api_json.py
+# -- coding: utf-8 --
+# Negociación de Accept-Encoding y ETag por codificación en api_json.respuesta.
+
+import gzip
+
+import pytest
+from starlette.requests import Request
+
+import api_json
+
+DATOS = {"datos": [{"id": i, "asunto": "Siniestro N°%d" % i} for i in range(100)]}
+
+
+def pedir(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/api/v1/siniestros",
+        "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()],
+    })
+
+
+@pytest.mark.parametrize(
+    "accept, esperada",
+    [
+        ("", None),
+        ("gzip", "gzip"),
+        ("gzip, br", "br"),
+        ("br;q=0, gzip", "gzip"),
+        ("br;q=0.0, gzip", "gzip"),
+        ("br; q=0.000, gzip;q=0.5", "gzip"),
+        ("br;q=0.2, gzip;q=0.8", "gzip"),
+        ("gzip;q=0, br;q=0", None),
+        ("*", "br"),
+        ("*;q=0.5, br;q=0", "gzip"),
+        ("identity", None),
+        ("GZIP;Q=1", "gzip"),
+        ("gzip;q=abc", None),
+    ],
+)
+def test_codificacion(accept, esperada):
+    assert api_json._codificacion(accept) == esperada
+
+
+def test_codificacion_sin_brotli(monkeypatch):
+    monkeypatch.setattr(api_json, "brotli", None)
+    assert api_json._codificacion("br, gzip;q=0.1") == "gzip"
+    assert api_json._codificacion("br") is None
+
+
+def test_etag_distinto_por_codificacion():
+    plano = api_json.respuesta(pedir(), DATOS)
+    comprimido = api_json.respuesta(pedir(accept_encoding="gzip"), DATOS)
+
+    assert plano.headers["etag"] != comprimido.headers["etag"]
+    assert comprimido.headers["etag"].endswith('-gzip"')
+    assert comprimido.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(comprimido.body) == plano.body
+    assert plano.headers["vary"] == comprimido.headers["vary"] == "Accept-Encoding"
+
+
+def test_304_solo_para_la_misma_codificacion():
+    etag = api_json.respuesta(pedir(accept_encoding="gzip"), DATOS).headers["etag"]
+
+    assert api_json.respuesta(pedir(accept_encoding="gzip", if_none_match=etag), DATOS).status_code == 304
+    assert api_json.respuesta(pedir(accept_encoding="gzip", if_none_match="W/" + etag), DATOS).status_code == 304
+    assert api_json.respuesta(pedir(if_none_match=etag), DATOS).status_code == 200
+
+
+def test_cuerpo_pequeño_no_se_comprime():
+    r = api_json.respuesta(pedir(accept_encoding="gzip"), {"datos": []})
+    assert "content-encoding" not in r.headers
+    assert not r.headers["etag"].endswith('-gzip"')
@@ -0,0 +1,196 @@
+# test_correo_salida.py
+# -- coding: utf-8 --
+# correo_salida contra un SMTP local (aiosmtpd, ver requirements-dev.txt):
+# reutilización de la conexión, reintentos con backoff ante errores
+# transitorios, errores permanentes y el registro de alertas en db.
+
+import smtplib
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import correo_salida
+
+HOST = "127.0.0.1"
+
+
+class Servidor:
+    """Handler de aiosmtpd: guarda los mensajes; `rechazar` responde ese código en RCPT."""
+
+    def __init__(self):
+        self.recibidos = []
+        self.rechazar = None
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if self.rechazar:
+            return self.rechazar
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recibidos.append(envelope.content)
+        return "250 OK"
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def esperar(condicion, limite: float = 10) -> None:
+    fin = time.monotonic() + limite
+    while not condicion():
+        if time.monotonic() > fin:
+            raise AssertionError("no se cumplió a tiempo")
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def smtp():
+    servidor = Servidor()
+    controller = Controller(servidor, hostname=HOST, port=puerto_libre())
+    controller.start()
+    yield servidor, controller.port
+    controller.stop()
+
+
+@pytest.fixture
+def buzon(db_temporal, smtp, monkeypatch):
+    monkeypatch.setattr(correo_salida, "REINTENTO_BASE", 0.2)
+    resultados = []
+    creados = []
+
+    def crear(port=None):
+        b = correo_salida.BuzonSalida(
+            correo_salida.ConexionSMTP(HOST, port or smtp[1], starttls=False, timeout=5),
+            al_resultado=lambda fila, estado, detalle: resultados.append((fila["id"], estado)),
+        )
+        creados.append(b)
+        return b
+
+    yield crear, resultados
+    for b in creados:
+        b.detener()
+
+
+def archivos(db, n: int):
+    """Crea n filas en files (alerts.fileid es FK) y devuelve sus id."""
+    return [db.upsert_file(Path(f"/polizas/{i}.pdf"), f"{i:064x}", 1, 1) for i in range(n)]
+
+
+def encolar(b, i: int, fileids=()):
+    return b.encolar(f"Alerta {i}", f"Cuerpo {i}", "watcher@localhost", ["destino@localhost"], fileids)
+
+
+def alertas(db):
+    with db.get_conn() as conn:
+        return conn.execute("SELECT fileid, subject, category FROM alerts ORDER BY fileid").fetchall()
+
+
+def fila_outbox(db, outbox_id):
+    with db.get_conn() as conn:
+        return conn.execute(
+            "SELECT estado, intentos, error, proximo FROM outbox WHERE id = ?", (outbox_id,)
+        ).fetchone()
+
+
+def test_reutiliza_una_conexion_y_registra_alertas(buzon, smtp, db_temporal):
+    crear, _ = buzon
+    ids = archivos(db_temporal, 20)
+    b = crear()
+    for i, fileid in enumerate(ids):
+        encolar(b, i, [fileid])
+
+    esperar(lambda: len(smtp[0].recibidos) == 20)
+    esperar(lambda: db_temporal.outbox_stats() == {"enviado": 20})
+    assert b.stats()["conexiones"] == 1
+    assert alertas(db_temporal) == [(f, f"Alerta {i}", "nuevo_pdf") for i, f in enumerate(ids)]
+
+
+def test_error_transitorio_se_reintenta(buzon, smtp, db_temporal):
+    servidor, _ = smtp
+    crear, resultados = buzon
+    servidor.rechazar = "421 Servicio no disponible"
+    (fileid,) = archivos(db_temporal, 1)
+    b = crear()
+    outbox_id = encolar(b, 1, [fileid])
+
+    esperar(lambda: (outbox_id, "REINTENTO") in resultados)
+    estado, intentos, error, proximo = fila_outbox(db_temporal, outbox_id)
+    assert estado == "pendiente" and intentos >= 1 and "421" in error
+    assert proximo > time.time() - 1
+    assert alertas(db_temporal) == []
+
+    servidor.rechazar = None
+    esperar(lambda: (outbox_id, "OK") in resultados)
+    assert fila_outbox(db_temporal, outbox_id)[0] == "enviado"
+    assert alertas(db_temporal) == [(fileid, "Alerta 1", "nuevo_pdf")]
+
+
+def test_error_permanente_no_se_reintenta(buzon, smtp, db_temporal):
+    servidor, _ = smtp
+    crear, resultados = buzon
+    servidor.rechazar = "550 Buzón inexistente"
+    b = crear()
+    outbox_id = encolar(b, 1, archivos(db_temporal, 1))
+
+    esperar(lambda: (outbox_id, "ERROR") in resultados)
+    time.sleep(0.5)
+    estado, intentos, error, _ = fila_outbox(db_temporal, outbox_id)
+    assert (estado, intentos) == ("fallido", 1) and "550" in error
+    assert servidor.recibidos == [] and alertas(db_temporal) == []
+
+
+def test_servidor_caido_pausa_la_cola(buzon, db_temporal):
+    crear, resultados = buzon
+    b = crear(port=puerto_libre())  # nadie escucha ahí
+    ids = [encolar(b, i) for i in range(3)]
+
+    esperar(lambda: any(estado == "REINTENTO" for _, estado in resultados))
+    # el primer fallo de conexión pausa la cola: el resto ni se intenta
+    intentos = sorted(fila_outbox(db_temporal, i)[1] for i in ids)
+    assert intentos[:2] == [0, 0]
+    assert b._pausa_hasta > time.time() - 1
+
+
+def test_espera_exponencial_con_tope(monkeypatch):
+    monkeypatch.setattr(correo_salida.random, "uniform", lambda a, b: 1.0)
+    monkeypatch.setattr(correo_salida, "REINTENTO_BASE", 5)
+    monkeypatch.setattr(correo_salida, "REINTENTO_MAX", 900)
+    assert [correo_salida._espera(n) for n in (1, 2, 3, 4)] == [5, 10, 20, 40]
+    assert correo_salida._espera(20) == 900
+
+
+@pytest.mark.parametrize(
+    "error, permanente, de_conexion",
+    [
+        (smtplib.SMTPRecipientsRefused({"a@b": (550, b"no")}), True, False),
+        (smtplib.SMTPRecipientsRefused({"a@b": (550, b"no"), "c@d": (421, b"luego")}), False, False),
+        (smtplib.SMTPDataError(552, b"muy grande"), True, False),
+        (smtplib.SMTPDataError(451, b"luego"), False, False),
+        (smtplib.SMTPAuthenticationError(535, b"clave"), False, True),
+        (smtplib.SMTPServerDisconnected("cerrada"), False, True),
+        (ConnectionRefusedError(), False, True),
+        (socket.gaierror("dns"), False, True),
+    ],
+)
+def test_clasificacion_de_errores(error, permanente, de_conexion):
+    assert correo_salida._permanente(error) is permanente
+    assert correo_salida._de_conexion(error) is de_conexion
+
+
+def test_enviado_y_alertas_en_la_misma_transaccion(db_temporal):
+    # el segundo fileid no existe: falla la FK de alerts y debe deshacerse todo
+    (fileid,) = archivos(db_temporal, 1)
+    outbox_id = db_temporal.outbox_agregar("A", "c", "w@l", "d@l", [fileid, fileid + 1000])
+    fila = db_temporal.outbox_listos(time.time() + 1)[0]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        db_temporal.outbox_enviado(fila)
+    assert fila_outbox(db_temporal, outbox_id)[0] == "pendiente"
+    assert alertas(db_temporal) == []
@@ -0,0 +1,172 @@
+# test_sharepoint_index.py
+# -- coding: utf-8 --
+# sharepoint_index contra un Graph falso: la sesión responde a cada URL con
+# las páginas delta grabadas en RUTAS.
+
+import pytest
+
+import sharepoint_index
+
+DRIVE = "D1"
+INICIAL = f"{sharepoint_index.GRAPH_BASE}/drives/{DRIVE}/root/delta"
+
+
+class Respuesta:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self._data = data or {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class GraphFalso:
+    """Sesión con .get(): cada URL devuelve la siguiente respuesta de su lista."""
+
+    def __init__(self, rutas):
+        self.rutas = {url: list(resps) for url, resps in rutas.items()}
+        self.pedidas = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.pedidas.append(url)
+        return self.rutas[url].pop(0)
+
+
+def carpeta(iid, nombre, padre):
+    return {"id": iid, "name": nombre, "folder": {}, "parentReference": {"id": padre}}
+
+
+def archivo(iid, nombre, padre, url=None):
+    it = {
+        "id": iid,
+        "name": nombre,
+        "file": {},
+        "parentReference": {"id": padre},
+        "lastModifiedDateTime": "2025-01-01T00:00:00Z",
+        "size": 10,
+    }
+    if url:
+        it["@microsoft.graph.downloadUrl"] = url
+    return it
+
+
+ENUMERACION = [
+    Respuesta(200, {
+        "value": [
+            {"id": "ROOT", "name": "root", "root": {}, "folder": {}},
+            carpeta("POL", "Pólizas", "ROOT"),
+            carpeta("A", "Cliente A", "POL"),
+            carpeta("A2", "2025", "A"),
+        ],
+        "@odata.nextLink": "https://graph/pagina2",
+    }),
+]
+PAGINA2 = Respuesta(200, {
+    "value": [
+        archivo("f1", "a.pdf", "A", "https://dl/f1"),
+        archivo("f2", "b.pdf", "A2", "https://dl/f2"),
+        archivo("f3", "suelto.pdf", "POL", "https://dl/f3"),
+        archivo("fuera", "otro.pdf", "ROOT", "https://dl/fuera"),
+    ],
+    "@odata.deltaLink": "https://graph/delta1",
+})
+
+
+def archivos(url_descarga=lambda iid: f"https://nueva/{iid}"):
+    return sorted(
+        ((carpeta_ or "", it["name"], it["@microsoft.graph.downloadUrl"])
+         for carpeta_, it in sharepoint_index.recorrer_archivos(DRIVE, "POL", url_descarga)),
+    )
+
+
+def test_enumeracion_inicial(db_temporal):
+    graph = GraphFalso({INICIAL: ENUMERACION, "https://graph/pagina2": [PAGINA2]})
+
+    assert sharepoint_index.sincronizar(DRIVE, {}, session=graph) == 8
+    assert sharepoint_index.listo(DRIVE)
+    assert db_temporal.sp_delta_get(DRIVE) == "https://graph/delta1"
+    assert archivos() == [
+        ("", "suelto.pdf", "https://dl/f3"),
+        ("Cliente A", "a.pdf", "https://dl/f1"),
+        ("Cliente A", "b.pdf", "https://dl/f2"),
+    ]
+
+
+def test_delta_incremental(db_temporal):
+    graph = GraphFalso({
+        INICIAL: ENUMERACION,
+        "https://graph/pagina2": [PAGINA2],
+        "https://graph/delta1": [Respuesta(200, {
+            "value": [
+                {"id": "f1", "deleted": {}},
+                archivo("f4", "nuevo.pdf", "A2", "https://dl/f4"),
+                carpeta("B", "Cliente B", "POL"),
+                archivo("f2", "b.pdf", "B", "https://dl/f2"),
+            ],
+            "@odata.deltaLink": "https://graph/delta2",
+        })],
+    })
+    sharepoint_index.sincronizar(DRIVE, {}, session=graph)
+
+    assert sharepoint_index.sincronizar(DRIVE, {}, session=graph) == 4
+    assert graph.pedidas[-1] == "https://graph/delta1"
+    assert db_temporal.sp_delta_get(DRIVE) == "https://graph/delta2"
+    assert archivos() == [
+        ("", "suelto.pdf", "https://dl/f3"),
+        ("Cliente A", "nuevo.pdf", "https://dl/f4"),
+        ("Cliente B", "b.pdf", "https://dl/f2"),
+    ]
+
+
+def test_delta_expirado_resincroniza(db_temporal):
+    graph = GraphFalso({
+        INICIAL: ENUMERACION + [Respuesta(200, {
+            "value": [
+                {"id": "ROOT", "name": "root", "root": {}, "folder": {}},
+                carpeta("POL", "Pólizas", "ROOT"),
+                archivo("f9", "unico.pdf", "POL", "https://dl/f9"),
+            ],
+            "@odata.deltaLink": "https://graph/delta-nuevo",
+        })],
+        "https://graph/pagina2": [PAGINA2],
+        "https://graph/delta1": [Respuesta(410)],
+    })
+    sharepoint_index.sincronizar(DRIVE, {}, session=graph)
+
+    assert sharepoint_index.sincronizar(DRIVE, {}, session=graph) == 3
+    assert graph.pedidas[-2:] == ["https://graph/delta1", INICIAL]
+    assert db_temporal.sp_delta_get(DRIVE) == "https://graph/delta-nuevo"
+    # lo que no volvió en la enumeración nueva ya no está en el índice
+    assert archivos() == [("", "unico.pdf", "https://dl/f9")]
+
+
+def test_url_vencida_se_reemplaza(db_temporal, monkeypatch):
+    graph = GraphFalso({INICIAL: ENUMERACION, "https://graph/pagina2": [PAGINA2]})
+    sharepoint_index.sincronizar(DRIVE, {}, session=graph)
+    pedidas = []
+
+    def url_descarga(iid):
+        pedidas.append(iid)
+        return f"https://nueva/{iid}"
+
+    ahora = sharepoint_index.time.time()
+    monkeypatch.setattr(
+        sharepoint_index.time, "time", lambda: ahora + sharepoint_index.DOWNLOAD_URL_TTL + 60
+    )
+    assert archivos(url_descarga) == [
+        ("", "suelto.pdf", "https://nueva/f3"),
+        ("Cliente A", "a.pdf", "https://nueva/f1"),
+        ("Cliente A", "b.pdf", "https://nueva/f2"),
+    ]
+    assert sorted(pedidas) == ["f1", "f2", "f3"]
+
+
+def test_error_de_graph_no_guarda_delta(db_temporal):
+    graph = GraphFalso({INICIAL: [Respuesta(503)]})
+    with pytest.raises(RuntimeError):
+        sharepoint_index.sincronizar(DRIVE, {}, session=graph)
+    assert not sharepoint_index.listo(DRIVE)
@@ -3,8 +3,16 @@
 from pathlib import Path
 import time
 import os
-import smtplib
-from email.mime.text import MIMEText
+import threading
+from typing import Optional
+
+import requests
+
+import cola_eventos
+import correo_salida
+import db
+import hashing
+import registro
 
 from dotenv import load_dotenv
 from watchdog.observers import Observer
@@ -17,16 +25,31 @@ SMTP_HOST = os.getenv("SMTP_HOST", "")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASS = os.getenv("SMTP_PASS", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1").lower() in ("1", "true", "si", "sí")
 MAIL_FROM = os.getenv("MAIL_FROM", SMTP_USER or "watcher@localhost")
 MAIL_TO = os.getenv("MAIL_TO", "")
 MAIL_SUBJECT_PREFIX = os.getenv("MAIL_SUBJECT_PREFIX", "[Watcher PDFs]")
 
+# Endpoint de la app web que invalida la caché de /polizas (opcional)
+POLIZAS_INVALIDAR_URL = os.getenv("POLIZAS_INVALIDAR_URL", "")
+POLIZAS_WEBHOOK_SECRET = os.getenv("POLIZAS_WEBHOOK_SECRET", "")
+
 # Carpeta real de pólizas (ajusta si cambia el path)
 RUTA_POLIZAS = Path(
     r"C:\Users\EdsonLazo\Comercial y Servicios Cruz del Sur\Gestion - Documentos\Seguros\Pólizas"
 )
 
-LOG_FILE = Path("log_polizas.txt")  # registro simple en texto
+LOG_FILE = Path(os.getenv("WATCHER_LOG", "log_polizas.jsonl"))  # una línea JSON por evento
+CATEGORIA_ALERTA = "nuevo_pdf"
+
+HASHER = hashing.ServicioHash(max_workers=2)
+
+# Modo resumen: junta los PDFs asentados durante WATCHER_DIGEST_VENTANA
+# segundos (o hasta WATCHER_DIGEST_MAX archivos) y envía un solo correo
+# agrupado por subcarpeta, en vez de una sesión SMTP por archivo.
+DIGEST = os.getenv("WATCHER_DIGEST", "0").lower() in ("1", "true", "si", "sí")
+DIGEST_VENTANA = float(os.getenv("WATCHER_DIGEST_VENTANA", "60"))
+DIGEST_MAX = int(os.getenv("WATCHER_DIGEST_MAX", "200"))
 
 
 def _destinatarios():
@@ -36,12 +59,54 @@ def _destinatarios():
     return [t.strip() for t in raw.split(",") if t.strip()]
 
 
-def enviar_correo_alerta(path: Path) -> tuple[bool, str]:
+def _asunto(path: Path) -> str:
+    return f"{MAIL_SUBJECT_PREFIX} Nuevo PDF: {path.name}"
+
+
+def _asunto_resumen(n: int) -> str:
+    return f"{MAIL_SUBJECT_PREFIX} {n} PDFs nuevos"
+
+
+_BUZON: Optional[correo_salida.BuzonSalida] = None
+_BUZON_LOCK = threading.Lock()
+
+
+def _registrar_envio(fila: dict, estado: str, detalle: str) -> None:
+    escribir_log(
+        estado,
+        evento="smtp",
+        smtp=estado,
+        correo=fila["id"],
+        duracion_ms=fila.get("duracion_ms"),
+        intentos=fila["intentos"] + 1,
+        fileids=",".join(map(str, fila["fileids"])),
+        asunto=fila["asunto"],
+        detalle=detalle,
+    )
+
+
+def buzon() -> correo_salida.BuzonSalida:
+    """Buzón de salida compartido (se crea con el primer correo)."""
+    global _BUZON
+    with _BUZON_LOCK:
+        if _BUZON is None:
+            conexion = correo_salida.ConexionSMTP(
+                SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, starttls=SMTP_STARTTLS
+            )
+            _BUZON = correo_salida.BuzonSalida(conexion, al_resultado=_registrar_envio)
+        return _BUZON
+
+
+def _enviar_correo(asunto: str, cuerpo: str, fileids=()) -> tuple[bool, str]:
+    """Deja el correo en el outbox; las alertas de `fileids` se registran al enviarse."""
     tos = _destinatarios()
     if not tos:
         return False, "MAIL_TO vacío; revisa .env"
+    outbox_id = buzon().encolar(asunto, cuerpo, MAIL_FROM, tos, fileids, CATEGORIA_ALERTA)
+    return True, f"Correo encolado (outbox {outbox_id})"
+
 
-    asunto = f"{MAIL_SUBJECT_PREFIX} Nuevo PDF: {path.name}"
+def enviar_correo_alerta(path: Path, fileids=()) -> tuple[bool, str]:
     cuerpo = (
         "Se ha detectado un archivo PDF en la carpeta de pólizas.\n\n"
         f"Nombre: {path.name}\n"
@@ -49,57 +114,238 @@ def enviar_correo_alerta(path: Path) -> tuple[bool, str]:
         f"Tamaño: {path.stat().st_size if path.exists() else 'N/A'} bytes\n"
         f"Fecha: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
     )
+    return _enviar_correo(_asunto(path), cuerpo, fileids)
+
+
+def _subcarpeta(path: Path) -> str:
+    try:
+        rel = path.parent.relative_to(RUTA_POLIZAS)
+    except ValueError:
+        return str(path.parent)
+    return str(rel) if str(rel) != "." else "(raíz)"
+
+
+def enviar_correo_resumen(paths: list[Path], fileids=()) -> tuple[bool, str]:
+    """Un solo correo con todos los PDFs, agrupados por subcarpeta."""
+    por_carpeta: dict[str, list[Path]] = {}
+    for p in paths:
+        por_carpeta.setdefault(_subcarpeta(p), []).append(p)
 
-    msg = MIMEText(cuerpo, _charset="utf-8")
-    msg["Subject"] = asunto
-    msg["From"] = MAIL_FROM
-    msg["To"] = ", ".join(tos)
+    lineas = [
+        f"Se han detectado {len(paths)} archivos PDF en la carpeta de pólizas.",
+        f"Fecha: {time.strftime('%Y-%m-%d %H:%M:%S')}",
+        "",
+    ]
+    for carpeta in sorted(por_carpeta):
+        archivos = sorted(por_carpeta[carpeta], key=lambda p: p.name.lower())
+        lineas.append(f"{carpeta} ({len(archivos)})")
+        for p in archivos:
+            try:
+                tam = p.stat().st_size
+            except OSError:
+                tam = "N/A"
+            lineas.append(f"  - {p.name} ({tam} bytes)")
+        lineas.append("")
+    return _enviar_correo(_asunto_resumen(len(paths)), "\n".join(lineas), fileids)
 
+
+def invalidar_cache_web() -> None:
+    """Avisa a la app web que cambió la carpeta (mejor esfuerzo)."""
+    if not POLIZAS_INVALIDAR_URL:
+        return
     try:
-        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20)
-        server.ehlo()
-        server.starttls()
-        server.ehlo()
-        if SMTP_USER:
-            server.login(SMTP_USER, SMTP_PASS)
-        server.sendmail(MAIL_FROM, tos, msg.as_string())
-        server.quit()
-        return True, "Correo enviado"
+        requests.post(
+            POLIZAS_INVALIDAR_URL,
+            headers={"X-Webhook-Secret": POLIZAS_WEBHOOK_SECRET},
+            timeout=5,
+        )
     except Exception as e:
-        return False, f"Error SMTP: {e}"
+        print("No se pudo invalidar la caché web:", e)
+
+
+_REGISTRO: Optional[registro.Registro] = None
+_LOG_LOCK = threading.Lock()
+
+
+def escribir_log(estado: str, **campos) -> None:
+    """Encola una línea JSON para LOG_FILE (y la muestra en consola)."""
+    global _REGISTRO
+    if _REGISTRO is None:
+        with _LOG_LOCK:
+            if _REGISTRO is None:
+                _REGISTRO = registro.Registro(LOG_FILE)
+    _REGISTRO.registrar(estado, **campos)
+
 
+def cerrar_log() -> None:
+    global _REGISTRO
+    with _LOG_LOCK:
+        if _REGISTRO is not None:
+            _REGISTRO.cerrar()
+            _REGISTRO = None
 
-def escribir_log(texto: str) -> None:
-    linea = f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {texto}\n"
-    LOG_FILE.write_text(LOG_FILE.read_text(encoding="utf-8") + linea if LOG_FILE.exists() else linea,
-                        encoding="utf-8")
-    print(linea, end="")  # también a la consola
+
+# fileids con una alerta en curso: dos copias del mismo PDF procesadas en
+# paralelo no deben pasar ambas el chequeo de alert_exists_for_file
+_EN_CURSO: set[int] = set()
+_EN_CURSO_LOCK = threading.Lock()
+
+
+def procesar_pdf(path: Path, evento: str) -> None:
+    """Procesa un PDF ya asentado (corre en el pool de cola_eventos)."""
+    if not path.is_file():
+        return
+    inicio = time.perf_counter()
+
+    # Una sola alerta por contenido: re-guardados, copias y la sincronización
+    # de OneDrive generan varios eventos para el mismo PDF.
+    try:
+        sha256, size, mtime_ns, _ = HASHER.huella(path)
+        fileid = db.upsert_file(path, sha256, size, mtime_ns)
+    except OSError as e:
+        escribir_log(
+            "ERROR", evento=evento, path=path, duracion_ms=registro.duracion_ms(inicio),
+            detalle=f"No se pudo leer: {e}",
+        )
+        return
+
+    with _EN_CURSO_LOCK:
+        duplicado = (
+            fileid in _EN_CURSO
+            or db.alert_exists_for_file(fileid, CATEGORIA_ALERTA)
+            or db.outbox_pendiente_para(fileid, CATEGORIA_ALERTA)
+        )
+        if not duplicado:
+            _EN_CURSO.add(fileid)
+    if duplicado:
+        escribir_log(
+            "DUPLICADO", evento=evento, path=path, duracion_ms=registro.duracion_ms(inicio),
+            sha256=sha256[:12],
+        )
+        return
+
+    if RESUMEN is not None:
+        # el fileid queda en _EN_CURSO hasta que salga el correo resumen
+        RESUMEN.agregar(fileid, path, evento)
+        return
+
+    try:
+        ok, msg = enviar_correo_alerta(path, [fileid])
+        estado = "ENCOLADO" if ok else "ERROR"
+    finally:
+        with _EN_CURSO_LOCK:
+            _EN_CURSO.discard(fileid)
+    escribir_log(estado, evento=evento, path=path, duracion_ms=registro.duracion_ms(inicio), detalle=msg)
+    invalidar_cache_web()
+
+
+class ResumenAlertas:
+    """
+    Acumula PDFs ya deduplicados y los envía en un correo resumen cuando pasan
+    `ventana` segundos desde el primero o se juntan `max_archivos`. Cada
+    archivo conserva su propia fila en db.alerts.
+    """
+
+    def __init__(self, ventana: float = DIGEST_VENTANA, max_archivos: int = DIGEST_MAX):
+        self.ventana = ventana
+        self.max_archivos = max_archivos
+        self._cond = threading.Condition()
+        self._items: list[tuple[int, Path, str]] = []
+        self._desde = 0.0
+        self._activo = True
+        self.enviados = 0
+        self._hilo = threading.Thread(target=self._bucle, name="watcher-resumen", daemon=True)
+        self._hilo.start()
+
+    def agregar(self, fileid: int, path: Path, evento: str) -> None:
+        with self._cond:
+            if not self._items:
+                self._desde = time.monotonic()
+            self._items.append((fileid, path, evento))
+            # el primero arranca la ventana (el hilo esperaba sin plazo)
+            if len(self._items) == 1 or len(self._items) >= self.max_archivos:
+                self._cond.notify()
+
+    def _bucle(self) -> None:
+        while True:
+            with self._cond:
+                while self._activo:
+                    if self._items:
+                        restante = self._desde + self.ventana - time.monotonic()
+                        if restante <= 0 or len(self._items) >= self.max_archivos:
+                            break
+                        self._cond.wait(timeout=restante)
+                    else:
+                        self._cond.wait()
+                items, self._items = self._items, []
+                activo = self._activo
+            if items:
+                try:
+                    self._enviar(items)
+                except Exception as e:
+                    # el hilo no debe morir: los siguientes resúmenes siguen saliendo
+                    print("[RESUMEN] Error al procesar el resumen:", e)
+            if not activo:
+                return
+
+    def _enviar(self, items: list[tuple[int, Path, str]]) -> None:
+        inicio = time.perf_counter()
+        fileids = [fileid for fileid, _, _ in items]
+        try:
+            ok, msg = enviar_correo_resumen([path for _, path, _ in items], fileids)
+            if ok:
+                self.enviados += 1
+        except Exception as e:
+            # ej. db.outbox_agregar con la base bloqueada: sin alerta registrada,
+            # un próximo evento de estos PDFs vuelve a intentarlo
+            ok, msg = False, f"No se pudo encolar el resumen: {e}"
+        finally:
+            with _EN_CURSO_LOCK:
+                _EN_CURSO.difference_update(fileids)
+        estado = "ENCOLADO" if ok else "ERROR"
+        duracion = registro.duracion_ms(inicio)
+        for _, path, evento in items:
+            escribir_log(estado, evento=evento, path=path, duracion_ms=duracion, resumen=len(items), detalle=msg)
+        invalidar_cache_web()
+
+    def detener(self) -> None:
+        """Envía lo pendiente y termina el hilo."""
+        with self._cond:
+            self._activo = False
+            self._cond.notify()
+        self._hilo.join()
+
+
+RESUMEN: Optional[ResumenAlertas] = None
 
 
 class HandlerPolizas(FileSystemEventHandler):
-    def _procesar(self, path_str: str, evento: str):
-        path = Path(path_str)
-        if not path.is_file():
-            return
-        if path.suffix.lower() != ".pdf":
-            return
+    """Solo encola: el hilo del observer nunca espera ni envía correos."""
 
-        # pequeña espera para que termine de copiarse
-        time.sleep(1.0)
+    def __init__(self, cola: cola_eventos.ColaEstable):
+        super().__init__()
+        self.cola = cola
 
-        ok, msg = enviar_correo_alerta(path)
-        estado = "OK" if ok else "ERROR"
-        escribir_log(f"{estado} | evento={evento} | archivo={path} | detalle={msg}")
+    def _encolar(self, path_str: str, evento: str):
+        if Path(path_str).suffix.lower() != ".pdf":
+            return
+        self.cola.agregar(path_str, evento)
 
     def on_created(self, event):
         if event.is_directory:
             return
-        self._procesar(event.src_path, "created")
+        self._encolar(event.src_path, "created")
 
     def on_modified(self, event):
         if event.is_directory:
             return
-        self._procesar(event.src_path, "modified")
+        self._encolar(event.src_path, "modified")
+
+    def on_moved(self, event):
+        # OneDrive y muchos programas guardan en un temporal y luego renombran
+        if event.is_directory:
+            return
+        self._encolar(event.dest_path, "moved")
 
 
 def main():
@@ -107,8 +353,15 @@ def main():
         print(f"La carpeta de pólizas NO existe: {RUTA_POLIZAS}")
         return
 
+    db.initdb()
     print(f"Vigilando pólizas y subcarpetas: {RUTA_POLIZAS}")
-    event_handler = HandlerPolizas()
+    buzon()  # reintenta lo que haya quedado en el outbox
+    global RESUMEN
+    if DIGEST:
+        RESUMEN = ResumenAlertas()
+        print(f"Modo resumen: cada {DIGEST_VENTANA:.0f}s o {DIGEST_MAX} archivos")
+    cola = cola_eventos.ColaEstable(procesar_pdf)
+    event_handler = HandlerPolizas(cola)
     observer = Observer()
     observer.schedule(event_handler, str(RUTA_POLIZAS), recursive=True)
     observer.start()
@@ -120,6 +373,11 @@ def main():
         print("\nDeteniendo watcher...")
         observer.stop()
     observer.join()
+    cola.detener()
+    if RESUMEN is not None:
+        RESUMEN.detener()
+    buzon().detener()
+    cerrar_log()
 
 
 if __name__ == "__main__":